@@ -0,0 +1,220 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Runtime analytics for the Trane Home plugin.
+#
+# Each poll gives the current value of a few signals per device: compressor, blower, heating and cooling for a
+# thermostat, calling and heat/cool demand for a zone, and the outdoor temperature.  The value seen at one poll
+# is taken to hold until the next, and that interval is added to hourly buckets for the last 24 hours and daily
+# buckets for the last 7 days, with running sums for the 24 hour window.  Each poll costs the same no matter how
+# long the plugin has been running, and no samples are kept.  Gaps longer than max_gap (plugin stopped, Nexia
+# not answering) are not counted, the plugin sets it from its poll interval.  The buckets are saved to a JSON file and loaded again at startup.
+####################
+
+import datetime
+import json
+import logging
+import time
+
+from atomic_file import write_atomic
+
+MAX_GAP = 30 * 60.0     # default for the longest time between polls that is still counted
+HOURS = 24              # hourly buckets, the 24 hour window
+DAYS = 7                # daily buckets, today and the 6 days before
+MIN_DAYS = 3            # completed days needed before runtime is compared with the outdoor temperature
+MIN_SEEN = 3600.0       # seconds observed before a 24 hour mean is reported, a few minutes of data is only noise
+KEEP = 8 * 24 * 3600.0  # devices not polled for this long are dropped when saving
+
+
+def local_day(ts):
+    return datetime.date.fromtimestamp(ts).toordinal()
+
+
+def next_boundary(ts):
+    # the next full hour or local midnight after ts, whichever comes first
+    hour = (int(ts // 3600.0) + 1) * 3600.0
+    midnight = datetime.datetime.combine(datetime.date.fromordinal(local_day(ts) + 1), datetime.time()).timestamp()
+    return min(hour, midnight)
+
+
+class Series:
+    # One signal of one device.  'on' buckets hold the signal integrated over time (seconds it was on for a
+    # flag, degree seconds for a temperature), 'seen' buckets the seconds it was observed.
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.hour = data.get("hour")                # number of the newest hour bucket, hours since the epoch
+        self.hour_on = data.get("hour_on", [0.0] * HOURS)
+        self.hour_seen = data.get("hour_seen", [0.0] * HOURS)
+        self.day = data.get("day")                  # local date ordinal of the newest day bucket
+        self.day_on = data.get("day_on", [0.0] * DAYS)
+        self.day_seen = data.get("day_seen", [0.0] * DAYS)
+        self.on_24h = sum(self.hour_on)
+        self.seen_24h = sum(self.hour_seen)
+
+    def to_json(self):
+        return {"hour": self.hour, "hour_on": self.hour_on, "hour_seen": self.hour_seen,
+                "day": self.day, "day_on": self.day_on, "day_seen": self.day_seen}
+
+    def add(self, start, end, value):
+        # add value held from start to end, split at hour and day boundaries
+        while start < end:
+            stop = min(end, next_boundary(start))
+            self.advance(start)
+            seconds = stop - start
+            index = self.hour % HOURS
+            self.hour_on[index] += value * seconds
+            self.hour_seen[index] += seconds
+            self.on_24h += value * seconds
+            self.seen_24h += seconds
+            self.day_on[self.day % DAYS] += value * seconds
+            self.day_seen[self.day % DAYS] += seconds
+            start = stop
+
+    def advance(self, ts):
+        # move the newest buckets up to ts, clearing the ones that fall out of the windows
+        hour = int(ts // 3600.0)
+        if self.hour is None or hour - self.hour >= HOURS:
+            self.hour_on = [0.0] * HOURS
+            self.hour_seen = [0.0] * HOURS
+            self.on_24h = self.seen_24h = 0.0
+        else:
+            for expired in range(self.hour + 1, hour + 1):
+                index = expired % HOURS
+                self.on_24h -= self.hour_on[index]
+                self.seen_24h -= self.hour_seen[index]
+                self.hour_on[index] = self.hour_seen[index] = 0.0
+        self.hour = max(hour, self.hour or hour)
+
+        day = local_day(ts)
+        if self.day is None or day - self.day >= DAYS:
+            self.day_on = [0.0] * DAYS
+            self.day_seen = [0.0] * DAYS
+        else:
+            for expired in range(self.day + 1, day + 1):
+                self.day_on[expired % DAYS] = self.day_seen[expired % DAYS] = 0.0
+        self.day = max(day, self.day or day)
+
+    def day_total(self, days_ago=0):
+        # the 'on' total of today or an earlier day still in the buckets, None if nothing was seen that day
+        if self.day is None or days_ago >= DAYS or not self.day_seen[(self.day - days_ago) % DAYS]:
+            return None
+        return self.day_on[(self.day - days_ago) % DAYS]
+
+    def day_mean(self, days_ago=0):
+        if self.day is None or days_ago >= DAYS or not self.day_seen[(self.day - days_ago) % DAYS]:
+            return None
+        return self.day_on[(self.day - days_ago) % DAYS] / self.day_seen[(self.day - days_ago) % DAYS]
+
+    def week_total(self):
+        return sum(self.day_on)
+
+    def mean_24h(self):
+        return self.on_24h / self.seen_24h if self.seen_24h >= MIN_SEEN else None
+
+
+class RuntimeAnalytics:
+
+    def __init__(self, path, max_gap=MAX_GAP):
+        self.logger = logging.getLogger("Plugin.analytics")
+        self.path = path
+        self.max_gap = max_gap
+        self.devices = {}       # device id -> {'ts': time of the last poll, 'values': {signal: value}, 'series': {signal: Series}}
+
+    def record(self, dev_id, values, ts=None):
+        # values is {signal: number} at this poll, a flag as 1.0 or 0.0.  Signals missing here aren't counted until the next poll.
+        ts = ts or time.time()
+        device = self.devices.setdefault(dev_id, {'ts': None, 'values': {}, 'series': {}})
+        if device['ts'] is not None and 0.0 < ts - device['ts'] <= self.max_gap:
+            for signal, value in device['values'].items():
+                series = device['series'].get(signal)
+                if series is None:
+                    series = device['series'][signal] = Series()
+                series.add(device['ts'], ts, value)
+        for series in device['series'].values():
+            series.advance(ts)
+        device['ts'] = ts
+        device['values'] = {signal: float(value) for signal, value in values.items() if value is not None}
+
+    def series(self, dev_id, signal):
+        return self.devices.get(dev_id, {}).get('series', {}).get(signal) or Series()
+
+    def thermostat_states(self, dev_id):
+        compressor = self.series(dev_id, 'compressor')
+        blower = self.series(dev_id, 'blower')
+        outdoor = self.series(dev_id, 'outdoor')
+        return [
+            {'key': "runtime_today_minutes", 'value': minutes(compressor.day_total(0))},
+            {'key': "runtime_yesterday_minutes", 'value': minutes(compressor.day_total(1))},
+            {'key': "runtime_week_hours", 'value': round(compressor.week_total() / 3600.0, 1)},
+            {'key': "duty_cycle_24h", 'value': percent(compressor.mean_24h())},
+            {'key': "heating_today_minutes", 'value': minutes(self.series(dev_id, 'heating').day_total(0))},
+            {'key': "cooling_today_minutes", 'value': minutes(self.series(dev_id, 'cooling').day_total(0))},
+            {'key': "blower_today_minutes", 'value': minutes(blower.day_total(0))},
+            {'key': "blower_duty_cycle_24h", 'value': percent(blower.mean_24h())},
+            {'key': "outdoor_temperature_avg_24h", 'value': round(outdoor.mean_24h(), 1) if outdoor.mean_24h() is not None else ""},
+            {'key': "runtime_outdoor_slope", 'value': self.outdoor_slope(compressor, outdoor)},
+        ]
+
+    def zone_states(self, dev_id):
+        calling = self.series(dev_id, 'calling')
+        return [
+            {'key': "calling_today_minutes", 'value': minutes(calling.day_total(0))},
+            {'key': "calling_week_hours", 'value': round(calling.week_total() / 3600.0, 1)},
+            {'key': "duty_cycle_24h", 'value': percent(calling.mean_24h())},
+            {'key': "heat_demand_today_minutes", 'value': minutes(self.series(dev_id, 'heat_demand').day_total(0))},
+            {'key': "cool_demand_today_minutes", 'value': minutes(self.series(dev_id, 'cool_demand').day_total(0))},
+        ]
+
+    @staticmethod
+    def outdoor_slope(compressor, outdoor):
+        # Least squares slope of the daily runtime (minutes) against the day's mean outdoor temperature, over the
+        # completed days in the buckets.  Negative when colder days need more heating.  "" until there is enough data.
+        points = []
+        for days_ago in range(1, DAYS):
+            runtime, temperature = compressor.day_total(days_ago), outdoor.day_mean(days_ago)
+            if runtime is not None and temperature is not None:
+                points.append((temperature, runtime / 60.0))
+        if len(points) < MIN_DAYS:
+            return ""
+        mean_x = sum(x for x, _y in points) / len(points)
+        mean_y = sum(y for _x, y in points) / len(points)
+        spread = sum((x - mean_x) ** 2 for x, _y in points)
+        if spread == 0.0:
+            return ""
+        return round(sum((x - mean_x) * (y - mean_y) for x, y in points) / spread, 1)
+
+    def forget(self, dev_id):
+        self.devices.pop(dev_id, None)
+
+    def to_json(self):
+        # called in the event loop, the result can be written from another thread
+        cutoff = time.time() - KEEP
+        return {str(dev_id): {'ts': device['ts'], 'values': device['values'],
+                              'series': {signal: series.to_json() for signal, series in device['series'].items()}}
+                for dev_id, device in self.devices.items() if device['ts'] and device['ts'] > cutoff}
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            self.logger.warning(f"Unable to read runtime analytics, starting over: {e!r}")
+            return
+        for dev_id, device in data.items():
+            self.devices[int(dev_id)] = {'ts': device['ts'], 'values': device['values'],
+                                         'series': {signal: Series(series) for signal, series in device['series'].items()}}
+
+    def save(self, data):
+        write_atomic(self.path, json.dumps(data))
+
+
+# Whole minutes and percent, so the states only change (and are only pushed to Indigo) when something ran for a while
+def minutes(seconds):
+    return round(seconds / 60.0) if seconds is not None else 0
+
+
+def percent(fraction):
+    return round(fraction * 100.0) if fraction is not None else ""
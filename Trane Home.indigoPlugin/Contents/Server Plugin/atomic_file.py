@@ -0,0 +1,19 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Atomic file writes for the Trane Home plugin.
+#
+# The snapshots, the runtime analytics and the metrics file are written to a temporary file next to the real
+# one, which is then renamed over it.  A crash never leaves a truncated file behind and a reader, like a
+# Prometheus scraper, sees either the old or the new contents.
+####################
+
+import os
+
+
+def write_atomic(path, text):
+    # Blocking, call it from a worker thread when the file may be large
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(text)
+    os.replace(temp_path, path)
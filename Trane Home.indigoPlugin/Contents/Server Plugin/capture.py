@@ -0,0 +1,103 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Snapshot capture for the Trane Home plugin.
+#
+# Each house snapshot fetched from Nexia is appended as one JSON line to a gzip file in the capture folder.
+# A file is closed and a new one started once it reaches FILE_SIZE compressed bytes, and the oldest files are
+# deleted when the folder holds more than MAX_BYTES.  Every record is flushed to disk as it is written, so a
+# capture can be read while it is still growing or after a crash.
+####################
+
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+FILE_SIZE = 8 * 1024 * 1024         # compressed bytes per capture file
+MAX_BYTES = 64 * 1024 * 1024        # compressed bytes kept in the capture folder
+PREFIX = "capture-"
+SUFFIX = ".jsonl.gz"
+
+
+def capture_files(folder):
+    # capture file names in the folder, oldest first
+    try:
+        names = [name for name in os.listdir(folder) if name.startswith(PREFIX) and name.endswith(SUFFIX)]
+    except FileNotFoundError:
+        return []
+    return sorted(names, key=lambda name: (os.path.getmtime(os.path.join(folder, name)), name))
+
+
+def read_capture(path):
+    # Yields the records of a capture file in order.  A record cut off by a crash ends the file quietly.
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    return
+        except (EOFError, zlib.error):
+            return
+
+
+class CaptureWriter:
+
+    def __init__(self, folder, file_size=FILE_SIZE, max_bytes=MAX_BYTES):
+        self.logger = logging.getLogger("Plugin.capture")
+        self.folder = folder
+        self.file_size = file_size
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()        # written from worker threads, closed from the plugin
+        self.raw = None                     # the open file, its position is the compressed size so far
+        self.gzip = None
+        self.path = None
+        self.records = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def write(self, account_id, house_json, ts=None):
+        # Append one snapshot.  Blocking, run it in a worker thread.
+        line = json.dumps({"ts": ts or time.time(), "account": account_id, "house_json": house_json}, separators=(',', ':'))
+        with self.lock:
+            if self.gzip is None:
+                self.open_file()
+            self.gzip.write(line.encode("utf-8") + b"\n")
+            self.gzip.flush(zlib.Z_SYNC_FLUSH)
+            self.records += 1
+            if self.raw.tell() >= self.file_size:
+                self.close_file()
+                self.prune()
+
+    def open_file(self):
+        now = time.time()
+        name = f"{PREFIX}{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}{SUFFIX}"
+        self.path = os.path.join(self.folder, name)
+        self.raw = open(self.path, "ab")
+        self.gzip = gzip.GzipFile(fileobj=self.raw, mode="ab")
+        self.logger.debug("capturing snapshots to %s", self.path)
+
+    def close_file(self):
+        if self.gzip is not None:
+            self.gzip.close()
+            self.raw.close()
+            self.gzip = self.raw = None
+
+    def prune(self):
+        # delete the oldest files until the folder is within max_bytes, never the file being written
+        files = [os.path.join(self.folder, name) for name in capture_files(self.folder)]
+        sizes = {path: os.path.getsize(path) for path in files}
+        total = sum(sizes.values())
+        for path in files:
+            if total <= self.max_bytes or path == self.path and self.gzip is not None:
+                break
+            os.remove(path)
+            total -= sizes[path]
+            self.logger.debug("deleted old capture %s", path)
+
+    def close(self):
+        with self.lock:
+            self.close_file()
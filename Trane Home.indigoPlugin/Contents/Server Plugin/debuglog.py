@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Structured debug log for the Trane Home plugin.
+#
+# Records from the plugin's loggers are written as JSON lines to a file of their own, rotated at FILE_SIZE.
+# The calling thread only filters the record, formats its message and puts it on a queue; a listener thread
+# does the JSON encoding and the file writes, so the poll loop doesn't wait for the disk.  With a sample rate
+# of N, only the first record and every Nth after it from each logging call site are kept, so a busy debug
+# message can't flood the file.  Warnings and errors are always kept.
+####################
+
+import json
+import logging
+import logging.handlers
+import queue
+
+FILE_SIZE = 8 * 1024 * 1024     # bytes per log file
+BACKUPS = 3                     # rotated files kept
+
+
+class JsonLinesFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "func": record.funcName,
+            "line": record.lineno,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        return json.dumps(entry, default=repr)
+
+
+class SampleFilter(logging.Filter):
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = max(1, rate)
+        self.counts = {}        # call site -> records seen from it
+
+    def filter(self, record):
+        if self.rate == 1 or record.levelno >= logging.WARNING:
+            return True
+        # The template of a %-style message tells call sites apart that go through a wrapper like threaddebug
+        site = (record.pathname, record.lineno, record.msg if record.args else None)
+        count = self.counts.get(site, 0)
+        self.counts[site] = count + 1
+        return count % self.rate == 0
+
+
+class DebugLog:
+
+    def __init__(self, path, level=logging.DEBUG, sample=1):
+        self.path = path
+        self.level = level
+        self.sample = sample
+        file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=FILE_SIZE, backupCount=BACKUPS, encoding="utf-8")
+        file_handler.setFormatter(JsonLinesFormatter())
+        self.queue = queue.SimpleQueue()
+        self.handler = logging.handlers.QueueHandler(self.queue)
+        self.handler.setLevel(level)
+        self.handler.addFilter(SampleFilter(sample))
+        self.listener = logging.handlers.QueueListener(self.queue, file_handler)
+        self.listener.start()
+
+    def close(self):
+        # writes the records still queued, then closes the file
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
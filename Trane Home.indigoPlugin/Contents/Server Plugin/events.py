@@ -0,0 +1,45 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Change detection for the Trane Home plugin's events.
+#
+# After every fetch a handful of watched values are read from each thermostat and zone and compared with the
+# values from that device's previous fetch.  Only values that actually changed are reported, so the plugin can
+# fire its Indigo triggers (Events.xml) without automations watching individual device states.  The first fetch
+# after a device starts only records the values.
+####################
+
+# watched values, field -> getter(thermostat, zone)
+THERMOSTAT_WATCHED = {
+    'system_status': lambda thermostat, _zone: thermostat.get_system_status(),
+    'online': lambda thermostat, _zone: thermostat.is_online,       # a property
+}
+
+ZONE_WATCHED = {
+    'calling': lambda _thermostat, zone: zone.is_calling(),
+    'setpointHeat': lambda _thermostat, zone: zone.get_heating_setpoint(),
+    'setpointCool': lambda _thermostat, zone: zone.get_cooling_setpoint(),
+}
+
+
+class ChangeDetector:
+
+    def __init__(self):
+        self.previous = {}      # device id -> {field: value} from the device's last fetch
+
+    def changes(self, dev_id, watched, thermostat, zone=None):
+        # {field: (old value, new value)} for the watched fields that changed since the last call for this device
+        current = {}
+        for field, getter in watched.items():
+            try:
+                current[field] = getter(thermostat, zone)
+            except (KeyError, TypeError, AttributeError):
+                current[field] = None       # missing from this thermostat's JSON
+        previous = self.previous.get(dev_id)
+        self.previous[dev_id] = current
+        if previous is None:
+            return {}
+        return {field: (previous.get(field), value) for field, value in current.items() if previous.get(field) != value}
+
+    def forget(self, dev_id):
+        self.previous.pop(dev_id, None)
@@ -0,0 +1,53 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Read-only view of the Nexia houses for the Trane Home plugin.
+#
+# The nexia library objects belong to the plugin's event loop, an update replaces their JSON while it runs.
+# After each update the event loop copies what Indigo's callbacks need (names, ids, capabilities, fan modes and presets)
+# into these immutable tuples and mappings, and publishes them by replacing one attribute.  Dialogs and actions
+# on Indigo's threads read the published view, so they never wait for the network or see a half-updated house.
+####################
+
+from collections import namedtuple
+from types import MappingProxyType
+
+# thermostats and zones are keyed by their id as a string, the way device props hold them.  The views keep the
+# library's own ids, which are ints for XL models and strings for others.
+HouseView = namedtuple("HouseView", "name thermostats")
+ThermostatView = namedtuple("ThermostatView", "thermostat_id name has_air_cleaner has_dehumidify_support has_variable_fan_speed fan_modes zones")
+ZoneView = namedtuple("ZoneView", "zone_id name presets")
+
+NO_HOUSES = MappingProxyType({})
+
+
+def zone_view(zone):
+    return ZoneView(zone.zone_id, zone.get_name(), tuple(zone.get_presets()))
+
+
+def thermostat_view(thermostat):
+    return ThermostatView(
+        thermostat.thermostat_id,
+        thermostat.get_name(),
+        thermostat.has_air_cleaner(),
+        thermostat.has_dehumidify_support(),
+        thermostat.has_variable_fan_speed(),
+        tuple(thermostat.get_fan_modes()),
+        MappingProxyType({str(zone.zone_id): zone_view(zone) for zone in thermostat.zones}),
+    )
+
+
+def house_view(nexia_home):
+    # Only call this in the event loop, between updates of nexia_home
+    thermostats = {str(thermostat.thermostat_id): thermostat_view(thermostat) for thermostat in nexia_home.thermostats or []}
+    return HouseView(nexia_home.get_name(), MappingProxyType(thermostats))
+
+
+def replace_house(houses, account_id, house):
+    # A new houses mapping with the account's house replaced, or removed if house is None.  The old one is unchanged.
+    houses = dict(houses)
+    if house is None:
+        houses.pop(account_id, None)
+    else:
+        houses[account_id] = house
+    return MappingProxyType(houses)
@@ -0,0 +1,172 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Timing histograms and counters for the Trane Home plugin.
+#
+# Everything is kept in memory in fixed buckets, so recording is cheap enough for the poll and action paths.
+# The registry can be written to the log as a summary, or in the Prometheus text format for the
+# node_exporter textfile collector or any other scraper.
+####################
+
+import threading
+import time
+from contextlib import contextmanager
+
+from atomic_file import write_atomic
+
+PREFIX = "trane_home_"
+
+# upper bounds in seconds, the last bucket (+Inf) catches everything slower
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(BUCKETS) and value > BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q'th observation, good enough to spot a slow path
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return BUCKETS[index] if index < len(BUCKETS) else self.max
+        return 0.0
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()        # recorded from the event loop and from Indigo's callback thread
+        self.histograms = {}                # (name, labels) -> Histogram, values in seconds
+        self.counters = {}                  # (name, labels) -> count
+        self.gauges = {}                    # (name, labels) -> current value
+        self.started = time.time()
+
+    def observe(self, name, seconds, **labels):
+        with self.lock:
+            histogram = self.histograms.get((name, _labels(labels)))
+            if histogram is None:
+                histogram = self.histograms[(name, _labels(labels))] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, amount=1, **labels):
+        with self.lock:
+            key = (name, _labels(labels))
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        # times the body, also across awaits, and counts it in <name>_total by result
+        start = time.perf_counter()
+        result = "ok"
+        try:
+            yield
+        except Exception:
+            result = "error"
+            raise
+        except BaseException:
+            result = "cancelled"
+            raise
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+            self.inc(f"{name}_total", result=result, **labels)
+
+    def trace_config(self):
+        # aiohttp hooks timing every Nexia HTTP request, from sending it to the response headers
+        from aiohttp import TraceConfig     # not when the plugin loads, see transport.py
+
+        trace_config = TraceConfig()
+
+        async def on_request_start(_session, context, _params):
+            context.start = time.perf_counter()
+
+        async def on_request_end(_session, context, params):
+            endpoint = params.url.path.split("/")[2] if params.url.path.count("/") > 1 else params.url.path
+            self.observe("http_request_seconds", time.perf_counter() - context.start, method=params.method, endpoint=endpoint)
+            self.inc("http_requests_total", method=params.method, endpoint=endpoint, status=params.response.status)
+
+        async def on_request_exception(_session, context, params):
+            self.observe("http_request_seconds", time.perf_counter() - context.start, method=params.method, endpoint="error")
+            self.inc("http_errors_total", method=params.method, error=type(params.exception).__name__)
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+    def summary(self):
+        # lines for the Event Log, slowest paths first
+        with self.lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: item[1].sum, reverse=True)
+            counters = sorted(self.counters.items()) + sorted(self.gauges.items())
+            lines = [f"Performance metrics for the last {(time.time() - self.started) / 3600.0:.1f} hours:"]
+            for (name, labels), histogram in histograms:
+                lines.append(f"    {name}{_format_labels(labels)}: {histogram.count} calls, avg {histogram.sum / histogram.count * 1000.0:.1f} ms, "
+                             f"p50 < {histogram.quantile(0.5) * 1000.0:.0f} ms, p95 < {histogram.quantile(0.95) * 1000.0:.0f} ms, "
+                             f"max {histogram.max * 1000.0:.1f} ms")
+            for (name, labels), count in counters:
+                lines.append(f"    {name}{_format_labels(labels)}: {count}")
+        return lines
+
+    def prometheus_text(self):
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _labels in self.histograms}):
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for (histogram_name, labels), histogram in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for index, count in enumerate(histogram.counts):
+                        cumulative += count
+                        bound = f"{BUCKETS[index]:g}" if index < len(BUCKETS) else "+Inf"
+                        lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                    lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {histogram.count}")
+            for name in sorted({name for name, _labels in self.counters}):
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                for (counter_name, labels), count in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {count}")
+            for name in sorted({name for name, _labels in self.gauges}):
+                lines.append(f"# TYPE {PREFIX}{name} gauge")
+                for (gauge_name, labels), value in sorted(self.gauges.items()):
+                    if gauge_name == name:
+                        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+        lines.append(f"# TYPE {PREFIX}start_time_seconds gauge")
+        lines.append(f"{PREFIX}start_time_seconds {self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # Blocking.  Written atomically, so a scraper never reads a partial file.
+        write_atomic(path, self.prometheus_text())
@@ -1,15 +1,35 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
+import time
+PLUGIN_LOADING = time.perf_counter()    # start of the startup profile (startup_profile.py)
+
 import indigo
 import asyncio
 import threading
-import time
 import logging
 import json
-
-from aiohttp import ClientSession
-from nexia.home import NexiaHome
-from nexia.const import AIR_CLEANER_MODES
+import os
+import itertools
+import math
+import random
+from collections import namedtuple
+from functools import partial
+
+from telemetry import TelemetryRecorder
+from analytics import RuntimeAnalytics
+from atomic_file import write_atomic
+from metrics import Metrics
+from scheduler import RequestScheduler, INTERACTIVE, BACKGROUND
+from events import ChangeDetector, THERMOSTAT_WATCHED, ZONE_WATCHED
+from capture import CaptureWriter, capture_files, read_capture
+from house_view import NO_HOUSES, house_view, replace_house
+from transport import load_modules, new_session, setting_errors, transport_settings
+from debuglog import DebugLog
+from startup_profile import StartupProfile
+
+# aiohttp and the nexia library aren't imported above, the event loop thread loads them (transport.load_modules)
+# while Indigo starts the devices
+PLUGIN_IMPORTED = time.perf_counter()
 
 kHvacModeEnumToStrMap = {
     indigo.kHvacMode.Cool: "COOL",
@@ -35,22 +55,116 @@ kFanModeStrToEnumMap = {
     'ON': indigo.kFanMode.AlwaysOn
 }
 
+# how long to wait after an update request before fetching, so a burst of actions results in one update
+UPDATE_DEBOUNCE = 1.0
+
+# setpoint, mode and preset changes for the same zone within this window are merged into one write
+WRITE_COALESCE_WINDOW = 2.0
+
+# account id used for the account entered in the plugin config dialog.  NexiaAccount devices use their device id.
+PREFS_ACCOUNT = 0
+
+# longest time one account's login or update may take, so a slow account can't hold up the others
+HOME_UPDATE_TIMEOUT = 60.0
+
+# a failed login is tried again after LOGIN_BACKOFF_INITIAL seconds, doubled for each failure after that up to
+# LOGIN_BACKOFF_MAX, and not at all after MAX_LOGIN_ATTEMPTS failures until the account's credentials change or its
+# device is restarted, so a wrong password can't lock the Nexia account
+MAX_LOGIN_ATTEMPTS = 5
+LOGIN_BACKOFF_INITIAL = 60.0
+LOGIN_BACKOFF_MAX = 3600.0
+
+# version of the saved session/snapshot files, bump when their layout changes
+SNAPSHOT_VERSION = 1
+
+# minimum seconds between snapshot writes for an account, unless its session changed
+SNAPSHOT_INTERVAL = 300.0
+
+# seconds between writes of the telemetry buffers to the history database
+TELEMETRY_FLUSH_INTERVAL = 300.0
+
+# zone write keys and the device states they change
+ZONE_WRITE_STATES = {
+    'heat': "setpointHeat",
+    'cool': "setpointCool",
+    'mode': "hvacOperationMode",
+    'preset': "zone_preset",
+}
+
+# most zone commands a bulk action runs at the same time
+BULK_CONCURRENCY = 4
+
+# longest time an action waits for a bulk operation when a script asked for the result
+BULK_RESULT_TIMEOUT = 120.0
+
+# seconds between saves of the runtime analytics
+ANALYTICS_SAVE_INTERVAL = 300.0
+
+# seconds between writes of the Prometheus metrics file
+METRICS_WRITE_INTERVAL = 60.0
+
+# the event loop is restarted after an unexpected error, waiting this long before the first restart, doubled for
+# each one after that up to RESTART_BACKOFF_MAX.  The backoff starts over once the loop ran RESTART_RESET seconds.
+RESTART_BACKOFF_INITIAL = 5.0
+RESTART_BACKOFF_MAX = 600.0
+RESTART_RESET = 3600.0
+
+# longest time a menu callback waits for the event loop to hand it data
+LOOP_CALL_TIMEOUT = 10.0
+
+# A Nexia call from an Indigo callback: the method of the device's 'thermostat' or 'zone' to call, and its arguments.
+# It holds names instead of library objects, and is resolved in the event loop when the call is made.
+Command = namedtuple("Command", "target method args")
+
+# numeric states recorded in the telemetry history, by device type
+TELEMETRY_KEYS = {
+    'NexiaThermostat': ("relative_humidity", "dehumidify_setpoint", "compressor_speed_current", "compressor_speed_requested",
+                        "outdoor_temperature", "is_blower_active"),
+    'NexiaZone': ("temperatureInput1", "setpointHeat", "setpointCool", "is_calling"),
+}
+
+
+def same_value(fetched, expected):
+    # a fetched state against the value a command asked for, fractions like a 0.45 humidity setpoint may differ in the last bits
+    if isinstance(fetched, (int, float)) and isinstance(expected, (int, float)) and not isinstance(fetched, bool):
+        return math.isclose(fetched, expected, abs_tol=1e-6)
+    return fetched == expected
+
 class Plugin(indigo.PluginBase):
 
     def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
         indigo.PluginBase.__init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
-        pfmt = logging.Formatter('%(asctime)s.%(msecs)03d\t[%(levelname)8s] %(name)20s.%(funcName)-25s%(msg)s', datefmt='%Y-%m-%d %H:%M:%S')
+        self.startup_profile = StartupProfile(PLUGIN_LOADING)
+        self.startup_profile.mark("imports", at=PLUGIN_IMPORTED)
+        pfmt = logging.Formatter('%(asctime)s.%(msecs)03d\t[%(levelname)8s] %(name)20s.%(funcName)-25s%(message)s', datefmt='%Y-%m-%d %H:%M:%S')
         self.plugin_file_handler.setFormatter(pfmt)
-        self.logLevel = int(self.pluginPrefs.get("logLevel", logging.INFO))
-        self.indigo_log_handler.setLevel(self.logLevel)
-        self.logger.debug(f"logLevel = {self.logLevel}")
-
         self.pluginPrefs = pluginPrefs
 
+        # prefs folder first, the optional debug log is written there
+        self.prefs_folder = f"{indigo.server.getInstallFolderPath()}/Preferences/Plugins/{pluginId}"
+        if not os.path.exists(self.prefs_folder):
+            os.makedirs(self.prefs_folder)
+
+        # Event Log, plugin log file and JSON-lines debug log levels.  The logger's own level is the lowest of them, so
+        # debug calls on the update path return before formatting anything when no handler wants their records.
+        self.debug_log = None
+        self.set_log_levels(self.pluginPrefs)
+        self.asyncioDebug = bool(self.pluginPrefs.get('asyncioDebug', False))
+
         self.updateFrequency = float(self.pluginPrefs.get('updateFrequency', "15")) * 60.0
         self.logger.debug(f"updateFrequency = {self.updateFrequency}")
         self.next_update = time.time() + self.updateFrequency
         self.update_needed = False
+        self.refresh_thermostats = set()    # (account_id, thermostat_id) to refresh on their own, without a full home update
+
+        # adaptive polling: poll at fastUpdateFrequency after commands and while the system is running,
+        # then back off towards updateFrequency as long as nothing changes
+        self.adaptivePolling = bool(self.pluginPrefs.get('adaptivePolling', False))
+        self.fastUpdateFrequency = float(self.pluginPrefs.get('fastUpdateFrequency', "60"))
+        self.fastUpdatePeriod = float(self.pluginPrefs.get('fastUpdatePeriod', "10")) * 60.0
+        self.poll_interval = self.updateFrequency
+        self.poll_reason = "configured"
+        self.last_command_time = 0.0
 
         # Adding IndigoLogHandler to the root logger makes it possible to see
         # warnings/errors from async callbacks in the Indigo log, which are otherwise not visible
@@ -60,31 +174,134 @@ class Plugin(indigo.PluginBase):
         # self.logger.*() calls produce duplicates.
         self.logger.removeHandler(self.indigo_log_handler)
 
+        # device id -> name of the started devices of each type.  Changed only by deviceStartComm and deviceStopComm,
+        # which replace the dicts instead of changing them, so the event loop can read them at any time.
+        self.nexia_accounts = {}
         self.nexia_thermostats = {}
         self.nexia_zones = {}
 
-        self.nexia_home = None
+        # thermostat and zone device id -> {'device', 'account', 'thermostat', 'zone'}, with the Nexia objects resolved.
+        # Rebuilt when devices start or stop and when an account's home or its topology changes.  Like the Nexia
+        # objects it is used in the event loop only, Indigo callbacks use self.houses.
+        self.device_index = {}
+        self.home_topology = {}     # account id -> (home, thermostat and zone ids) the index was built from
+
+        # last values pushed to each device, so do_update only sends states that changed
+        self.state_cache = {}
+        self.states_pushed = 0
+        self.states_skipped = 0
+
+        # zone writes waiting to be sent, keyed by zone device id.  Filled in by action callbacks, flushed by the event loop.
+        self.zone_writes = {}
+        self.zone_writes_lock = threading.Lock()
+        self.writes_merged = 0
+
+        # commands sent to Nexia and not finished yet, command id -> {'name', 'device', 'states', 'previous'}.
+        # 'states' are shown on the device right away, 'previous' are the values to restore if the command fails.
+        # Only used in the event loop thread.
+        self.commands = {}
+        self.command_ids = itertools.count(1)
+        self.unconfirmed = {}       # device id -> {state: value} from finished commands, checked against the next fetch
+        self.command_counts = {}    # account id -> {'outstanding': n, 'failed': n}
+
+        self.nexia_homes = {}       # account id -> logged in NexiaHome, or one restored from its saved snapshot
+        self.restored_homes = set() # account ids whose home came from a snapshot and hasn't been updated live yet
+        self.home_credentials = {}  # account id -> (username, password, brand) its home was created with
+        self.login_failures = {}    # account id -> {'credentials', 'count', 'retry'} of failed logins with those credentials
+        self.houses = NO_HOUSES     # account id -> HouseView, republished by the event loop after each update (house_view.py)
         self.event_loop = None
         self.async_thread = None
+        self.main_task = None
+        self.wake_event = None
+        self.update_lock = None     # held by updates and by a replay, which swaps the homes out from under them
+        self.logins = {}            # account id -> task logging in again after Nexia rejected the session
+
+        # HTTP connection pool, timeouts and compression (transport.py).  A new session is opened when the settings change.
+        self.transport = transport_settings(self.pluginPrefs)
         self.session = None
+        self.session_transport = None   # the settings self.session was opened with
+        self.session_closers = set()    # tasks closing replaced sessions
+
+        # saved sessions and house snapshots, so devices get states before the first login completes
+        self.snapshots_saved = {}   # account id -> (time, api_key) of the last snapshot written
+
+        # history of numeric states, kept in ring buffers and flushed to a SQLite file in the prefs folder
+        self.telemetry = None
+        self.next_telemetry_flush = time.time() + TELEMETRY_FLUSH_INTERVAL
+        self.set_telemetry(bool(self.pluginPrefs.get('telemetryEnabled', False)))
+
+        # compressor, blower and zone calling runtime, aggregated from each poll and saved to the prefs folder
+        self.analytics = RuntimeAnalytics(f"{self.prefs_folder}/analytics.json", max_gap=self.analytics_max_gap())
+        self.analytics.load()
+        self.next_analytics_save = time.time() + ANALYTICS_SAVE_INTERVAL
+
+        # timing histograms and counters for polls, HTTP requests and commands
+        self.metrics = Metrics()
+        self.metricsFile = bool(self.pluginPrefs.get('metricsFile', False))
+        self.metricsPath = self.pluginPrefs.get('metricsPath', "") or f"{self.prefs_folder}/metrics.prom"
+        self.next_metrics_write = time.time() + METRICS_WRITE_INTERVAL
+
+        # every Nexia API call waits its turn here, user commands ahead of polling
+        self.scheduler = RequestScheduler(self.metrics)
+
+        # plugin events (Events.xml): trigger id -> trigger, fired when a fetch shows a watched value changed
+        self.triggers = {}
+        self.change_detector = ChangeDetector()
+
+        # house snapshots captured to gzip'd JSON lines files, and replayed from them without network access
+        self.capture_folder = f"{self.prefs_folder}/capture"
+        self.capture = None
+        self.set_capture(bool(self.pluginPrefs.get('captureEnabled', False)))
+        self.replay_task = None
+        self.replay_events = False
+
+        self.new_accounts = set()       # account devices started since the last update, set up without waiting for the debounce
+        self.started_devices = set()    # thermostat and zone devices started since the last push_started_devices
+        self.startup_profile.mark("init")
 
     ##############################################################################################
 
     def validatePrefsConfigUi(self, valuesDict):    # noqa
         errorDict = indigo.Dict()
 
+        # The account here is optional when Nexia Account devices are used, but needs both username and password if given
         username = valuesDict['username']
-        if len(username) == 0:
-            errorDict['username'] = "Username is required"
-
         password = valuesDict['password']
-        if len(password) == 0:
+        if len(username) == 0 and len(password) > 0:
+            errorDict['username'] = "Username is required"
+        if len(password) == 0 and len(username) > 0:
             errorDict['password'] = "Password is required"
 
         updateFrequency = int(valuesDict['updateFrequency'])
         if (updateFrequency < 2) or (updateFrequency > 60):
             errorDict['updateFrequency'] = "Update frequency is invalid - enter a valid number (between 2 and 60)"
 
+        if valuesDict.get('adaptivePolling', False):
+            try:
+                fastUpdateFrequency = int(valuesDict['fastUpdateFrequency'])
+            except ValueError:
+                fastUpdateFrequency = 0
+            if (fastUpdateFrequency < 30) or (fastUpdateFrequency > 600):
+                errorDict['fastUpdateFrequency'] = "Fast update frequency is invalid - enter a valid number (between 30 and 600)"
+
+            try:
+                fastUpdatePeriod = int(valuesDict['fastUpdatePeriod'])
+            except ValueError:
+                fastUpdatePeriod = 0
+            if (fastUpdatePeriod < 1) or (fastUpdatePeriod > 60):
+                errorDict['fastUpdatePeriod'] = "Fast update period is invalid - enter a valid number (between 1 and 60)"
+
+        for key, message in setting_errors(valuesDict).items():
+            errorDict[key] = message
+
+        if valuesDict.get('debugLog', False):
+            try:
+                debugLogSample = int(valuesDict.get('debugLogSample', "1"))
+            except ValueError:
+                debugLogSample = 0
+            if (debugLogSample < 1) or (debugLogSample > 1000):
+                errorDict['debugLogSample'] = "Sample rate is invalid - enter a valid number (between 1 and 1000)"
+
         if len(errorDict) > 0:
             return False, valuesDict, errorDict
 
@@ -92,81 +309,878 @@ class Plugin(indigo.PluginBase):
 
     def closedPrefsConfigUi(self, valuesDict, userCancelled):
         if not userCancelled:
-            self.logLevel = int(valuesDict.get("logLevel", logging.INFO))
-
-            self.indigo_log_handler.setLevel(self.logLevel)
-            self.logger.debug(f"logLevel = {self.logLevel}")
+            self.set_log_levels(valuesDict)
+            self.asyncioDebug = bool(valuesDict.get('asyncioDebug', False))
+            if self.event_loop:
+                self.event_loop.call_soon_threadsafe(self.event_loop.set_debug, self.asyncioDebug)
 
             self.updateFrequency = float(valuesDict['updateFrequency']) * 60.0
             self.logger.debug(f"updateFrequency = {self.updateFrequency}")
+
+            self.adaptivePolling = bool(valuesDict.get('adaptivePolling', False))
+            self.fastUpdateFrequency = float(valuesDict.get('fastUpdateFrequency', "60"))
+            self.fastUpdatePeriod = float(valuesDict.get('fastUpdatePeriod', "10")) * 60.0
+            self.logger.debug(f"adaptivePolling = {self.adaptivePolling}, fastUpdateFrequency = {self.fastUpdateFrequency}, fastUpdatePeriod = {self.fastUpdatePeriod}")
+            self.poll_interval = self.updateFrequency
             self.next_update = time.time()
+            self.analytics.max_gap = self.analytics_max_gap()
+            # the recorder and the capture writer are used by the event loop, they are replaced there
+            self.call_in_loop(self.set_telemetry, bool(valuesDict.get('telemetryEnabled', False)))
+            self.metricsFile = bool(valuesDict.get('metricsFile', False))
+            self.metricsPath = valuesDict.get('metricsPath', "") or f"{self.prefs_folder}/metrics.prom"
+            self.logger.debug(f"metricsFile = {self.metricsFile}, metricsPath = {self.metricsPath}")
+            self.call_in_loop(self.set_capture, bool(valuesDict.get('captureEnabled', False)))
+            self.transport = transport_settings(valuesDict)
+            self.logger.debug(f"transport = {self.transport}")
+            self.wake_async_loop()
+
+    def set_log_levels(self, prefs):
+        self.logLevel = int(prefs.get("logLevel", logging.INFO))
+        self.indigo_log_handler.setLevel(self.logLevel)
+        self.fileLogLevel = int(prefs.get("fileLogLevel", logging.DEBUG))
+        self.plugin_file_handler.setLevel(self.fileLogLevel)
+
+        if prefs.get('debugLog', False):
+            level = int(prefs.get("debugLogLevel", logging.DEBUG))
+            try:
+                sample = int(prefs.get("debugLogSample", "1"))
+            except ValueError:
+                sample = 1
+            if not self.debug_log or (self.debug_log.level, self.debug_log.sample) != (level, sample):
+                self.close_debug_log()
+                self.debug_log = DebugLog(f"{self.prefs_folder}/debug.jsonl", level, sample)
+                self.logger.addHandler(self.debug_log.handler)
+        else:
+            self.close_debug_log()
+
+        levels = [self.logLevel, self.fileLogLevel] + ([self.debug_log.level] if self.debug_log else [])
+        self.logger.setLevel(min(levels))
+        self.logger.debug("logLevel = %s, fileLogLevel = %s, debugLog = %s", self.logLevel, self.fileLogLevel,
+                          self.debug_log and (self.debug_log.level, self.debug_log.sample))
+
+    def close_debug_log(self):
+        if self.debug_log:
+            self.logger.removeHandler(self.debug_log.handler)
+            self.debug_log.close()
+            self.debug_log = None
 
     def startup(self):
         self.logger.debug("startup")
+        # The loop exists before Indigo starts the devices, so their deviceStartComm callbacks queue up in it while
+        # the thread loads the network modules and the logins start
+        self.event_loop = asyncio.new_event_loop()
+        self.wake_event = asyncio.Event()
+        self.update_lock = asyncio.Lock()
         self.async_thread = threading.Thread(target=self.run_async_thread)
         self.async_thread.start()
+        self.startup_profile.mark("thread")
         self.logger.debug("startup complete")
 
     def shutdown(self):
         self.logger.debug("shutdown")
-        self.event_loop.call_soon_threadsafe(self.event_loop.stop)
+        self.stopThread = True
+        if self.event_loop and self.main_task:
+            self.event_loop.call_soon_threadsafe(self.main_task.cancel)
 
     def run_async_thread(self):
         self.logger.debug("run_async_thread starting")
-        self.event_loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.event_loop)
-        self.event_loop.set_debug(True)
+        self.event_loop.set_debug(self.asyncioDebug)
         self.event_loop.set_exception_handler(self.asyncio_exception_handler)
 
         try:
-            self.event_loop.run_until_complete(self.async_main())
+            load_modules()
+            self.startup_profile.mark("network_imports")
+            self.main_task = self.event_loop.create_task(self.async_main())
+            self.event_loop.run_until_complete(self.main_task)
+        except asyncio.CancelledError:
+            self.logger.debug("run_async_thread: async_main cancelled")
         except Exception as exc:
             self.logger.exception(exc)
+
+        if self.telemetry:
+            try:
+                self.telemetry.flush()      # keep the samples recorded since the last flush
+            except Exception as e:
+                self.logger.warning(f"run_async_thread: unable to write telemetry: {e!r}")
+        try:
+            self.analytics.save(self.analytics.to_json())
+        except Exception as e:
+            self.logger.warning(f"run_async_thread: unable to save runtime analytics: {e!r}")
+        self.set_capture(False)
         self.event_loop.close()
         self.logger.debug("run_async_thread exiting")
+        self.close_debug_log()
 
     def asyncio_exception_handler(self, _loop, context):
         self.logger.exception(f"Event loop exception {context}")
 
-    async def async_main(self):
-        self.logger.debug(f"async_main: running")
-        """Create the aiohttp session and run."""
-        async with ClientSession() as self.session:
+    def request_update(self, account_id=None, thermostat_id=None):
+        # Safe to call from any thread.  Updates requested within UPDATE_DEBOUNCE seconds of each other are merged.
+        # With a thermostat_id only that thermostat and its zones are refreshed, otherwise all homes are updated.
+        if self.event_loop and self.wake_event:
+            self.event_loop.call_soon_threadsafe(self._update_requested, account_id, thermostat_id)
+        else:
+            self.update_needed = True       # async loop not running yet, it checks the flag when it starts
+
+    def _update_requested(self, account_id, thermostat_id):
+        # runs in the event loop thread, so the flags are never modified concurrently
+        if thermostat_id is None:
+            self.update_needed = True
+        else:
+            self.refresh_thermostats.add((account_id, thermostat_id))
+        self.wake_event.set()
+
+    def wake_async_loop(self):
+        if self.event_loop and self.wake_event:
+            self.event_loop.call_soon_threadsafe(self.wake_event.set)
+
+    def send_command(self, command, device, states=None):
+        # Submit a Command for a device from an Indigo callback, like Command('zone', 'set_preset', (preset,)).  It is run
+        # by the request scheduler in the interactive lane.  The device gets 'states' ({key: value}) right away, they are
+        # rolled back if the command fails.  The device's thermostat is refreshed once the command is done.  Returns the command id.
+        relogin = partial(self.relogin, self.device_account(device))
 
+        async def run():
             try:
+                await self.scheduler.run(INTERACTIVE, self.command_factory(command, device), relogin=relogin)
+            finally:
+                self.refresh_device(device)
+        return self.start_command(command.method, run, device, states)
+
+    def refresh_device(self, device):
+        # Runs in the event loop.  Refreshes the thermostat of a thermostat or zone device, if it's still available.
+        entry = self.device_index.get(device.id)
+        if entry is not None and entry['thermostat'] is not None:
+            self._update_requested(entry['account'], entry['thermostat'].thermostat_id)
+
+    def command_factory(self, command, device):
+        # The scheduler factory for a Command.  The device's library object is looked up when the call is made, in the event loop.
+        def factory():
+            return getattr(self.lookup(device)[command.target], command.method)(*command.args)
+        factory.__name__ = command.method
+        return factory
+
+    def start_command(self, name, run, device, states=None):
+        # Like send_command, for a 'run' coroutine function that schedules its own Nexia calls
+        if self.replay_task is not None:
+            self.logger.warning(f"{device.name}: {name} not sent, a capture is being replayed")
+            return None
+        command_id = next(self.command_ids)
+        self.event_loop.call_soon_threadsafe(self._command_sent, command_id, name, device, states or {})
+        asyncio.run_coroutine_threadsafe(self.tracked_command(command_id, name, run), self.event_loop)
+        return command_id
+
+    def add_command_states(self, command_id, device, states):
+        # Show more expected states for a command that was already sent, like a zone write that merged another change
+        self.event_loop.call_soon_threadsafe(self._command_states, command_id, device, states)
+
+    def _command_sent(self, command_id, name, device, states):
+        self.last_command_time = time.time()
+        if self.adaptivePolling and self.next_update > self.last_command_time + self.fastUpdateFrequency:
+            self.next_update = self.last_command_time + self.fastUpdateFrequency
+            self.wake_event.set()
+
+        self.commands[command_id] = {'name': name, 'device': device, 'states': {}, 'previous': {}}
+        self.count_command(device, 'outstanding', 1)
+        self._command_states(command_id, device, states)
+
+    def _command_states(self, command_id, device, states):
+        command = self.commands.get(command_id)
+        if command is not None:
+            cache = self.state_cache.get(device.id, {})
+            for key in states:
+                if key not in command['previous'] and key in cache:
+                    command['previous'][key] = cache[key]
+            command['states'].update(states)
+            if 'zone_preset' in states:
+                # a preset replaces the zone's setpoints, the ones shown before it are no longer expected
+                command['states'].pop('setpointHeat', None)
+                command['states'].pop('setpointCool', None)
+        self.push_states(device, [{'key': key, 'value': value} for key, value in states.items()])
+
+    async def tracked_command(self, command_id, name, run):
+        # Runs a command in the event loop, timing it, and rolls back its optimistic states if it fails.
+        # Returns None if the command succeeded, otherwise the exception.
+        try:
+            with self.metrics.timer("command", command=name):
+                await run()
+        except Exception as e:
+            command = self.commands.pop(command_id, None)
+            if command is None:
+                return e
+            self.logger.error(f"{command['device'].name}: {command['name']} failed: {type(e).__name__}: {e}")
+            self.count_command(command['device'], 'outstanding', -1)
+            self.count_command(command['device'], 'failed', 1)
+            self.rollback_command(command)
+            return e
+        else:
+            command = self.commands.pop(command_id, None)
+            if command is not None:
+                self.count_command(command['device'], 'outstanding', -1)
+                self.unconfirmed.setdefault(command['device'].id, {}).update(command['states'])
+            return None
+
+    def rollback_command(self, command):
+        # restore the states this command changed, unless a later command for the device changed them again
+        held = self.held_states(command['device'].id)
+        rollback = [{'key': key, 'value': value} for key, value in command['previous'].items() if key not in held]
+        if rollback:
+            self.logger.warning(f"{command['device'].name}: {command['name']} failed, restoring {', '.join(item['key'] for item in rollback)}")
+            self.push_states(command['device'], rollback)
+
+    def held_states(self, dev_id):
+        # states shown optimistically for commands still in progress, a fetch must not overwrite them yet
+        held = {}
+        for command in self.commands.values():
+            if command['device'].id == dev_id:
+                held.update(command['states'])
+        return held
+
+    def reconcile_states(self, device, update_list):
+        # Called with each device's freshly fetched states.  Keeps optimistic states of commands still in progress,
+        # and reports finished commands whose values the cloud didn't take.
+        held = self.held_states(device.id) if self.commands else {}
+        expected = self.unconfirmed.pop(device.id, None) if self.replay_task is None else None
+        if expected:
+            zone = self.device_index.get(device.id, {}).get('zone')
+            for item in update_list:
+                if item['key'] not in expected or item['key'] in held:
+                    continue
+                value = expected[item['key']]
+                if zone is not None and item['key'] in ('setpointHeat', 'setpointCool') and value is not None:
+                    value = zone.round_temp(value)      # the setpoint nexia sent, to the nearest degree or half degree
+                if not same_value(item['value'], value):
+                    self.logger.warning(f"{device.name}: {item['key']} is {item['value']} after the command, not {value}")
+                    self.count_command(device, 'failed', 1)
+        if held:
+            update_list = [item for item in update_list if item['key'] not in held]
+        return update_list
+
+    def count_command(self, device, counter, change):
+        account_id = self.device_account(device)
+        counts = self.command_counts.setdefault(account_id, {'outstanding': 0, 'failed': 0})
+        counts[counter] += change
+        self.metrics.set(f"commands_{counter}", counts[counter], account=account_id)
+        if account_id in self.nexia_accounts:
+            self.push_states(indigo.devices[account_id], [{'key': f"commands_{counter}", 'value': counts[counter]}])
+
+    def analytics_max_gap(self):
+        # polls up to two full update intervals apart are counted, a longer gap means updates were missed
+        return 2.0 * self.updateFrequency
+
+    def adapt_poll_interval(self):
+        # Pick the interval until the next full update, called after each one
+        if not self.adaptivePolling:
+            interval, reason = self.updateFrequency, "configured"
+        elif time.time() - self.last_command_time < self.fastUpdatePeriod:
+            interval, reason = self.fastUpdateFrequency, "recent command"
+        elif self.system_active():
+            interval, reason = self.fastUpdateFrequency, "system active"
+        elif self.states_pushed == 0:
+            interval, reason = min(self.poll_interval * 2.0, self.updateFrequency), "no changes, backing off"
+        else:
+            interval, reason = self.poll_interval, "states changed"
+
+        if interval != self.poll_interval or reason != self.poll_reason:
+            self.logger.debug("adapt_poll_interval: polling every %.0f seconds (%s)", interval, reason)
+        self.poll_interval = interval
+        self.poll_reason = reason
+        return interval
 
-                self.nexia_home = NexiaHome(self.session, username=self.pluginPrefs.get("username"), password=self.pluginPrefs.get("password"), brand=self.pluginPrefs.get("brand"))
-                await self.nexia_home.login()
-                await self.nexia_home.update()
+    def set_telemetry(self, enabled):
+        if enabled and not self.telemetry:
+            try:
+                self.telemetry = TelemetryRecorder(f"{self.prefs_folder}/telemetry.sqlite")
+            except Exception as e:
+                self.logger.error(f"Unable to open telemetry database: {e!r}")
+        elif not enabled:
+            self.telemetry = None
+        self.logger.debug(f"telemetry = {self.telemetry is not None}")
+
+    def set_capture(self, enabled):
+        if enabled and not self.capture:
+            try:
+                self.capture = CaptureWriter(self.capture_folder)
             except Exception as e:
-                self.logger.warning(f"async_main: exception:{e}")
-                raise e
+                self.logger.error(f"Unable to create capture folder: {e!r}")
+        elif not enabled and self.capture:
+            self.capture.close()
+            self.capture = None
+        self.logger.debug(f"capture = {self.capture is not None}")
+
+    async def capture_snapshot(self, account_id, house_json):
+        # house_json is None when the house hasn't changed since the last update
+        capture = self.capture
+        if not capture or not house_json:
+            return
+        try:
+            await asyncio.to_thread(capture.write, account_id, house_json)
+        except Exception as e:
+            self.logger.warning(f"capture_snapshot: unable to write capture: {e!r}")
+
+    async def housekeeping(self):
+        # periodic writes that don't depend on the poll schedule
+        await self.flush_telemetry()
+        await self.save_analytics()
+        await self.write_metrics()
+        self.check_transport()
+
+    def next_housekeeping(self):
+        return min(self.next_telemetry_flush if self.telemetry else self.next_update,
+                   self.next_metrics_write if self.metricsFile else self.next_update,
+                   self.next_analytics_save)
+
+    async def write_metrics(self):
+        if not self.metricsFile or time.time() < self.next_metrics_write:
+            return
+        self.next_metrics_write = time.time() + METRICS_WRITE_INTERVAL
+        try:
+            await asyncio.to_thread(self.metrics.write_prometheus, self.metricsPath)
+        except Exception as e:
+            self.logger.warning(f"write_metrics: unable to write {self.metricsPath}: {e!r}")
+
+    async def flush_telemetry(self):
+        telemetry = self.telemetry
+        if not telemetry or time.time() < self.next_telemetry_flush:
+            return
+        self.next_telemetry_flush = time.time() + TELEMETRY_FLUSH_INTERVAL
+        try:
+            await asyncio.to_thread(telemetry.flush)
+        except Exception as e:
+            self.logger.warning(f"flush_telemetry: unable to write telemetry: {e!r}")
+
+    async def save_analytics(self):
+        if time.time() < self.next_analytics_save:
+            return
+        self.next_analytics_save = time.time() + ANALYTICS_SAVE_INTERVAL
+        try:
+            await asyncio.to_thread(self.analytics.save, self.analytics.to_json())
+        except Exception as e:
+            self.logger.warning(f"save_analytics: unable to save runtime analytics: {e!r}")
+
+    def analytics_states(self, account_id, device, thermostat, zone=None):
+        # Add this poll to the device's runtime analytics and return its analytics states.  Replayed captures and
+        # homes restored from a snapshot don't show the current state of the system, so they aren't added.
+        status = str(thermostat.get_system_status()).lower()
+        heating = "heating" in status or "emergency heat" in status
+        cooling = "cooling" in status
+        if zone is None:
+            if thermostat.has_variable_speed_compressor():
+                compressor = (thermostat.get_current_compressor_speed() or 0) > 0
+            else:
+                compressor = heating or cooling
+            signals = {'compressor': compressor, 'blower': thermostat.is_blower_active(), 'heating': heating, 'cooling': cooling,
+                       'outdoor': thermostat.get_outdoor_temperature() if thermostat.has_outdoor_temperature() else None}
+        else:
+            calling = zone.is_calling()
+            signals = {'calling': calling, 'heat_demand': calling and heating, 'cool_demand': calling and cooling}
+        if self.replay_task is None and account_id not in self.restored_homes:
+            self.analytics.record(device.id, signals)
+        return self.analytics.thermostat_states(device.id) if zone is None else self.analytics.zone_states(device.id)
+
+    def record_telemetry(self, account_id, device, update_list):
+        # like analytics_states, replayed captures and homes restored from a snapshot aren't recorded
+        if self.telemetry and self.replay_task is None and account_id not in self.restored_homes:
+            keys = TELEMETRY_KEYS[device.deviceTypeId]
+            self.telemetry.record(device.id, {item['key']: item['value'] for item in update_list if item['key'] in keys})
+
+    def system_active(self):
+        for nexia_home in self.nexia_homes.values():
+            for thermostat in nexia_home.thermostats:
+                if thermostat.is_blower_active():
+                    return True
+                for zone in thermostat.zones:
+                    if zone.is_calling():
+                        return True
+        return False
+
+    ########################################
+    # Accounts.  Each configured account has its own NexiaHome, all of them share one ClientSession.
+    ########################################
+
+    def account_configs(self):
+        # account id -> (name, username, password, brand) for every configured account
+        accounts = {}
+        if self.pluginPrefs.get("username"):
+            accounts[PREFS_ACCOUNT] = ("Plugin Config Account", self.pluginPrefs["username"], self.pluginPrefs.get("password"), self.pluginPrefs.get("brand"))
+        for dev_id in self.nexia_accounts:
+            try:
+                device = indigo.devices[dev_id]
+            except KeyError:
+                continue        # deleted, deviceStopComm hasn't run yet
+            accounts[dev_id] = (device.name, device.pluginProps["username"], device.pluginProps["password"], device.pluginProps.get("brand"))
+        return accounts
+
+    @staticmethod
+    def device_account(device):
+        # Devices created before multiple accounts were supported don't have the property, they use the plugin config account
+        return int(device.pluginProps.get('nexia_account', PREFS_ACCOUNT) or PREFS_ACCOUNT)
+
+    ########################################
+    # Device index
+    ########################################
 
-            if not self.nexia_home:
-                self.logger.warning(f"async_main: no nexia_home")
+    @staticmethod
+    def find_thermostat(nexia_home, thermostat_id):
+        # Props hold ids as strings, the library has int ids for XL models and str ids for others, so compare as strings
+        for thermostat in nexia_home.thermostats or []:
+            if str(thermostat.thermostat_id) == str(thermostat_id):
+                return thermostat
+        return None
+
+    @staticmethod
+    def find_zone(thermostat, zone_id):
+        for zone in thermostat.zones:
+            if str(zone.zone_id) == str(zone_id):
+                return zone
+        return None
+
+    def resolve_device(self, device):
+        account_id = self.device_account(device)
+        entry = {'device': device, 'account': account_id, 'thermostat': None, 'zone': None}
+        nexia_home = self.nexia_homes.get(account_id)
+        if nexia_home is None:
+            return entry
+        entry['thermostat'] = self.find_thermostat(nexia_home, device.pluginProps['nexia_thermostat'])
+        if entry['thermostat'] is None:
+            self.logger.error(f"{device.name}: thermostat {device.pluginProps['nexia_thermostat']} not found, "
+                              f"valid ids are {nexia_home.get_thermostat_ids()}")
+        elif device.deviceTypeId == 'NexiaZone':
+            entry['zone'] = self.find_zone(entry['thermostat'], device.pluginProps['nexia_zone'])
+            if entry['zone'] is None:
+                self.logger.error(f"{device.name}: zone {device.pluginProps['nexia_zone']} not found, "
+                                  f"valid ids are {entry['thermostat'].get_zone_ids()}")
+        return entry
+
+    def index_device(self, device):
+        self.device_index[device.id] = self.resolve_device(device)
+
+    def unindex_device(self, device):
+        self.device_index.pop(device.id, None)
+
+    def reindex_account(self, account_id):
+        # Re-resolve the account's devices if its home was replaced or its thermostats or zones changed
+        nexia_home = self.nexia_homes.get(account_id)
+        topology = None
+        if nexia_home is not None:
+            topology = (nexia_home, tuple((thermostat.thermostat_id, tuple(thermostat.get_zone_ids())) for thermostat in nexia_home.thermostats or []))
+        if self.home_topology.get(account_id) == topology:
+            return
+        self.home_topology[account_id] = topology
+        for dev_id, entry in list(self.device_index.items()):
+            if entry['account'] == account_id:
+                self.device_index[dev_id] = self.resolve_device(entry['device'])
+        self.logger.debug("reindex_account: account %s topology changed, index rebuilt", account_id)
+
+    def lookup(self, device):
+        # The index entry for a thermostat or zone device, KeyError if its Nexia objects aren't available
+        entry = self.device_index.get(device.id)
+        if entry is None or entry['thermostat'] is None or (device.deviceTypeId == 'NexiaZone' and entry['zone'] is None):
+            raise KeyError(f"{device.name}: Nexia thermostat or zone not available")
+        return entry
+
+    def device_view(self, device):
+        # (ThermostatView, ZoneView or None) of a thermostat or zone device from the published houses, for Indigo
+        # callbacks.  KeyError if the device's thermostat or zone isn't available.
+        house = self.houses.get(self.device_account(device))
+        thermostat = house.thermostats.get(str(device.pluginProps.get('nexia_thermostat'))) if house else None
+        zone = thermostat.zones.get(str(device.pluginProps.get('nexia_zone'))) if thermostat and device.deviceTypeId == 'NexiaZone' else None
+        if thermostat is None or (device.deviceTypeId == 'NexiaZone' and zone is None):
+            raise KeyError(f"{device.name}: Nexia thermostat or zone not available")
+        return thermostat, zone
+
+    def publish_house(self, account_id):
+        # Runs in the event loop.  Replaces the account's house view, readers see the old or the new one, never a mix.
+        nexia_home = self.nexia_homes.get(account_id)
+        self.houses = replace_house(self.houses, account_id, house_view(nexia_home) if nexia_home is not None else None)
+
+    def call_in_loop(self, callback, *args):
+        # Run callback in the event loop thread, which owns the Nexia objects and the device index.  Called right
+        # away when the loop isn't running, before startup and after shutdown.
+        if self.event_loop is not None:
+            try:
+                self.event_loop.call_soon_threadsafe(callback, *args)
                 return
+            except RuntimeError:
+                pass        # loop closed
+        callback(*args)
+
+    def update_account_status(self, account_id, status):
+        if account_id in self.nexia_accounts:
+            update_list = [{'key': "status", 'value': status}]
+            if account_id in self.nexia_homes:
+                update_list.append({'key': "home_name", 'value': self.nexia_homes[account_id].get_name()})
+            self.push_states(indigo.devices[account_id], update_list)
+
+    async def start_homes(self):
+        # Set up every configured account that doesn't have a home yet.  Accounts with a saved snapshot get
+        # their devices filled in from it right away and are updated live by do_update, the others log in
+        # all at the same time.  Returns the account ids that logged in, they already have fresh data.
+        accounts = self.account_configs()
+        for account_id in list(self.nexia_homes):
+            if account_id not in accounts or self.home_credentials.get(account_id) != accounts[account_id][1:]:
+                self.drop_home(account_id)
+        pending = [account_id for account_id in accounts if account_id not in self.nexia_homes]
+        for account_id in pending:
+            self.restore_home(account_id, *accounts[account_id])
+        pending = [account_id for account_id in pending if account_id not in self.nexia_homes and self.login_allowed(account_id, accounts[account_id][1:])]
+        if pending:
+            await asyncio.gather(*(self.start_home(account_id, *accounts[account_id]) for account_id in pending))
+        return set(pending)
+
+    def drop_home(self, account_id):
+        # Forget the account's home and everything tied to its session, start_homes sets it up again if it's still configured
+        self.nexia_homes.pop(account_id, None)
+        self.restored_homes.discard(account_id)
+        self.home_credentials.pop(account_id, None)
+        self.login_failures.pop(account_id, None)
+        self.snapshots_saved.pop(account_id, None)
+        login = self.logins.pop(account_id, None)
+        if login is not None:
+            login.cancel()
+        self.reindex_account(account_id)
+        self.publish_house(account_id)
+
+    def login_allowed(self, account_id, credentials):
+        failures = self.login_failures.get(account_id)
+        if failures is None or failures['credentials'] != credentials:
+            self.login_failures.pop(account_id, None)
+            return True
+        return failures['count'] < MAX_LOGIN_ATTEMPTS and time.time() >= failures['retry']
+
+    def login_failed(self, account_id, name, credentials, error):
+        failures = self.login_failures.get(account_id)
+        if failures is None or failures['credentials'] != credentials:
+            failures = self.login_failures[account_id] = {'credentials': credentials, 'count': 0, 'retry': 0.0}
+        failures['count'] += 1
+        delay = min(LOGIN_BACKOFF_MAX, LOGIN_BACKOFF_INITIAL * 2.0 ** (failures['count'] - 1))
+        failures['retry'] = time.time() + delay
+        if failures['count'] >= MAX_LOGIN_ATTEMPTS:
+            self.logger.error(f"{name}: login failed {failures['count']} times, not trying again until the account settings change: {error}")
+        elif failures['count'] == 1:
+            self.logger.warning(f"{name}: login failed, trying again in {delay:.0f} seconds: {error}")
+        else:
+            self.logger.debug(f"{name}: login failed {failures['count']} times, trying again in {delay:.0f} seconds: {error}")
 
-            while True:
-                if (time.time() > self.next_update) or self.update_needed:
+    def new_home(self, username, password, brand):
+        from nexia.home import NexiaHome    # loaded by load_modules() before the event loop runs
 
-                    self.update_needed = False
-                    self.next_update = time.time() + self.updateFrequency
-                    await self.do_update()
+        # keep the library's device uuid file with the snapshots, the saved session is only valid with the same uuid
+        state_file = f"{self.prefs_folder}/{brand}_config_{username}.conf"
+        return NexiaHome(self.session, username=username, password=password, brand=brand, state_file=state_file)
 
-                await asyncio.sleep(2.0)
-                if self.stopThread:
-                    self.logger.debug("async_main: stopping")
-                    break
+    async def start_home(self, account_id, name, username, password, brand):
+        self.logger.debug(f"{name}: logging in as {username} ({brand})")
+        nexia_home = self.new_home(username, password, brand)
+        try:
+            with self.metrics.timer("login", account=account_id):
+                await self.scheduler.run(BACKGROUND, nexia_home.login, timeout=HOME_UPDATE_TIMEOUT)
+                house_json = await self.scheduler.run(BACKGROUND, nexia_home.update, timeout=HOME_UPDATE_TIMEOUT)
+        except Exception as e:
+            self.login_failed(account_id, name, (username, password, brand), e)
+            self.update_account_status(account_id, "Login Failed")
+            return
+        self.login_failures.pop(account_id, None)
+        if self.account_configs().get(account_id, (None,))[1:] != (username, password, brand):
+            return      # the account was stopped or changed while logging in
+        self.nexia_homes[account_id] = nexia_home
+        self.home_credentials[account_id] = (username, password, brand)
+        self.startup_profile.mark("login")
+        self.logger.info(f"{name}: logged in to home '{nexia_home.get_name()}'")
+        self.update_account_status(account_id, "OK")
+        self.update_devices(account_id, fetched=True)
+        await self.capture_snapshot(account_id, house_json)
+        await self.save_snapshot(account_id, nexia_home, house_json)
+
+    async def update_home(self, account_id):
+        nexia_home = self.nexia_homes[account_id]
+        if account_id in self.restored_homes and not self.login_allowed(account_id, self.home_credentials[account_id]):
+            return      # its saved session wasn't accepted, and nexia logs in again on every update, so it waits like a login
+        try:
+            with self.metrics.timer("home_update", account=account_id):
+                try:
+                    house_json = await self.scheduler.run(BACKGROUND, nexia_home.update, timeout=HOME_UPDATE_TIMEOUT,
+                                                          relogin=partial(self.relogin, account_id))
+                except Exception as e:
+                    if account_id not in self.restored_homes:
+                        raise
+                    # the saved session may have expired while the plugin wasn't running, log in again
+                    self.logger.debug(f"Account {account_id}: saved session not accepted ({e!r}), logging in")
+                    if not await self.login_restored_home(account_id, nexia_home):
+                        self.update_account_status(account_id, "Login Failed")
+                        return
+                    house_json = await self.scheduler.run(BACKGROUND, nexia_home.update, timeout=HOME_UPDATE_TIMEOUT)
+        except Exception as e:
+            self.logger.warning(f"Account {account_id}: update failed: {e!r}")
+            self.update_account_status(account_id, "Update Failed")
+            return
+        if self.nexia_homes.get(account_id) is not nexia_home:
+            return      # dropped while updating, its account was stopped or changed
+        if account_id in self.restored_homes:
+            self.restored_homes.discard(account_id)
+            self.logger.info(f"Account {account_id}: resumed session for home '{nexia_home.get_name()}'")
+        self.update_account_status(account_id, "OK")
+        self.update_devices(account_id, fetched=True)
+        await self.capture_snapshot(account_id, house_json)
+        await self.save_snapshot(account_id, nexia_home, house_json)
+
+    async def login_restored_home(self, account_id, nexia_home):
+        # Log a restored home in, with the same backoff and attempt limit as start_home.  Returns True if it logged in.
+        credentials = self.home_credentials[account_id]
+        if not self.login_allowed(account_id, credentials):
+            return False
+        try:
+            await self.scheduler.run(BACKGROUND, nexia_home.login, timeout=HOME_UPDATE_TIMEOUT)
+        except Exception as e:
+            self.login_failed(account_id, self.account_configs().get(account_id, (f"Account {account_id}",))[0], credentials, e)
+            return False
+        self.login_failures.pop(account_id, None)
+        return True
+
+    async def relogin(self, account_id):
+        # Log the account in again after Nexia rejected its session.  Calls that fail together share one login.
+        task = self.logins.get(account_id)
+        if task is None:
+            task = self.logins[account_id] = asyncio.ensure_future(self._relogin(account_id))
+            task.add_done_callback(lambda _task: self.logins.pop(account_id, None))
+        await asyncio.shield(task)
+
+    async def _relogin(self, account_id):
+        nexia_home = self.nexia_homes[account_id]
+        with self.metrics.timer("relogin", account=account_id):
+            await self.scheduler.run(INTERACTIVE, nexia_home.login, timeout=HOME_UPDATE_TIMEOUT)
+        self.logger.info(f"Account {account_id}: logged in again to home '{nexia_home.get_name()}'")
+
+    ########################################
+    # HTTP session
+    ########################################
+
+    def open_session(self):
+        self.session = new_session(self.transport, [self.metrics.trace_config()])
+        self.session_transport = self.transport
+
+    def check_transport(self):
+        # Open a new session when the transport settings changed, the homes switch to it for their next request.
+        # Not during a replay, which holds the live homes aside.
+        if self.transport == self.session_transport or self.replay_task is not None:
+            return
+        old_session = self.session
+        self.open_session()
+        for nexia_home in self.nexia_homes.values():
+            nexia_home.session = self.session
+        self.logger.info("Connection settings changed, using new connections to Nexia")
+        closer = self.event_loop.create_task(self.close_session(old_session, HOME_UPDATE_TIMEOUT))
+        self.session_closers.add(closer)
+        closer.add_done_callback(self.session_closers.discard)
+
+    @staticmethod
+    async def close_session(session, delay):
+        # give requests that are already using the session time to finish
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            await session.close()
+
+    ########################################
+    # Saved sessions and snapshots.  One file per account holding the login session and the last house JSON.
+    ########################################
+
+    def snapshot_path(self, account_id):
+        return f"{self.prefs_folder}/account_{account_id}.json"
+
+    def restore_home(self, account_id, name, username, password, brand):
+        # Create the account's home from its saved snapshot and push the saved states, without any network access
+        try:
+            with open(self.snapshot_path(account_id)) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            self.logger.warning(f"{name}: unable to read saved snapshot: {e!r}")
+            return
+        if snapshot.get("version") != SNAPSHOT_VERSION or snapshot.get("username") != username or snapshot.get("brand") != brand:
+            self.logger.debug(f"{name}: saved snapshot is for a different account, ignoring it")
+            return
+
+        nexia_home = self.new_home(username, password, brand)
+        try:
+            nexia_home.update_from_json(snapshot["house_json"])
+        except Exception as e:
+            self.logger.warning(f"{name}: unable to load saved snapshot: {e!r}")
+            return
+        nexia_home.house_id = snapshot["house_id"]
+        nexia_home.mobile_id = snapshot["mobile_id"]
+        nexia_home.api_key = snapshot["api_key"]
+
+        self.nexia_homes[account_id] = nexia_home
+        self.home_credentials[account_id] = (username, password, brand)
+        self.restored_homes.add(account_id)
+        age = (time.time() - snapshot.get("saved", 0.0)) / 60.0
+        self.logger.info(f"{name}: restored home '{nexia_home.get_name()}' from snapshot saved {age:.0f} minutes ago")
+        self.update_account_status(account_id, "Cached")
+        self.update_devices(account_id)
+
+    async def save_snapshot(self, account_id, nexia_home, house_json):
+        # house_json is None when the house hasn't changed since the last update, the saved copy is still current
+        if not house_json:
+            return
+        saved_time, saved_key = self.snapshots_saved.get(account_id, (0.0, None))
+        if saved_key == nexia_home.api_key and time.time() - saved_time < SNAPSHOT_INTERVAL:
+            return
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "saved": time.time(),
+            "username": nexia_home.username,
+            "brand": nexia_home.brand,
+            "house_id": nexia_home.house_id,
+            "mobile_id": nexia_home.mobile_id,
+            "api_key": nexia_home.api_key,
+            "house_json": house_json,
+        }
+        try:
+            await asyncio.to_thread(self.write_snapshot, self.snapshot_path(account_id), snapshot)
+            self.snapshots_saved[account_id] = (snapshot["saved"], nexia_home.api_key)
+        except Exception as e:
+            self.logger.warning(f"Account {account_id}: unable to save snapshot: {e!r}")
+
+    @staticmethod
+    def write_snapshot(path, snapshot):
+        write_atomic(path, json.dumps(snapshot))
+
+    async def async_main(self):
+        self.logger.debug(f"async_main: running")
+        """Create the aiohttp session and run."""
+        self.open_session()
+        self.startup_profile.mark("session")
+        try:
+            await self.supervise()
+        finally:
+            if self.replay_task is not None:
+                self.replay_task.cancel()
+                await asyncio.gather(self.replay_task, return_exceptions=True)
+            for closer in list(self.session_closers):
+                closer.cancel()
+            await asyncio.gather(*self.session_closers, return_exceptions=True)
+            await self.session.close()
+
+        self.logger.debug("async_main: stopping")
+
+    async def supervise(self):
+        # Run the main loop, and restart it after an unexpected error instead of letting the async thread end
+        failures = 0
+        while not self.stopThread:
+            started = time.monotonic()
+            try:
+                await self.main_loop()
+                return
+            except Exception as e:
+                failures = 1 if time.monotonic() - started > RESTART_RESET else failures + 1
+                delay = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_INITIAL * 2.0 ** (failures - 1)) * random.uniform(0.75, 1.25)
+                self.logger.exception(f"async_main: unexpected error {e!r}, restarting in {delay:.0f} seconds")
+                self.metrics.inc("loop_restarts_total")
+                await asyncio.sleep(delay)
+
+    async def main_loop(self):
+        # restores saved snapshots first, so devices have states while the logins and updates run
+        self.update_needed = False
+        await self.do_update()
+        self.next_update = time.time() + self.adapt_poll_interval()
+        if not self.nexia_homes:
+            self.logger.warning(f"async_main: no Nexia accounts logged in, will retry at the next update")
+
+        while not self.stopThread:
+            if self.replay_task is not None:
+                # live updates wait for the replay to finish, so they don't overwrite the replayed states
+                await asyncio.wait([self.replay_task], timeout=max(0.0, self.next_housekeeping() - time.time()))
+                await self.housekeeping()
+                continue
+            if not (self.update_needed or self.refresh_thermostats):
+                wake_time = max(time.time(), min(self.next_update, self.next_housekeeping()))
+                try:
+                    await asyncio.wait_for(self.wake_event.wait(), timeout=max(0.0, wake_time - time.time()))
+                except asyncio.TimeoutError:
+                    # how late the loop woke up, a busy event loop shows up here first
+                    self.metrics.observe("loop_lag_seconds", max(0.0, time.time() - wake_time))
+            self.wake_event.clear()
+            await self.housekeeping()
+
+            if self.update_needed or self.refresh_thermostats:
+                if not self.new_accounts:       # a new account is set up right away
+                    await asyncio.sleep(UPDATE_DEBOUNCE)
+                    self.wake_event.clear()
+            elif time.time() < self.next_update:
+                continue        # woken up early, but nothing to do yet
+
+            if self.update_needed or time.time() >= self.next_update:
+                self.update_needed = False
+                self.refresh_thermostats = set()
+                self.next_update = time.time() + self.poll_interval
+                async with self.update_lock:
+                    await self.do_update()
+                self.next_update = time.time() + self.adapt_poll_interval()
+            else:
+                # targeted refresh, the full update stays on its normal schedule
+                thermostat_ids = self.refresh_thermostats
+                self.refresh_thermostats = set()
+                async with self.update_lock:
+                    await self.do_refresh(thermostat_ids)
 
     async def do_update(self):
-        await self.nexia_home.update()
-
-        for dev_id in self.nexia_thermostats:
-            device = indigo.devices[dev_id]
-#            thermostat_id = int(device.pluginProps['nexia_thermostat'])
-            thermostat_id = device.pluginProps['nexia_thermostat']
-            self.logger.debug(f"{device.name}: starting update for thermostat {thermostat_id}")
-            thermostat = self.nexia_home.get_thermostat_by_id(thermostat_id)
+        # Update all homes concurrently.  Each one pushes its own device states as soon as its data arrives.
+        self.states_pushed = 0
+        self.states_skipped = 0
+        self.new_accounts = set()       # start_homes sets them up
+        with self.metrics.timer("poll"):
+            started = await self.start_homes()
+            await asyncio.gather(*(self.update_home(account_id) for account_id in list(self.nexia_homes) if account_id not in started))
+        self.metrics.inc("states_pushed_total", self.states_pushed)
+        self.metrics.inc("states_skipped_total", self.states_skipped)
+        self.logger.debug("do_update: pushed %d states, skipped %d unchanged", self.states_pushed, self.states_skipped)
+
+    async def do_refresh(self, thermostat_ids):
+        # Fetch only the given (account_id, thermostat_id) thermostats, then push states for them and their zones.
+        # These confirm commands, so they go in the interactive lane.
+        self.states_pushed = 0
+        self.states_skipped = 0
+        for account_id, thermostat_id in thermostat_ids:
+            if account_id not in self.nexia_homes:
+                continue
+            try:
+                with self.metrics.timer("thermostat_refresh"):
+                    thermostat = self.nexia_homes[account_id].get_thermostat_by_id(thermostat_id)
+                    await self.scheduler.run(INTERACTIVE, thermostat.refresh_thermostat_data, timeout=HOME_UPDATE_TIMEOUT,
+                                             relogin=partial(self.relogin, account_id))
+            except Exception as e:
+                self.logger.warning(f"do_refresh: refresh of thermostat {thermostat_id} failed: {e}")
+                continue
+            self.update_devices(account_id, {thermostat_id}, fetched=True)
+        self.metrics.inc("states_pushed_total", self.states_pushed)
+        self.metrics.inc("states_skipped_total", self.states_skipped)
+        self.logger.debug("do_refresh: thermostats %s, pushed %d states, skipped %d unchanged", thermostat_ids, self.states_pushed, self.states_skipped)
+
+    def update_devices(self, account_id, thermostat_ids=None, fetched=False):
+        # Push states to the account's thermostat and zone devices, limited to thermostat_ids if given.  fetched is
+        # True right after the data was fetched from Nexia, only then are the values recorded as telemetry samples.
+        start = time.perf_counter()
+        self._update_devices(account_id, thermostat_ids, fetched)
+        self.publish_house(account_id)
+        self.metrics.observe("update_devices_seconds", time.perf_counter() - start)
+        # startup ends with the first device states from Nexia, not from a snapshot or a replay
+        if not self.startup_profile.done and account_id not in self.restored_homes and self.replay_task is None and self.startup_profile.reached("first_state"):
+            self.startup_profile.mark("first_live_state")
+            self.startup_profile.finish(self.metrics)
+
+    def _update_devices(self, account_id, thermostat_ids, fetched):
+        self.reindex_account(account_id)
+        entries = [entry for entry in list(self.device_index.values()) if entry['account'] == account_id and entry['thermostat'] is not None]
+        for entry in entries:
+            device, thermostat = entry['device'], entry['thermostat']
+            if device.deviceTypeId != 'NexiaThermostat':
+                continue
+            if thermostat_ids is not None and thermostat.thermostat_id not in thermostat_ids:
+                continue
+            self.logger.debug("%s: starting update for thermostat %s", device.name, thermostat.thermostat_id)
             update_list = [
                 {'key': "thermostat_name", 'value': thermostat.get_name()},
                 {'key': "thermostat_model", 'value': thermostat.get_model()},
@@ -201,19 +1215,19 @@ class Plugin(indigo.PluginBase):
 
                 {'key': "is_blower_active", 'value': thermostat.is_blower_active()},
             ]
-            try:
-                self.logger.threaddebug(f"do_update: update_list: {update_list}")
-                device.updateStatesOnServer(update_list)
-            except Exception as e:
-                self.logger.error(f"{device.name}: failed to update states: {e}")
-
-        for zone_id in self.nexia_zones:
-            device = indigo.devices[zone_id]
-            thermostat_id = int(device.pluginProps['nexia_thermostat'])
-            zone_id = int(device.pluginProps['nexia_zone'])
-            self.logger.debug(f"{device.name}: starting update for zone {thermostat_id}:{zone_id}")
-            thermostat = self.nexia_home.get_thermostat_by_id(thermostat_id)
-            zone = thermostat.get_zone_by_id(zone_id)
+            update_list.extend(self.analytics_states(account_id, device, thermostat))
+            self.fire_events(device, self.change_detector.changes(device.id, THERMOSTAT_WATCHED, thermostat))
+            self.push_states(device, self.reconcile_states(device, update_list))
+            if fetched:
+                self.record_telemetry(account_id, device, update_list)
+
+        for entry in entries:
+            device, thermostat, zone = entry['device'], entry['thermostat'], entry['zone']
+            if device.deviceTypeId != 'NexiaZone' or zone is None:
+                continue
+            if thermostat_ids is not None and thermostat.thermostat_id not in thermostat_ids:
+                continue
+            self.logger.debug("%s: starting update for zone %s:%s", device.name, thermostat.thermostat_id, zone.zone_id)
             update_list = [
                 {'key': "temperatureInput1", 'value': zone.get_temperature()},
                 {'key': "setpointHeat", 'value': zone.get_heating_setpoint()},
@@ -229,11 +1243,34 @@ class Plugin(indigo.PluginBase):
                 {'key': "is_native_zone", 'value': zone.is_native_zone()},
                 {'key': "is_in_permanent_hold", 'value': zone.is_in_permanent_hold()},
             ]
-            try:
-                self.logger.threaddebug(f"do_update: update_list: {update_list}")
-                device.updateStatesOnServer(update_list)
-            except Exception as e:
-                self.logger.error(f"{device.name}: failed to update states: {e}")
+            update_list.extend(self.analytics_states(account_id, device, thermostat, zone))
+            self.fire_events(device, self.change_detector.changes(device.id, ZONE_WATCHED, thermostat, zone))
+            self.push_states(device, self.reconcile_states(device, update_list))
+            if fetched:
+                self.record_telemetry(account_id, device, update_list)
+
+    def push_states(self, device, update_list):
+        # Only send the states whose value differs from the last successful push to this device.
+        cache = self.state_cache.setdefault(device.id, {})
+        changed = [item for item in update_list if item['key'] not in cache or cache[item['key']] != item['value']]
+        self.states_skipped += len(update_list) - len(changed)
+        if not changed:
+            self.logger.threaddebug("%s: no state changes", device.name)
+            return
+
+        try:
+            self.logger.threaddebug("push_states: %s: changed: %s", device.name, changed)
+            with self.metrics.timer("push_states"):
+                device.updateStatesOnServer(changed)
+        except Exception as e:
+            self.logger.error(f"{device.name}: failed to update states: {e}")
+            return
+
+        for item in changed:
+            cache[item['key']] = item['value']
+        self.states_pushed += len(changed)
+        if device.deviceTypeId != 'NexiaAccount':
+            self.startup_profile.mark("first_state")
 
     ########################################
 
@@ -242,7 +1279,16 @@ class Plugin(indigo.PluginBase):
         errorsDict = indigo.Dict()
         valid = True
 
-        if typeId == "NexiaThermostat":
+        if typeId == "NexiaAccount":
+            if len(valuesDict["username"]) == 0:
+                errorsDict["username"] = "Username is required"
+                valid = False
+            if len(valuesDict["password"]) == 0:
+                errorsDict["password"] = "Password is required"
+                valid = False
+            valuesDict["address"] = valuesDict["username"]
+
+        elif typeId == "NexiaThermostat":
             if len(valuesDict["nexia_thermostat"]) == 0:
                 errorsDict["nexia_thermostat"] = "No Thermostat Specified"
                 self.logger.warning("validateDeviceConfigUi - No Thermostat Specified")
@@ -268,29 +1314,147 @@ class Plugin(indigo.PluginBase):
     def deviceStartComm(self, device):
 
         self.logger.info(f"{device.name}: Starting {device.deviceTypeId} Device {device.id}")
+        self.startup_profile.mark("first_device")
+        self.startup_profile.mark("last_device", again=True)
         device.stateListOrDisplayStateIdChanged()
+        self.call_in_loop(self.device_started, device)
 
-        if device.deviceTypeId == 'NexiaThermostat':
+        if device.deviceTypeId == 'NexiaAccount':
 
-            self.nexia_thermostats[device.id] = device.name
-            self.update_needed = True
+            self.nexia_accounts = {**self.nexia_accounts, device.id: device.name}
+            counts = self.command_counts.get(device.id, {'outstanding': 0, 'failed': 0})
+            device.updateStatesOnServer([{'key': "status", 'value': "Starting"},
+                                         {'key': "commands_outstanding", 'value': counts['outstanding']},
+                                         {'key': "commands_failed", 'value': counts['failed']}])
+
+        elif device.deviceTypeId == 'NexiaThermostat':
+
+            self.nexia_thermostats = {**self.nexia_thermostats, device.id: device.name}
 
         elif device.deviceTypeId == 'NexiaZone':
 
-            self.nexia_zones[device.id] = device.name
-            self.update_needed = True
+            self.nexia_zones = {**self.nexia_zones, device.id: device.name}
 
     def deviceStopComm(self, device):
 
         self.logger.info(f"{device.name}: Stopping {device.deviceTypeId} Device {device.id}")
+        self.call_in_loop(self.device_stopped, device)
 
-        if device.deviceTypeId == 'NexiaThermostat':
-            if device.id in self.nexia_thermostats:
-                del self.nexia_thermostats[device.id]
+        if device.deviceTypeId == 'NexiaAccount':
+            self.nexia_accounts = {dev_id: name for dev_id, name in self.nexia_accounts.items() if dev_id != device.id}
+
+        elif device.deviceTypeId == 'NexiaThermostat':
+            self.nexia_thermostats = {dev_id: name for dev_id, name in self.nexia_thermostats.items() if dev_id != device.id}
 
         elif device.deviceTypeId == 'NexiaZone':
-            if device.id in self.nexia_zones:
-                del self.nexia_zones[device.id]
+            self.nexia_zones = {dev_id: name for dev_id, name in self.nexia_zones.items() if dev_id != device.id}
+
+    def deviceDeleted(self, device):
+        # Stops the device, then drops its runtime history, which a stopped device keeps
+        indigo.PluginBase.deviceDeleted(self, device)
+        self.call_in_loop(self.analytics.forget, device.id)
+
+    def device_started(self, device):
+        # Event loop side of deviceStartComm.  A thermostat or zone whose home is loaded already (restored or live)
+        # gets its states from it right away, anything else waits for an update.  A new account is set up by that
+        # update without the debounce.
+        self.state_cache.pop(device.id, None)     # force a full push on the next update
+        if device.deviceTypeId == 'NexiaAccount':
+            self.new_accounts.add(device.id)
+            self.request_update()
+            return
+        self.index_device(device)
+        if self.device_index[device.id]['thermostat'] is None or not (self.event_loop and self.event_loop.is_running()):
+            self.request_update()
+            return
+        if not self.started_devices:
+            self.event_loop.call_soon(self.push_started_devices)
+        self.started_devices.add(device.id)
+
+    def push_started_devices(self):
+        # Devices started together are pushed together, one pass per thermostat
+        thermostats = {}
+        for dev_id in self.started_devices:
+            entry = self.device_index.get(dev_id)
+            if entry is not None and entry['thermostat'] is not None:
+                thermostats.setdefault(entry['account'], set()).add(entry['thermostat'].thermostat_id)
+        self.started_devices = set()
+        for account_id, thermostat_ids in thermostats.items():
+            self.update_devices(account_id, thermostat_ids)
+
+    def device_stopped(self, device):
+        # event loop side of deviceStopComm.  A stopped account's home is dropped, so changed credentials are used
+        # when it starts again.
+        self.state_cache.pop(device.id, None)
+        self.change_detector.forget(device.id)
+        if device.deviceTypeId == 'NexiaAccount':
+            self.drop_home(device.id)
+        elif device.deviceTypeId in ('NexiaThermostat', 'NexiaZone'):
+            self.unindex_device(device)
+
+    ########################################
+    # Events.  Fired from the event loop when a fetch shows that a watched thermostat or zone value changed.
+    ########################################
+
+    def triggerStartProcessing(self, trigger):
+        self.logger.debug(f"{trigger.name}: Adding Trigger")
+        self.triggers[trigger.id] = trigger
+
+    def triggerStopProcessing(self, trigger):
+        self.logger.debug(f"{trigger.name}: Removing Trigger")
+        self.triggers.pop(trigger.id, None)
+
+    def fire_events(self, device, changes):
+        # changes is {field: (old, new)} from the change detector, see events.py for the watched fields
+        if not changes or (self.replay_task is not None and not self.replay_events):
+            return
+        if 'online' in changes:
+            connection = "online" if changes['online'][1] else "offline"
+            self.logger.info(f"{device.name}: thermostat is {connection}")
+            self.execute_triggers("thermostatConnection", device, connection=connection)
+        if 'system_status' in changes:
+            old, new = changes['system_status']
+            self.logger.debug("%s: system status changed from '%s' to '%s'", device.name, old, new)
+            self.execute_triggers("systemStatusChanged", device, status=new)
+        if 'calling' in changes:
+            calling = "started" if changes['calling'][1] else "stopped"
+            self.logger.debug("%s: %s calling", device.name, calling)
+            self.execute_triggers("zoneCalling", device, calling=calling)
+
+        # Setpoint changes that confirm one of our commands aren't external.  Checked before reconcile_states
+        # takes the finished commands out of self.unconfirmed.
+        if device.id in self.unconfirmed or self.held_states(device.id):
+            return
+        setpoints = []
+        for field, setpoint in (('setpointHeat', "heat"), ('setpointCool', "cool")):
+            if field in changes:
+                old, new = changes[field]
+                self.logger.info(f"{device.name}: {setpoint} setpoint changed externally from {old} to {new}")
+                setpoints.append(setpoint)
+        if setpoints:
+            self.execute_triggers("setpointChanged", device, setpoint=tuple(setpoints))
+
+    def execute_triggers(self, event_type, device, **values):
+        # A trigger's device "0" matches any device.  Each other prop given in values matches if the trigger has
+        # no value for it, "any", or the same value (case insensitive).  A tuple value matches any of its items,
+        # so one change event fires each trigger at most once.
+        for trigger in list(self.triggers.values()):
+            if trigger.pluginTypeId != event_type:
+                continue
+            props = trigger.pluginProps
+            if props.get("deviceId", "0") not in ("0", "", str(device.id)):
+                continue
+            if any(str(props.get(key, "")).lower() not in ("", "any", *(str(item).lower() for item in (value if isinstance(value, tuple) else (value,))))
+                   for key, value in values.items()):
+                continue
+            self.logger.debug("%s: executing for %s", trigger.name, device.name)
+            indigo.trigger.execute(trigger)
+
+    def triggerDeviceList(self, filter="", valuesDict=None, typeId="", targetId=0):
+        # filter is the device type id the event applies to
+        names = self.nexia_zones if filter == 'NexiaZone' else self.nexia_thermostats
+        devices = [(str(dev_id), name) for dev_id, name in names.items()]
+        return [("0", "- Any -")] + sorted(devices, key=lambda item: item[1])
 
     ########################################
     #
@@ -298,13 +1462,20 @@ class Plugin(indigo.PluginBase):
     #
     ########################################
 
+    def get_account_list(self, filter="", valuesDict=None, typeId="", targetId=0):
+        self.logger.threaddebug(f"get_account_list: typeId = {typeId}, targetId = {targetId}, valuesDict = {valuesDict}")
+        return [(str(account_id), config[0]) for account_id, config in self.account_configs().items()]
+
     def get_thermostat_list(self, filter="", valuesDict=None, typeId="", targetId=0):
         self.logger.threaddebug(f"get_thermostat_list: typeId = {typeId}, targetId = {targetId}, valuesDict = {valuesDict}")
 
-        device_list = []
-        for thermostat_id in self.nexia_home.get_thermostat_ids():
-            name = self.nexia_home.get_thermostat_by_id(thermostat_id).get_name()
-            device_list.append((thermostat_id, name))
+        try:
+            house = self.houses[int(valuesDict.get("nexia_account", PREFS_ACCOUNT) or PREFS_ACCOUNT)]
+        except (Exception,):
+            self.logger.debug("get_thermostat_list: account not selected or not logged in, returning empty list")
+            return []
+
+        device_list = [(thermostat.thermostat_id, thermostat.name) for thermostat in house.thermostats.values()]
 
         self.logger.threaddebug(f"get_thermostat_list: device_list for {typeId} ({filter}) = {device_list}")
         return device_list
@@ -313,16 +1484,13 @@ class Plugin(indigo.PluginBase):
         self.logger.threaddebug(f"get_zone_list: typeId = {typeId}, targetId = {targetId}, filter = {filter}, valuesDict = {valuesDict}")
 
         try:
-            thermostat_id = int(valuesDict["nexia_thermostat"])
+            house = self.houses[int(valuesDict.get("nexia_account", PREFS_ACCOUNT) or PREFS_ACCOUNT)]
+            zones = house.thermostats[str(valuesDict["nexia_thermostat"])].zones
         except (Exception,):
-            self.logger.debug("get_zone_list: no thermostat selected, returning empty list")
+            self.logger.debug("get_zone_list: no account or thermostat selected, returning empty list")
             return []
 
-        device_list = []
-        thermostat = self.nexia_home.get_thermostat_by_id(thermostat_id)
-        for zone_id in thermostat.get_zone_ids():
-            name = thermostat.get_zone_by_id(zone_id).get_name()
-            device_list.append((zone_id, name))
+        device_list = [(zone.zone_id, zone.name) for zone in zones.values()]
 
         self.logger.threaddebug(f"get_zone_list: device_list for {typeId} ({filter}) = {device_list}")
         return device_list
@@ -349,20 +1517,26 @@ class Plugin(indigo.PluginBase):
                 self.logger.warning(f"{device.name}: SetHvacMode not supported for NexiaThermostat devices")
                 return
 
-            hvac_mode = kHvacModeEnumToStrMap.get(action.actionMode, "unknown")
+            hvac_mode = kHvacModeEnumToStrMap.get(action.actionMode)
+            if hvac_mode is None:
+                self.logger.warning(f"{device.name}: HVAC mode {action.actionMode} not supported")
+                return
             self.logger.debug(f"{device.name}: HVAC mode set to: {hvac_mode}")
-            thermostat = self.nexia_home.get_thermostat_by_id(int(device.pluginProps['nexia_thermostat']))
-            zone = thermostat.get_zone_by_id(int(device.pluginProps['nexia_zone']))
-            asyncio.run_coroutine_threadsafe(zone.set_mode(hvac_mode), self.event_loop)
-            self.update_needed = True
+            self.queue_zone_write(device, mode=hvac_mode)
 
         elif action.thermostatAction == indigo.kThermostatAction.SetFanMode:
 
             fan_mode = kFanModeEnumToStrMap.get(action.actionMode, "auto")
+            try:
+                thermostat, _zone = self.device_view(device)
+            except KeyError as e:
+                self.logger.warning(f"{device.name}: SetFanMode not sent: {e}")
+                return
+            # set_fan_mode takes the thermostat's own label for the mode, like "Auto"
+            fan_mode = next((label for label in thermostat.fan_modes if label.lower() == fan_mode.lower()), fan_mode)
             self.logger.debug(f"{device.name}: Fan mode set to: {fan_mode}")
-            thermostat = self.nexia_home.get_thermostat_by_id(int(device.pluginProps['nexia_thermostat']))
-            asyncio.run_coroutine_threadsafe(thermostat.set_fan_mode(fan_mode), self.event_loop)
-            self.update_needed = True
+            states = {'fan_mode': fan_mode} if device.deviceTypeId == 'NexiaThermostat' else {}
+            self.send_command(Command('thermostat', 'set_fan_mode', (fan_mode,)), device, states)
 
         elif action.thermostatAction == indigo.kThermostatAction.SetCoolSetpoint:
             newSetpoint = action.actionValue
@@ -373,26 +1547,31 @@ class Plugin(indigo.PluginBase):
             self.handleChangeSetpointAction(device, newSetpoint, "setpointHeat")
 
         elif action.thermostatAction == indigo.kThermostatAction.DecreaseCoolSetpoint:
-            newSetpoint = device.coolSetpoint - action.actionValue
+            newSetpoint = self.pending_zone_value(device, "cool", device.coolSetpoint) - action.actionValue
             self.handleChangeSetpointAction(device, newSetpoint, "setpointCool")
 
         elif action.thermostatAction == indigo.kThermostatAction.IncreaseCoolSetpoint:
-            newSetpoint = device.coolSetpoint + action.actionValue
+            newSetpoint = self.pending_zone_value(device, "cool", device.coolSetpoint) + action.actionValue
             self.handleChangeSetpointAction(device, newSetpoint, "setpointCool")
 
         elif action.thermostatAction == indigo.kThermostatAction.DecreaseHeatSetpoint:
-            newSetpoint = device.heatSetpoint - action.actionValue
+            newSetpoint = self.pending_zone_value(device, "heat", device.heatSetpoint) - action.actionValue
             self.handleChangeSetpointAction(device, newSetpoint, "setpointHeat")
 
         elif action.thermostatAction == indigo.kThermostatAction.IncreaseHeatSetpoint:
-            newSetpoint = device.heatSetpoint + action.actionValue
+            newSetpoint = self.pending_zone_value(device, "heat", device.heatSetpoint) + action.actionValue
             self.handleChangeSetpointAction(device, newSetpoint, "setpointHeat")
 
         elif action.thermostatAction in [indigo.kThermostatAction.RequestStatusAll, indigo.kThermostatAction.RequestMode,
                                          indigo.kThermostatAction.RequestEquipmentState, indigo.kThermostatAction.RequestTemperatures,
                                          indigo.kThermostatAction.RequestHumidities,
                                          indigo.kThermostatAction.RequestDeadbands, indigo.kThermostatAction.RequestSetpoints]:
-            self.update_needed = True
+            try:
+                thermostat, _zone = self.device_view(device)
+            except KeyError as e:
+                self.logger.warning(f"{device.name}: status request not sent: {e}")
+                return
+            self.request_update(self.device_account(device), thermostat.thermostat_id)
 
         else:
             self.logger.warning(f"{device.name}: Unimplemented action.thermostatAction: {action.thermostatAction}")
@@ -407,18 +1586,77 @@ class Plugin(indigo.PluginBase):
             return
 
         self.logger.debug(f"{device.name}: handleChangeSetpointAction: setpoint {newSetpoint} {stateKey}")
-        thermostat = self.nexia_home.get_thermostat_by_id(int(device.pluginProps['nexia_thermostat']))
-        zone = thermostat.get_zone_by_id(int(device.pluginProps['nexia_zone']))
 
         if stateKey == "setpointCool":
-            self.logger.info(f'{device.name}: set cool to: {newSetpoint} and leave heat at: {device.heatSetpoint}')
-            asyncio.run_coroutine_threadsafe(zone.set_heat_cool_temp(device.heatSetpoint, newSetpoint), self.event_loop)
+            self.logger.info(f'{device.name}: set cool to: {newSetpoint}')
+            self.queue_zone_write(device, cool=newSetpoint)
         elif stateKey == "setpointHeat":
-            self.logger.info(f'{device.name}: set heat to: {newSetpoint} and leave cool at: {device.coolSetpoint}')
-            asyncio.run_coroutine_threadsafe(zone.set_heat_cool_temp(newSetpoint, device.coolSetpoint), self.event_loop)
+            self.logger.info(f'{device.name}: set heat to: {newSetpoint}')
+            self.queue_zone_write(device, heat=newSetpoint)
         else:
             self.logger.error(f'{device.name}: handleChangeSetpointAction Invalid operation - {stateKey}')
-        self.update_needed = True
+
+    ########################################
+    # Zone write queue.  Changes to the same zone are merged for WRITE_COALESCE_WINDOW seconds, then sent
+    # as one set_mode, set_preset and set_heat_cool_temp call each, using the latest requested values.
+    ########################################
+
+    def queue_zone_write(self, zone_device, **changes):
+        if self.replay_task is not None:
+            self.logger.warning(f"{zone_device.name}: zone write not sent, a capture is being replayed")
+            return
+        if 'mode' in changes and changes['mode'] not in kHvacModeStrToEnumMap:
+            self.logger.warning(f"{zone_device.name}: zone write not sent, unknown HVAC mode {changes['mode']}")
+            return
+        states = {ZONE_WRITE_STATES[key]: kHvacModeStrToEnumMap[value] if key == 'mode' else value for key, value in changes.items()}
+        with self.zone_writes_lock:
+            pending = self.zone_writes.get(zone_device.id)
+            if pending is None:
+                pending = self.zone_writes[zone_device.id] = {'requests': 0}
+                pending['command'] = self.start_command("zone_write", partial(self.flush_zone_writes, zone_device.id), zone_device, states)
+            else:
+                self.add_command_states(pending['command'], zone_device, states)
+            if 'preset' in changes:
+                # a preset replaces both setpoints, so setpoints requested before it are obsolete
+                pending.pop('heat', None)
+                pending.pop('cool', None)
+            pending.update(changes)
+            pending['requests'] += 1
+
+    def pending_zone_value(self, zone_device, key, default):
+        # Relative setpoint changes must build on values that are queued but not yet sent
+        with self.zone_writes_lock:
+            return self.zone_writes.get(zone_device.id, {}).get(key, default)
+
+    async def flush_zone_writes(self, dev_id):
+        await asyncio.sleep(WRITE_COALESCE_WINDOW)
+        with self.zone_writes_lock:
+            pending = self.zone_writes.pop(dev_id, None)
+        if not pending:
+            return
+        if self.replay_task is not None:
+            raise RuntimeError("not sent, a capture is being replayed")
+
+        entry = self.lookup(self.device_index[dev_id]['device'])
+        zone_device, thermostat, zone = entry['device'], entry['thermostat'], entry['zone']
+        requests = pending.pop('requests')
+        pending.pop('command')
+        if requests > 1:
+            self.writes_merged += requests - 1
+            self.logger.debug("%s: merged %d zone writes into one (%d merged since startup)", zone_device.name, requests, self.writes_merged)
+
+        relogin = partial(self.relogin, self.device_account(zone_device))
+        try:
+            with self.metrics.timer("zone_write"):
+                if 'mode' in pending:
+                    await self.scheduler.run(INTERACTIVE, partial(zone.set_mode, pending['mode']), relogin=relogin)
+                if 'preset' in pending:
+                    await self.scheduler.run(INTERACTIVE, partial(zone.set_preset, pending['preset']), relogin=relogin)
+                if 'heat' in pending or 'cool' in pending:
+                    # a setpoint that wasn't changed is passed as None, set_heat_cool_temp keeps it within the deadband
+                    await self.scheduler.run(INTERACTIVE, partial(zone.set_heat_cool_temp, pending.get('heat'), pending.get('cool')), relogin=relogin)
+        finally:
+            self.request_update(self.device_account(zone_device), thermostat.thermostat_id)
 
     ########################################
     # Menu callbacks
@@ -426,8 +1664,8 @@ class Plugin(indigo.PluginBase):
 
     def menuResumeAllSchedules(self):
         self.logger.debug("menuResumeAllSchedules")
-        for devId in self.nexia_zones:
-            self.resume_zone_schedule(indigo.devices[devId])
+        zone_devices = [indigo.devices[dev_id] for dev_id in self.nexia_zones]
+        self.send_bulk("Resume All Schedules", zone_devices, Command('zone', 'call_return_to_schedule', ()), {'is_in_permanent_hold': False})
         return True
 
     def menuResumeSchedule(self, valuesDict, _typeId):
@@ -442,20 +1680,231 @@ class Plugin(indigo.PluginBase):
         return True
 
     def resume_zone_schedule(self, zone_device):
-        thermostat = self.nexia_home.get_thermostat_by_id(int(zone_device.pluginProps['nexia_thermostat']))
-        zone = thermostat.get_zone_by_id(int(zone_device.pluginProps['nexia_zone']))
-        asyncio.run_coroutine_threadsafe(zone.call_return_to_schedule(), self.event_loop)
-        self.update_needed = True
+        self.send_command(Command('zone', 'call_return_to_schedule', ()), zone_device, {'is_in_permanent_hold': False})
+
+    ########################################
+    # Bulk zone operations.  One command per zone, run together with at most BULK_CONCURRENCY in flight,
+    # followed by one refresh of the thermostats involved.
+    ########################################
+
+    def send_bulk(self, name, zone_devices, command, states=None):
+        # Sends the zone Command to each zone device.  Returns a concurrent future with the results.
+        jobs = []
+        if self.replay_task is not None:
+            self.logger.warning(f"{name}: not sent, a capture is being replayed")
+            zone_devices = []
+        for zone_device in zone_devices:
+            try:
+                thermostat, _zone = self.device_view(zone_device)
+            except KeyError as e:
+                self.logger.warning(f"{name}: skipping {zone_device.name}: {e}")
+                continue
+            command_id = next(self.command_ids)
+            self.event_loop.call_soon_threadsafe(self._command_sent, command_id, command.method, zone_device, states or {})
+            jobs.append((command_id, zone_device, thermostat.thermostat_id))
+        return asyncio.run_coroutine_threadsafe(self.run_bulk(name, command, jobs), self.event_loop)
+
+    async def run_bulk(self, name, command, jobs):
+        semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+        async def run(command_id, zone_device):
+            async with semaphore:
+                run_command = partial(self.scheduler.run, INTERACTIVE, self.command_factory(command, zone_device),
+                                      relogin=partial(self.relogin, self.device_account(zone_device)))
+                return await self.tracked_command(command_id, command.method, run_command)
+
+        start = time.perf_counter()
+        errors = await asyncio.gather(*(run(command_id, zone_device) for command_id, zone_device, _thermostat_id in jobs))
+        for account_id, thermostat_id in {(self.device_account(zone_device), thermostat_id) for _command_id, zone_device, thermostat_id in jobs}:
+            self._update_requested(account_id, thermostat_id)
+
+        results = {zone_device.id: "ok" if error is None else f"{type(error).__name__}: {error}" for (_command_id, zone_device, _thermostat_id), error in zip(jobs, errors)}
+        failed = [zone_device.name for (_command_id, zone_device, _thermostat_id), error in zip(jobs, errors) if error is not None]
+        self.logger.info(f"{name}: {len(jobs) - len(failed)} of {len(jobs)} zones done in {time.perf_counter() - start:.1f} seconds"
+                         + (f", failed: {', '.join(failed)}" if failed else ""))
+        return results
+
+    def bulk_zone_devices(self, props):
+        zones = self.nexia_zones
+        return [indigo.devices[int(dev_id)] for dev_id in props.get("zones", []) if int(dev_id) in zones]
+
+    def bulk_result(self, future, callerWaitingForResult):
+        # scripts using executeAction(..., waitUntilDone=True) get {zone device id: "ok" or the error}
+        if not callerWaitingForResult:
+            return None
+        try:
+            return future.result(timeout=BULK_RESULT_TIMEOUT)
+        except Exception as e:
+            self.logger.warning(f"bulk action did not finish: {e!r}")
+            return None
+
+    def bulkPresetGenerator(self, _filter, valuesDict, typeId, targetId):
+        self.logger.debug(f"bulkPresetGenerator: typeId = {typeId}, targetId = {targetId}")
+        presets = []
+        for house in self.houses.values():
+            for thermostat in house.thermostats.values():
+                for zone in thermostat.zones.values():
+                    presets.extend(preset for preset in zone.presets if preset not in presets)
+        return [(preset, preset) for preset in presets]
+
+    def bulkSetSetpointsAction(self, pluginAction, _device, callerWaitingForResult):
+        try:
+            heat = float(pluginAction.props["heat_setpoint"]) if pluginAction.props.get("heat_setpoint") else None
+            cool = float(pluginAction.props["cool_setpoint"]) if pluginAction.props.get("cool_setpoint") else None
+        except ValueError:
+            self.logger.error(f"bulkSetSetpointsAction: invalid setpoint in {dict(pluginAction.props)}")
+            return None
+        if heat is None and cool is None:
+            self.logger.error("bulkSetSetpointsAction: no heat or cool setpoint given")
+            return None
+        if heat is not None and cool is not None and heat >= cool:
+            self.logger.error(f"bulkSetSetpointsAction: heat setpoint {heat} must be below cool setpoint {cool}")
+            return None
+        states = {}
+        if heat is not None:
+            states["setpointHeat"] = heat
+        if cool is not None:
+            states["setpointCool"] = cool
+        self.logger.debug(f"bulkSetSetpointsAction: heat {heat}, cool {cool}")
+        future = self.send_bulk("Set Zone Setpoints", self.bulk_zone_devices(pluginAction.props), Command('zone', 'set_heat_cool_temp', (heat, cool)), states)
+        return self.bulk_result(future, callerWaitingForResult)
+
+    def bulkSetPresetAction(self, pluginAction, _device, callerWaitingForResult):
+        preset = pluginAction.props.get("zone_preset", None)
+        self.logger.debug(f"bulkSetPresetAction: {preset}")
+        future = self.send_bulk("Set Zone Presets", self.bulk_zone_devices(pluginAction.props), Command('zone', 'set_preset', (preset,)), {'zone_preset': preset})
+        return self.bulk_result(future, callerWaitingForResult)
+
+    def bulkHoldResumeAction(self, pluginAction, _device, callerWaitingForResult):
+        operation = pluginAction.props.get("operation", "resume")
+        self.logger.debug(f"bulkHoldResumeAction: {operation}")
+        if operation == "hold":
+            future = self.send_bulk("Hold Zones", self.bulk_zone_devices(pluginAction.props), Command('zone', 'call_permanent_hold', ()), {'is_in_permanent_hold': True})
+        else:
+            future = self.send_bulk("Resume Zone Schedules", self.bulk_zone_devices(pluginAction.props), Command('zone', 'call_return_to_schedule', ()), {'is_in_permanent_hold': False})
+        return self.bulk_result(future, callerWaitingForResult)
+
+    def menuShowMetrics(self):
+        self.logger.info("\n".join(self.metrics.summary()))
+        return True
 
     def menuDumpNexia(self):
-        for thermostat_id in self.nexia_home.get_thermostat_ids():
-            thermostat = self.nexia_home.get_thermostat_by_id(thermostat_id)
-            self.logger.info(f"\n{thermostat.get_name()}:\n{json.dumps(thermostat._thermostat_json, sort_keys=True, indent=4, separators=(',', ': '))}")
-            for zone_id in thermostat.get_zone_ids():
-                zone = thermostat.get_zone_by_id(zone_id)
-                self.logger.info(f"\n{zone.get_name()}:\n{json.dumps(zone._zone_json, sort_keys=True, indent=4, separators=(',', ': '))}")
+        # The JSON of a large house floods the Event Log, so it goes to a file and only the path is logged
+        if self.event_loop is None:
+            self.logger.warning("Nexia data not available, the plugin is not running")
+            return True
+        path = f"{self.prefs_folder}/nexia-data-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        try:
+            count, text = asyncio.run_coroutine_threadsafe(self.nexia_data(), self.event_loop).result(timeout=LOOP_CALL_TIMEOUT)
+            with open(path, "w") as f:
+                f.write(text)
+        except Exception as e:
+            self.logger.error(f"Unable to write Nexia data: {e!r}")
+            return True
+        self.logger.info(f"Nexia data for {count} account(s) written to {path}")
         return True
 
+    async def nexia_data(self):
+        # (number of accounts, JSON text) of every thermostat's data, serialized in the event loop between updates
+        data = {}
+        for account_id, nexia_home in self.nexia_homes.items():
+            data[account_id] = {thermostat.get_name(): thermostat._thermostat_json for thermostat in nexia_home.thermostats or []}
+        return len(data), json.dumps(data, sort_keys=True, indent=4, separators=(',', ': '))
+
+    ########################################
+    # Capture replay.  Feeds the snapshots of a capture file to the devices, with the recorded timing divided by
+    # 'speed' (0 for no pauses).  Live updates and commands are suspended meanwhile, and nothing is sent to Nexia.
+    ########################################
+
+    def captureFileList(self, filter="", valuesDict=None, typeId="", targetId=0):
+        return [(name, name) for name in reversed(capture_files(self.capture_folder))]
+
+    def menuReplayCapture(self, valuesDict, _typeId):
+        errorDict = indigo.Dict()
+        try:
+            speed = float(valuesDict.get("speed", "10"))
+            if speed < 0:
+                raise ValueError
+        except ValueError:
+            errorDict['speed'] = "Enter 0 or a positive number"
+            speed = 0.0
+        if not valuesDict.get("captureFile"):
+            errorDict['captureFile'] = "Select a capture file"
+        if len(errorDict) > 0:
+            return False, valuesDict, errorDict
+        path = f"{self.capture_folder}/{valuesDict['captureFile']}"
+        if not self.event_loop or not self.event_loop.is_running():
+            self.logger.error(f"Unable to replay {path}: the plugin hasn't started")
+            return True
+        self.event_loop.call_soon_threadsafe(self.start_replay, path, speed, bool(valuesDict.get("fireEvents", False)))
+        return True
+
+    def menuStopReplay(self):
+        if self.event_loop:
+            self.event_loop.call_soon_threadsafe(self.stop_replay)
+        return True
+
+    def start_replay(self, path, speed, fire_events):
+        if self.replay_task is not None:
+            self.logger.warning("A capture is already being replayed")
+            return
+        self.replay_events = fire_events
+        self.replay_task = self.event_loop.create_task(self.replay(path, speed))
+        self.wake_event.set()
+
+    def stop_replay(self):
+        if self.replay_task is not None:
+            self.replay_task.cancel()
+
+    async def replay(self, path, speed):
+        async with self.update_lock:
+            await self._replay(path, speed)
+        self.update_needed = True       # back to live data
+
+    async def _replay(self, path, speed):
+        accounts = self.account_configs()
+        live_homes = self.nexia_homes
+        self.nexia_homes = {}
+        self.change_detector = ChangeDetector()     # no events for the difference between live and recorded data
+        self.logger.info(f"Replaying {path} at {'full' if not speed else f'{speed:g}x'} speed")
+        records = read_capture(path)
+        count = 0
+        previous_ts = None
+        start = time.perf_counter()
+        try:
+            while True:
+                record = await asyncio.to_thread(next, records, None)     # read and parsed one at a time, off the loop
+                if record is None:
+                    break
+                # recorded accounts map to the same account, or to the only one configured here
+                account_id = record["account"] if record["account"] in accounts else next(iter(accounts)) if len(accounts) == 1 else None
+                if account_id is None:
+                    continue
+                if speed and previous_ts is not None:
+                    await asyncio.sleep(max(0.0, (record["ts"] - previous_ts) / speed))
+                previous_ts = record["ts"]
+
+                nexia_home = self.nexia_homes.get(account_id)
+                if nexia_home is None:
+                    _name, username, password, brand = accounts[account_id]
+                    nexia_home = self.nexia_homes[account_id] = self.new_home(username, password, brand)
+                with self.metrics.timer("replay_update"):
+                    nexia_home.update_from_json(record["house_json"])
+                    self.update_devices(account_id)
+                count += 1
+        except asyncio.CancelledError:
+            self.logger.info("Replay stopped")
+        except Exception as e:
+            self.logger.error(f"Replay of {path} failed: {e!r}")
+        finally:
+            self.nexia_homes = live_homes
+            for account_id in accounts:
+                self.reindex_account(account_id)
+                self.publish_house(account_id)
+            self.change_detector = ChangeDetector()
+            self.replay_task = None
+        self.logger.info(f"Replayed {count} snapshots in {time.perf_counter() - start:.1f} seconds")
+
     ########################################
     # Action callbacks
     ########################################
@@ -464,74 +1913,113 @@ class Plugin(indigo.PluginBase):
 
     def airCleanerModeGenerator(self, _filter, _valuesDict, typeId, targetId):
         self.logger.debug(f"airCleanerModeGenerator: typeId = {typeId}, targetId = {targetId}")
+        from nexia.const import AIR_CLEANER_MODES
         return [(mode, mode) for mode in AIR_CLEANER_MODES]
 
     def setAirCleanerModeAction(self, pluginAction, thermostat_device, _callerWaitingForResult):
         mode = pluginAction.props.get("cleaner_mode", "auto")
         self.logger.debug(f"{thermostat_device.name}: actionSetAirCleanerMode: {mode}")
-        thermostat = self.nexia_home.get_thermostat_by_id(int(thermostat_device.pluginProps['nexia_thermostat']))
-        if thermostat.has_air_cleaner():
-            asyncio.run_coroutine_threadsafe(thermostat.set_air_cleaner(mode), self.event_loop)
+        try:
+            thermostat, _zone = self.device_view(thermostat_device)
+        except KeyError as e:
+            self.logger.warning(f"{thermostat_device.name}: actionSetAirCleanerMode: not sent: {e}")
+            return
+        if thermostat.has_air_cleaner:
+            self.send_command(Command('thermostat', 'set_air_cleaner', (mode,)), thermostat_device, {'air_cleaner_mode': mode.lower()})
         else:
             self.logger.warning(f"{thermostat_device.name}: actionSetAirCleanerMode: System does not have an air cleaner.")
 
     def setDehumidifySetpointAction(self, pluginAction, thermostatDevice, _callerWaitingForResult):
         setpoint = pluginAction.props.get("dehumidify_setpoint", "50")
         self.logger.debug(f"{thermostatDevice.name}: setDehumidifySetpointAction: {setpoint}%")
-        thermostat = self.nexia_home.get_thermostat_by_id(int(thermostatDevice.pluginProps['nexia_thermostat']))
-        if thermostat.has_dehumidify_support():
-            asyncio.run_coroutine_threadsafe(thermostat.set_dehumidify_setpoint(float(setpoint) / 100.0), self.event_loop)
+        try:
+            thermostat, _zone = self.device_view(thermostatDevice)
+        except KeyError as e:
+            self.logger.warning(f"{thermostatDevice.name}: setDehumidifySetpointAction: not sent: {e}")
+            return
+        if thermostat.has_dehumidify_support:
+            self.send_command(Command('thermostat', 'set_dehumidify_setpoint', (float(setpoint) / 100.0,)), thermostatDevice,
+                              {'dehumidify_setpoint': float(setpoint) / 100.0})
         else:
             self.logger.warning(f"{thermostatDevice.name}: setDehumidifySetpointAction: System does not have dehumidify support.")
 
     def setFanSpeedSetpointAction(self, pluginAction, thermostatDevice, _callerWaitingForResult):
         setpoint = pluginAction.props.get("fanspeed_setpoint", "50")
         self.logger.debug(f"{thermostatDevice.name}: setFanSpeedSetpointAction: {setpoint}%")
-        thermostat = self.nexia_home.get_thermostat_by_id(int(thermostatDevice.pluginProps['nexia_thermostat']))
-        if thermostat.has_variable_fan_speed():
-            asyncio.run_coroutine_threadsafe(thermostat.set_fan_setpoint(float(setpoint) / 100.0), self.event_loop)
+        try:
+            thermostat, _zone = self.device_view(thermostatDevice)
+        except KeyError as e:
+            self.logger.warning(f"{thermostatDevice.name}: setFanSpeedSetpointAction: not sent: {e}")
+            return
+        if thermostat.has_variable_fan_speed:
+            self.send_command(Command('thermostat', 'set_fan_setpoint', (float(setpoint) / 100.0,)), thermostatDevice,
+                              {'fan_speed': float(setpoint) / 100.0})
         else:
             self.logger.warning(f"{thermostatDevice.name}: setDehumidifySetpointAction: System does not have set fan speed support.")
 
     def setFollowScheduleAction(self, pluginAction, thermostatDevice, _callerWaitingForResult):
         enabled = pluginAction.props.get("schedules_enabled", False)
         self.logger.debug(f"{thermostatDevice.name}: setFollowScheduleAction: {enabled}")
-        thermostat = self.nexia_home.get_thermostat_by_id(int(thermostatDevice.pluginProps['nexia_thermostat']))
-        asyncio.run_coroutine_threadsafe(thermostat.set_follow_schedule(enabled), self.event_loop)
+        self.send_command(Command('thermostat', 'set_follow_schedule', (enabled,)), thermostatDevice)
 
     # Zone callbacks
 
     def zonePresetGenerator(self, _filter, valuesDict, typeId, targetId):
         self.logger.debug(f"zonePresetGenerator: typeId = {typeId}, targetId = {targetId}, valuesDict= {valuesDict}")
-        zone_device = indigo.devices[int(targetId)]
-        thermostat = self.nexia_home.get_thermostat_by_id(int(zone_device.pluginProps['nexia_thermostat']))
-        zone = thermostat.get_zone_by_id(int(zone_device.pluginProps['nexia_zone']))
-        return [(preset, preset) for preset in zone.get_presets()]
+        try:
+            _thermostat, zone = self.device_view(indigo.devices[int(targetId)])
+        except (Exception,):
+            self.logger.debug("zonePresetGenerator: account not logged in yet, returning empty list")
+            return []
+        return [(preset, preset) for preset in zone.presets]
 
     def zoneSetPresetAction(self, pluginAction, zone_device, _callerWaitingForResult):
         preset = pluginAction.props.get("zone_preset", None)
         self.logger.debug(f"{zone_device.name}: zoneSetPresetAction: {preset}")
-        thermostat = self.nexia_home.get_thermostat_by_id(int(zone_device.pluginProps['nexia_thermostat']))
-        zone = thermostat.get_zone_by_id(int(zone_device.pluginProps['nexia_zone']))
-        asyncio.run_coroutine_threadsafe(zone.set_preset(preset), self.event_loop)
+        self.queue_zone_write(zone_device, preset=preset)
 
     def zoneReturnToScheduleAction(self, _pluginAction, zone_device, _callerWaitingForResult):
         self.logger.debug(f"{zone_device.name}: zoneReturnToScheduleAction")
-        thermostat = self.nexia_home.get_thermostat_by_id(int(zone_device.pluginProps['nexia_thermostat']))
-        zone = thermostat.get_zone_by_id(int(zone_device.pluginProps['nexia_zone']))
-        asyncio.run_coroutine_threadsafe(zone.call_return_to_schedule(), self.event_loop)
+        self.send_command(Command('zone', 'call_return_to_schedule', ()), zone_device, {'is_in_permanent_hold': False})
 
     def zoneSetHoldAction(self, _pluginAction, zone_device, _callerWaitingForResult):
         self.logger.debug(f"{zone_device.name}: zoneSetHoldAction")
-        thermostat = self.nexia_home.get_thermostat_by_id(int(zone_device.pluginProps['nexia_thermostat']))
-        zone = thermostat.get_zone_by_id(int(zone_device.pluginProps['nexia_zone']))
-        asyncio.run_coroutine_threadsafe(zone.call_permanent_hold(), self.event_loop)
+        self.send_command(Command('zone', 'call_permanent_hold', ()), zone_device, {'is_in_permanent_hold': True})
+
+    # Telemetry
+
+    def telemetryKeyGenerator(self, _filter, valuesDict, typeId, targetId):
+        self.logger.debug(f"telemetryKeyGenerator: typeId = {typeId}, targetId = {targetId}")
+        try:
+            return [(key, key) for key in TELEMETRY_KEYS[indigo.devices[int(targetId)].deviceTypeId]]
+        except (Exception,):
+            return []
+
+    def queryTelemetryAction(self, pluginAction, device, _callerWaitingForResult):
+        # Logs min/max/avg of a recorded state over the last few hours, and returns them for scripts
+        key = pluginAction.props.get("telemetry_key", "")
+        try:
+            hours = float(pluginAction.props.get("window_hours", "24") or "24")
+        except ValueError:
+            self.logger.warning(f"{device.name}: queryTelemetryAction: invalid window_hours {pluginAction.props.get('window_hours')!r}")
+            return None
+        self.logger.debug(f"{device.name}: queryTelemetryAction: {key} for {hours} hours")
+        if not self.telemetry:
+            self.logger.warning(f"{device.name}: queryTelemetryAction: telemetry recording is not enabled in the plugin config")
+            return None
+
+        result = self.telemetry.query(device.id, key, hours * 3600.0)
+        if result:
+            self.logger.info(f"{device.name}: {key} over the last {hours:g} hours: min {result['min']:.1f}, max {result['max']:.1f}, "
+                             f"avg {result['avg']:.1f} ({result['count']} samples)")
+        else:
+            self.logger.info(f"{device.name}: {key}: no samples in the last {hours:g} hours")
+        return result
 
     def pickZone(self, filter=None, valuesDict=None, typeId=0): # noqa
         retList = []
-        for dev in indigo.devices.iter("self"):
-            if dev.deviceTypeId == 'NexiaZone':
-                retList.append((dev.id, dev.name))
+        for dev_id, name in self.nexia_zones.items():
+            retList.append((dev_id, name))
         retList.sort(key=lambda tup: tup[1])
         return retList
 
@@ -0,0 +1,165 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Request scheduler for the Trane Home plugin.
+#
+# Every call to the Nexia API goes through one RequestScheduler in the plugin's event loop.  A call waits for a
+# token from a token bucket (REQUEST_RATE per second, up to REQUEST_BURST at once), and waiting interactive
+# calls (user commands and the refreshes that confirm them) always get the next token before background polls.
+# A 429 or 503 from the server pauses every call, for the server's Retry-After or an exponential backoff,
+# and the throttled call is tried again.  A call that fails with a connection error, a timeout or a gateway
+# error is tried again on its own after a jittered exponential backoff, and one rejected because the account's
+# session expired is tried again after logging in.
+####################
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+
+INTERACTIVE = 0
+BACKGROUND = 1
+LANES = ("interactive", "background")     # in priority order, indexed by the lane constants above
+
+REQUEST_RATE = 2.0              # tokens added per second
+REQUEST_BURST = 10              # most tokens held, so an idle plugin can send this many calls at once
+THROTTLE_STATUS = (429, 503)    # responses meaning the server wants us to slow down
+THROTTLE_RETRIES = 3            # times a throttled call is tried again before its error is raised
+BACKOFF_INITIAL = 5.0           # seconds paused after the first throttled response, doubled for each one after
+BACKOFF_MAX = 300.0
+RETRY_STATUS = (502, 504)       # gateway errors, usually gone on the next try
+RETRIES = 2                     # times a call failing with a connection error, a timeout or RETRY_STATUS is tried again
+RETRY_INITIAL = 1.0             # seconds before the first retry, doubled for each one after, with jitter
+RETRY_MAX = 30.0
+SESSION_EXPIRED_STATUS = (401, 403)
+
+
+def call_name(factory):
+    # name of the Nexia method behind a factory, for logs and metrics
+    return getattr(getattr(factory, 'func', factory), '__name__', "call")
+
+
+class RequestScheduler:
+
+    def __init__(self, metrics, rate=REQUEST_RATE, burst=REQUEST_BURST):
+        self.logger = logging.getLogger("Plugin.scheduler")
+        self.metrics = metrics
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled = time.monotonic()
+        self.waiting = tuple(deque() for _lane in LANES)   # futures of calls waiting for a token, per lane
+        self.paused_until = 0.0         # monotonic time throttling ends
+        self.backoff = 0.0              # current backoff, reset by the first call that succeeds
+        self.wakeup = None              # timer handle of the next dispatch
+        self.update_gauges()
+
+    def queue_depth(self, lane):
+        return len(self.waiting[lane])
+
+    async def run(self, lane, factory, timeout=None, relogin=None):
+        # Wait for a token, then await factory(), limited to 'timeout' seconds (not counting the wait).  factory is
+        # called again for each retry, so it must return a new coroutine each time.  relogin is a coroutine function
+        # logging the account in again, it is awaited once if the server says the session expired.
+        from aiohttp import ClientConnectionError, ClientResponseError    # not when the plugin loads, see transport.py
+
+        attempt = retries = 0
+        while True:
+            await self.acquire(lane)
+            try:
+                coro = factory()
+                result = await (asyncio.wait_for(coro, timeout) if timeout else coro)
+            except ClientResponseError as e:
+                if e.status in THROTTLE_STATUS and attempt < THROTTLE_RETRIES:
+                    attempt += 1
+                    self.throttled(e, call_name(factory))
+                    continue
+                if e.status in SESSION_EXPIRED_STATUS and relogin is not None:
+                    self.logger.info(f"{call_name(factory)}: Nexia session expired, logging in again")
+                    await relogin()
+                    relogin = None
+                    continue
+                if e.status not in RETRY_STATUS or retries >= RETRIES:
+                    raise
+                error = e
+            except (ClientConnectionError, asyncio.TimeoutError) as e:
+                if retries >= RETRIES:
+                    raise
+                error = e
+            else:
+                self.backoff = 0.0
+                return result
+            retries += 1
+            await self.retry_delay(error, call_name(factory), retries)
+
+    async def retry_delay(self, error, name, retries):
+        delay = min(RETRY_MAX, RETRY_INITIAL * 2.0 ** (retries - 1)) * random.uniform(0.5, 1.5)
+        self.metrics.inc("scheduler_retries_total", error=type(error).__name__)
+        self.logger.debug("%s: %r, trying again in %.1f seconds", name, error, delay)
+        await asyncio.sleep(delay)
+
+    async def acquire(self, lane):
+        start = time.monotonic()
+        if not any(self.waiting) and self.take_token():
+            self.metrics.observe("scheduler_wait_seconds", 0.0, lane=LANES[lane])
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[lane].append(future)
+        self.dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future in self.waiting[lane]:
+                self.waiting[lane].remove(future)
+                self.update_gauges()
+            elif not future.cancelled():
+                self.tokens = min(self.burst, self.tokens + 1)     # granted just as the caller gave up, give it back
+            raise
+        self.metrics.observe("scheduler_wait_seconds", time.monotonic() - start, lane=LANES[lane])
+
+    def take_token(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if now < self.paused_until or self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+    def dispatch(self):
+        # Hand out the available tokens, highest priority lane first, and schedule the next dispatch if calls are left waiting
+        if self.wakeup is not None:
+            self.wakeup.cancel()
+            self.wakeup = None
+        for waiting in self.waiting:
+            while waiting and self.take_token():
+                future = waiting.popleft()
+                if future.done():
+                    self.tokens = min(self.burst, self.tokens + 1.0)     # caller cancelled while waiting
+                else:
+                    future.set_result(None)
+            if waiting:
+                break
+        if any(self.waiting):
+            now = time.monotonic()
+            delay = max(self.paused_until - now, (1.0 - self.tokens) / self.rate, 0.001)
+            self.wakeup = asyncio.get_running_loop().call_later(delay, self.dispatch)
+        self.update_gauges()
+
+    def throttled(self, error, name):
+        # pause every call, for as long as the server asked or for the next backoff step with some jitter
+        self.backoff = min(BACKOFF_MAX, self.backoff * 2.0 if self.backoff else BACKOFF_INITIAL)
+        try:
+            delay = float(error.headers.get("Retry-After")) if error.headers else None
+        except (TypeError, ValueError):
+            delay = None
+        if delay is None:
+            delay = self.backoff * random.uniform(0.75, 1.25)
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        self.metrics.inc("scheduler_throttled_total", status=error.status)
+        self.logger.warning(f"{name}: Nexia responded {error.status}, pausing requests for {delay:.0f} seconds")
+
+    def update_gauges(self):
+        for lane, name in enumerate(LANES):
+            self.metrics.set("scheduler_queue_depth", len(self.waiting[lane]), lane=name)
@@ -0,0 +1,54 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Startup timing for the Trane Home plugin.
+#
+# Records when each startup milestone was reached, in seconds since plugin.py started loading: imports done,
+# plugin created, event loop thread started, devices started, network modules loaded, session open, first
+# login and the first device states, from a saved snapshot or from Nexia.  Once the first live update is done
+# the breakdown is written to the log and kept as metrics gauges.
+####################
+
+import logging
+import time
+
+FIRST_STATE_TARGET = 2.0        # seconds from loading the plugin to the first device states, from a snapshot if there is one
+
+# milestones in the order they are reported
+MILESTONES = ("imports", "init", "thread", "first_device", "last_device", "network_imports", "session",
+              "first_state", "login", "first_live_state")
+
+
+class StartupProfile:
+
+    def __init__(self, started):
+        self.logger = logging.getLogger("Plugin.startup")
+        self.started = started          # time.perf_counter() when plugin.py started loading
+        self.marks = {}                 # milestone -> seconds since started
+        self.done = False
+
+    def mark(self, milestone, again=False, at=None):
+        # The first time a milestone is reached counts, unless again is True (last_device).  at is a time.perf_counter()
+        # value if it was reached earlier.
+        if not self.done and (again or milestone not in self.marks):
+            self.marks[milestone] = (at or time.perf_counter()) - self.started
+
+    def reached(self, milestone):
+        return milestone in self.marks
+
+    def finish(self, metrics):
+        # Log the breakdown and keep it as gauges, once
+        if self.done:
+            return
+        self.done = True
+        marks = dict(self.marks)        # deviceStartComm may still add to it from Indigo's thread
+        for milestone, seconds in marks.items():
+            metrics.set("startup_seconds", round(seconds, 3), milestone=milestone)
+        steps = ", ".join(f"{milestone} {marks[milestone]:.2f}" for milestone in MILESTONES if milestone in marks)
+        first_state = marks.get("first_state")
+        if first_state is None:
+            self.logger.info(f"Startup: no device states yet ({steps} seconds)")
+        elif first_state > FIRST_STATE_TARGET:
+            self.logger.info(f"Startup: first device states after {first_state:.2f} seconds, over the {FIRST_STATE_TARGET:.1f} second target ({steps})")
+        else:
+            self.logger.info(f"Startup: first device states after {first_state:.2f} seconds ({steps})")
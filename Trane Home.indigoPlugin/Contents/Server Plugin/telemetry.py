@@ -0,0 +1,177 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Telemetry history for the Trane Home plugin.
+#
+# Each poll's numeric device states go into small fixed-size ring buffers (two float arrays per series),
+# which are flushed in batches to a SQLite file.  Raw samples are kept for RAW_RETENTION, older data only
+# as ROLLUP_PERIOD rollups (count/min/max/sum) for ROLLUP_RETENTION.  Queries aggregate in SQLite, so
+# they never load the history into memory.
+####################
+
+import array
+import sqlite3
+import threading
+import time
+import logging
+
+RAW_RETENTION = 48 * 3600.0             # seconds of raw samples kept in the database
+ROLLUP_PERIOD = 15 * 60.0               # seconds covered by one rollup row
+ROLLUP_RETENTION = 365 * 24 * 3600.0    # seconds of rollups kept in the database
+RING_SIZE = 256                         # samples per series held in memory between flushes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (dev_id INTEGER NOT NULL, key TEXT NOT NULL, ts REAL NOT NULL, value REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS samples_series ON samples (dev_id, key, ts);
+CREATE TABLE IF NOT EXISTS rollups (dev_id INTEGER NOT NULL, key TEXT NOT NULL, bucket REAL NOT NULL,
+    count INTEGER NOT NULL, min REAL NOT NULL, max REAL NOT NULL, sum REAL NOT NULL,
+    PRIMARY KEY (dev_id, key, bucket)) WITHOUT ROWID;
+"""
+
+UPSERT_ROLLUP = """
+INSERT INTO rollups (dev_id, key, bucket, count, min, max, sum) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (dev_id, key, bucket) DO UPDATE SET
+    count = count + excluded.count, min = MIN(min, excluded.min), max = MAX(max, excluded.max), sum = sum + excluded.sum
+"""
+
+
+class RingBuffer:
+    # Fixed size buffer of (timestamp, value) samples.  'written' and 'flushed' count samples since creation,
+    # so the unflushed samples are the last (written - flushed) ones, as long as that fits in the buffer.
+
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self.times = array.array('d', bytes(8 * size))
+        self.values = array.array('d', bytes(8 * size))
+        self.written = 0
+        self.flushed = 0
+
+    def append(self, ts, value):
+        index = self.written % self.size
+        self.times[index] = ts
+        self.values[index] = value
+        self.written += 1
+
+    def unflushed(self):
+        # returns the samples not yet flushed and how many were overwritten before they could be
+        start = max(self.flushed, self.written - self.size)
+        samples = [(self.times[i % self.size], self.values[i % self.size]) for i in range(start, self.written)]
+        return samples, start - self.flushed
+
+
+class TelemetryRecorder:
+
+    def __init__(self, db_path):
+        self.logger = logging.getLogger("Plugin.telemetry")
+        self.db_path = db_path
+        self.buffers = {}                   # (dev_id, key) -> RingBuffer
+        self.lock = threading.Lock()        # protects the buffers, held only briefly
+        self.db_lock = threading.Lock()     # serializes flushes and queries, so no sample is counted twice
+        self.samples_dropped = 0
+
+        db = self.connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")     # persistent, lets queries read while a flush is writing
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=10.0)
+
+    def record(self, dev_id, values, ts=None):
+        # values is a dict of state key -> value, anything that isn't a number (or bool) is skipped
+        ts = ts or time.time()
+        with self.lock:
+            for key, value in values.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                buffer = self.buffers.get((dev_id, key))
+                if buffer is None:
+                    buffer = self.buffers[(dev_id, key)] = RingBuffer()
+                buffer.append(ts, float(value))
+
+    def flush(self):
+        # Write all unflushed samples and their rollups in one transaction, then prune expired rows.
+        # Blocking, run it in a worker thread.  Returns the number of samples written.
+        with self.db_lock:
+            with self.lock:
+                pending = []
+                for series, buffer in self.buffers.items():
+                    samples, dropped = buffer.unflushed()
+                    self.samples_dropped += dropped
+                    if samples:
+                        pending.append((series, buffer, buffer.written, samples))
+            if not pending:
+                return 0
+
+            rows = []
+            rollups = {}
+            for (dev_id, key), _buffer, _written, samples in pending:
+                for ts, value in samples:
+                    rows.append((dev_id, key, ts, value))
+                    bucket = ts - ts % ROLLUP_PERIOD
+                    rollup = rollups.get((dev_id, key, bucket))
+                    if rollup is None:
+                        rollups[(dev_id, key, bucket)] = [1, value, value, value]
+                    else:
+                        rollup[0] += 1
+                        rollup[1] = min(rollup[1], value)
+                        rollup[2] = max(rollup[2], value)
+                        rollup[3] += value
+
+            now = time.time()
+            db = self.connect()
+            try:
+                with db:
+                    db.executemany("INSERT INTO samples (dev_id, key, ts, value) VALUES (?, ?, ?, ?)", rows)
+                    db.executemany(UPSERT_ROLLUP, [(*series, *rollup) for series, rollup in rollups.items()])
+                    db.execute("DELETE FROM samples WHERE ts < ?", (now - RAW_RETENTION,))
+                    db.execute("DELETE FROM rollups WHERE bucket < ?", (now - ROLLUP_RETENTION,))
+            finally:
+                db.close()
+
+            with self.lock:
+                for _series, buffer, written, _samples in pending:
+                    buffer.flushed = written
+        self.logger.debug("flush: wrote %d samples, %d rollups", len(rows), len(rollups))
+        return len(rows)
+
+    def query(self, dev_id, key, window):
+        # min/max/avg of one series over the last 'window' seconds, or None if there are no samples.
+        # Raw samples cover the last RAW_RETENTION, whole rollup periods before that.  Blocking.
+        now = time.time()
+        start = now - window
+        boundary = now - RAW_RETENTION
+        boundary += -boundary % ROLLUP_PERIOD       # first rollup period made up only of raw samples
+        raw_start = max(start, boundary)
+
+        parts = []
+        with self.db_lock:
+            db = self.connect()
+            try:
+                parts.append(db.execute("SELECT COUNT(*), MIN(value), MAX(value), SUM(value) FROM samples "
+                                        "WHERE dev_id = ? AND key = ? AND ts >= ?", (dev_id, key, raw_start)).fetchone())
+                if raw_start > start:
+                    parts.append(db.execute("SELECT SUM(count), MIN(min), MAX(max), SUM(sum) FROM rollups "
+                                            "WHERE dev_id = ? AND key = ? AND bucket >= ? AND bucket < ?",
+                                            (dev_id, key, start - start % ROLLUP_PERIOD, raw_start)).fetchone())
+            finally:
+                db.close()
+            with self.lock:
+                buffer = self.buffers.get((dev_id, key))
+                samples = buffer.unflushed()[0] if buffer else []
+        values = [value for ts, value in samples if ts >= start]
+        if values:
+            parts.append((len(values), min(values), max(values), sum(values)))
+
+        parts = [part for part in parts if part[0]]
+        if not parts:
+            return None
+        count = sum(part[0] for part in parts)
+        return {
+            'count': count,
+            'min': min(part[1] for part in parts),
+            'max': max(part[2] for part in parts),
+            'avg': sum(part[3] for part in parts) / count,
+        }
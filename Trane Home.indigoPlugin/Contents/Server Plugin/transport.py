@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# HTTP transport for the Trane Home plugin.
+#
+# All accounts share one aiohttp ClientSession.  It keeps a limited pool of connections to the Nexia cloud
+# open between polls, so most requests skip the TLS handshake, and caches DNS lookups.  Every request has a
+# total and a per-read timeout, so a request the server never answers fails instead of waiting forever.
+# Responses are gzip compressed unless that is turned off.  The settings come from the plugin config dialog.
+#
+# aiohttp and the nexia library take a good part of a second to import, so they are only imported by
+# load_modules(), in the event loop thread, not when the plugin is loaded.
+####################
+
+import functools
+from collections import namedtuple
+
+TransportSettings = namedtuple("TransportSettings", "pool_size keepalive dns_ttl total_timeout read_timeout gzip")
+
+# setting -> (pref key, default, minimum, maximum), all in seconds except pool_size
+LIMITS = {
+    'pool_size': ("connectionLimit", 10, 1, 100),
+    'keepalive': ("keepaliveTimeout", 60, 0, 600),
+    'dns_ttl': ("dnsCacheTTL", 300, 0, 86400),
+    'total_timeout': ("requestTimeout", 30, 5, 300),
+    'read_timeout': ("readTimeout", 15, 1, 300),
+}
+
+
+@functools.cache
+def load_modules():
+    # Imports the network modules, returns the response class for new sessions
+    import nexia.home   # noqa: F401
+    from aiohttp import ClientResponse
+
+    class PooledResponse(ClientResponse):
+        # aiohttp 3.14 starts the sock_read timer again while the body of a response is read, after the connection went
+        # back to the pool, and the next request on that connection fails with a read timeout.  Stop it once read.
+
+        async def start(self, connection):
+            self.pooled_protocol = connection.protocol
+            return await super().start(connection)
+
+        async def read(self):
+            try:
+                return await super().read()
+            finally:
+                if self.connection is None and self.pooled_protocol is not None:
+                    self.pooled_protocol._drop_timeout()
+
+    return PooledResponse
+
+
+def setting_errors(prefs):
+    # {pref key: message} for the numeric settings that are not valid
+    errors = {}
+    for key, default, minimum, maximum in LIMITS.values():
+        try:
+            value = int(prefs.get(key, default))
+        except ValueError:
+            value = None
+        if value is None or value < minimum or value > maximum:
+            errors[key] = f"Enter a whole number between {minimum} and {maximum}"
+    return errors
+
+
+def transport_settings(prefs):
+    # TransportSettings from the plugin prefs, a setting that isn't valid gets its default
+    values = {}
+    for setting, (key, default, minimum, maximum) in LIMITS.items():
+        try:
+            value = int(prefs.get(key, default))
+        except ValueError:
+            value = default
+        values[setting] = value if minimum <= value <= maximum else default
+    return TransportSettings(gzip=bool(prefs.get("httpCompression", True)), **values)
+
+
+def new_session(settings, trace_configs=None):
+    response_class = load_modules()
+    import nexia.home
+    from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+    timeout = ClientTimeout(total=settings.total_timeout, sock_read=settings.read_timeout)
+    # The library passes its own timeout with each request, which replaces the session's, so set that one too
+    nexia.home.TIMEOUT = timeout
+    if settings.keepalive:
+        connection = {'keepalive_timeout': settings.keepalive}
+    else:
+        connection = {'force_close': True}
+    connector = TCPConnector(limit=settings.pool_size, use_dns_cache=settings.dns_ttl > 0, ttl_dns_cache=settings.dns_ttl or None, **connection)
+    headers = {"Accept-Encoding": "gzip, deflate" if settings.gzip else "identity"}
+    return ClientSession(connector=connector, timeout=timeout, headers=headers, trace_configs=trace_configs, response_class=response_class)
@@ -0,0 +1,244 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark the plugin's update and action paths against the local fake Nexia API.
+
+Loads plugin.py with the stub indigo module, creates a thermostat device for every thermostat and a
+zone device for every zone in a synthetic house, then measures login, full update cycles and a burst of
+setpoint actions.  Requires the plugin's requirements (aiohttp, nexia) to be installed.
+
+    python bench_update.py --sizes 1x1,10x2,50x4,200x1 --cycles 10
+
+With --main-loop the plugin's own main loop runs instead, for a fixed number of full updates on a short
+poll interval with adaptive polling on, while bursts of setpoint actions come in from another thread.  That
+covers the request scheduler, the zone write coalescing, the targeted refreshes and the poll schedule.
+
+    python bench_update.py --main-loop --sizes 10x2,50x4 --cycles 10 --poll 2
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import indigo_stub
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Trane Home.indigoPlugin", "Contents", "Server Plugin")
+
+
+class Action:
+    def __init__(self, thermostatAction, actionValue=None, actionMode=None):
+        self.thermostatAction = thermostatAction
+        self.actionValue = actionValue
+        self.actionMode = actionMode
+
+
+def load_plugin():
+    indigo = indigo_stub.install()
+    if PLUGIN_DIR not in sys.path:
+        sys.path.insert(0, PLUGIN_DIR)
+    import plugin
+    return indigo, plugin
+
+
+def create_devices(indigo, plugin_instance, house_json):
+    indigo.devices.clear()
+    dev_id = 1000
+    zone_devices = []
+    for child in house_json["result"]["_links"]["child"]:
+        if "/devices" not in child["href"]:
+            continue
+        for thermostat in child["data"]["items"]:
+            dev_id += 1
+            device = indigo.devices.add(indigo.Device(dev_id, thermostat["name"], "NexiaThermostat", {"nexia_thermostat": str(thermostat["id"])}))
+            plugin_instance.deviceStartComm(device)
+            for zone in thermostat["zones"]:
+                dev_id += 1
+                device = indigo.devices.add(indigo.Device(dev_id, f"{thermostat['name']} {zone['name']}", "NexiaZone",
+                                                          {"nexia_thermostat": str(thermostat["id"]), "nexia_zone": str(zone["id"])}))
+                plugin_instance.deviceStartComm(device)
+                zone_devices.append(device)
+    return zone_devices
+
+
+def pushed_keys(indigo):
+    return sum(device.push_keys for device in indigo.devices.values()), sum(device.push_calls for device in indigo.devices.values())
+
+
+async def run_case(indigo, plugin, thermostats, zones, cycles, churn, latency):
+    from transport import new_session
+    from fake_nexia import FAKE_BRAND, FakeNexiaServer, synthetic_house, use_fake_brand
+
+    house_json = synthetic_house(1, thermostats, zones)
+    server = FakeNexiaServer(house_json, churn=churn, latency=latency)
+    use_fake_brand(await server.start())
+
+    indigo.server.install_folder = tempfile.mkdtemp(prefix="indigo_bench_")    # no saved snapshot, every case starts cold
+    prefs = {"username": "bench", "password": "bench", "brand": FAKE_BRAND, "updateFrequency": "15", "logLevel": "30", "fileLogLevel": "30"}
+    p = plugin.Plugin("com.flyingdiver.indigoplugin.tranehome", "Trane Home", "benchmark", prefs)
+    p.event_loop = asyncio.get_running_loop()
+    p.wake_event = asyncio.Event()
+    zone_devices = create_devices(indigo, p, house_json)
+
+    result = {"size": f"{thermostats}x{zones}", "devices": len(indigo.devices)}
+    async with new_session(p.transport) as p.session:
+        start = time.perf_counter()
+        await p.do_update()
+        result["startup_ms"] = (time.perf_counter() - start) * 1000.0
+        result["first_push_keys"] = pushed_keys(indigo)[0]
+
+        latencies = []
+        keys_before, calls_before = pushed_keys(indigo)
+        tracemalloc.start()
+        for _cycle in range(cycles):
+            start = time.perf_counter()
+            await p.do_update()
+            latencies.append((time.perf_counter() - start) * 1000.0)
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        keys_after, calls_after = pushed_keys(indigo)
+
+        result["poll_p50_ms"] = statistics.median(latencies)
+        result["poll_max_ms"] = max(latencies)
+        result["keys_per_poll"] = (keys_after - keys_before) / cycles
+        result["pushes_per_poll"] = (calls_after - calls_before) / cycles
+        result["peak_kib"] = peak / 1024.0
+
+        # a burst of setpoint actions on one zone, sent from another thread like Indigo does
+        writes_before = server.requests.get("POST /mobile/xxl_zones/{zone_id}/{end_point}", 0)
+        zone_device = zone_devices[0]
+        start = time.perf_counter()
+        await asyncio.to_thread(burst, p, indigo, zone_device, 5)
+        await asyncio.sleep(plugin.WRITE_COALESCE_WINDOW + 0.5)
+        result["burst_writes"] = server.requests.get("POST /mobile/xxl_zones/{zone_id}/{end_point}", 0) - writes_before
+        result["http_requests"] = sum(server.requests.values())
+
+    await server.stop()
+    return result
+
+
+def burst(plugin_instance, indigo, zone_device, count):
+    for _ in range(count):
+        plugin_instance.actionControlThermostat(Action(indigo.kThermostatAction.IncreaseHeatSetpoint, actionValue=1), zone_device)
+
+
+def bursts(plugin_instance, indigo, zone_devices, count):
+    for zone_device in zone_devices:
+        burst(plugin_instance, indigo, zone_device, count)
+
+
+async def run_loop_case(indigo, plugin, thermostats, zones, cycles, churn, latency, poll):
+    # Runs Plugin.async_main, which opens the session and runs main_loop, until it has done cycles full updates
+    # after the first one.  Bursts of setpoint actions on a few zones are sent after the first update and halfway,
+    # and the run ends once their zone writes are done.
+    from fake_nexia import FAKE_BRAND, FakeNexiaServer, synthetic_house, use_fake_brand
+
+    house_json = synthetic_house(1, thermostats, zones)
+    server = FakeNexiaServer(house_json, churn=churn, latency=latency)
+    use_fake_brand(await server.start())
+
+    indigo.server.install_folder = tempfile.mkdtemp(prefix="indigo_bench_")
+    prefs = {"username": "bench", "password": "bench", "brand": FAKE_BRAND, "logLevel": "30", "fileLogLevel": "30",
+             "updateFrequency": str(poll / 60.0), "adaptivePolling": True, "fastUpdateFrequency": str(poll / 4.0),
+             "fastUpdatePeriod": str(poll * 3.0 / 60.0)}
+    p = plugin.Plugin("com.flyingdiver.indigoplugin.tranehome", "Trane Home", "benchmark", prefs)
+    p.event_loop = asyncio.get_running_loop()
+    p.wake_event = asyncio.Event()
+    p.update_lock = asyncio.Lock()
+    zone_devices = create_devices(indigo, p, house_json)
+
+    poll_starts = []
+    do_update = p.do_update
+
+    async def timed_update():
+        poll_starts.append(time.perf_counter())
+        await do_update()
+    p.do_update = timed_update
+
+    write_key = "POST /mobile/xxl_zones/{zone_id}/{end_point}"
+    burst_zones = zone_devices[:5]
+    burst_at = {1, 1 + cycles // 2}     # number of updates started when a burst is sent
+    actions = 0
+    start = time.perf_counter()
+    main_task = asyncio.create_task(p.async_main())
+    deadline = start + 60.0 + cycles * poll * 2.0
+    while (len(poll_starts) <= cycles or p.commands) and time.perf_counter() < deadline and not main_task.done():
+        if len(poll_starts) in burst_at:
+            burst_at.discard(len(poll_starts))
+            await asyncio.to_thread(bursts, p, indigo, burst_zones, 5)
+            actions += len(burst_zones) * 5
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    p.stopThread = True
+    main_task.cancel()
+    await asyncio.gather(main_task, return_exceptions=True)
+    await server.stop()
+
+    def histogram(name):
+        # all label sets of a histogram together, (count, sum, max)
+        found = [h for (hist_name, _labels), h in p.metrics.histograms.items() if hist_name == name]
+        return sum(h.count for h in found), sum(h.sum for h in found), max((h.max for h in found), default=0.0)
+
+    intervals = [b - a for a, b in zip(poll_starts, poll_starts[1:])]
+    wait_count, wait_sum, wait_max = histogram("scheduler_wait_seconds")
+    polls, poll_sum, _poll_max = histogram("poll_seconds")
+    return {
+        "size": f"{thermostats}x{zones}", "devices": len(indigo.devices), "polls": len(poll_starts),
+        "interval_min_s": min(intervals, default=0.0), "interval_p50_s": statistics.median(intervals) if intervals else 0.0,
+        "interval_max_s": max(intervals, default=0.0), "poll_avg_ms": poll_sum / polls * 1000.0 if polls else 0.0,
+        "wait_avg_ms": wait_sum / wait_count * 1000.0 if wait_count else 0.0, "wait_max_ms": wait_max * 1000.0,
+        "refreshes": histogram("thermostat_refresh_seconds")[0], "actions": actions, "zone_writes": server.requests.get(write_key, 0),
+        "writes_merged": p.writes_merged, "loop_lag_max_ms": histogram("loop_lag_seconds")[2] * 1000.0,
+        "http_requests": sum(server.requests.values()), "wall_s": elapsed,
+    }
+
+
+COLUMNS = [
+    ("size", "{:>8}"), ("devices", "{:>7}"), ("startup_ms", "{:>10.1f}"), ("poll_p50_ms", "{:>11.1f}"), ("poll_max_ms", "{:>11.1f}"),
+    ("pushes_per_poll", "{:>15.1f}"), ("keys_per_poll", "{:>13.1f}"), ("peak_kib", "{:>9.1f}"), ("burst_writes", "{:>12}"), ("http_requests", "{:>13}"),
+]
+
+LOOP_COLUMNS = [
+    ("size", "{:>8}"), ("devices", "{:>7}"), ("polls", "{:>5}"), ("interval_min_s", "{:>14.2f}"), ("interval_p50_s", "{:>14.2f}"),
+    ("interval_max_s", "{:>14.2f}"), ("poll_avg_ms", "{:>11.1f}"), ("wait_avg_ms", "{:>11.2f}"), ("wait_max_ms", "{:>11.2f}"),
+    ("refreshes", "{:>9}"), ("actions", "{:>7}"), ("zone_writes", "{:>11}"), ("writes_merged", "{:>13}"), ("loop_lag_max_ms", "{:>15.1f}"),
+    ("http_requests", "{:>13}"), ("wall_s", "{:>6.1f}"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Trane Home plugin update pipeline against a fake Nexia API")
+    parser.add_argument("--sizes", default="1x1,10x2,50x4,200x1", help="comma separated <thermostats>x<zones per thermostat>")
+    parser.add_argument("--cycles", type=int, default=10, help="full update cycles per size")
+    parser.add_argument("--churn", type=float, default=0.1, help="fraction of zones changing between polls")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of simulated network latency per request")
+    parser.add_argument("--main-loop", action="store_true", help="run the plugin's main loop instead of calling do_update")
+    parser.add_argument("--poll", type=float, default=2.0, help="seconds between full updates with --main-loop")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    os.chdir(tempfile.mkdtemp(prefix="nexia_bench_"))     # the nexia library writes its uuid file to the cwd
+    indigo, plugin = load_plugin()
+    logging.getLogger("Plugin").setLevel(args.log_level)
+
+    results = []
+    for size in args.sizes.split(","):
+        thermostats, zones = (int(n) for n in size.lower().split("x"))
+        if args.main_loop:
+            results.append(asyncio.run(run_loop_case(indigo, plugin, thermostats, zones, args.cycles, args.churn, args.latency, args.poll)))
+        else:
+            results.append(asyncio.run(run_case(indigo, plugin, thermostats, zones, args.cycles, args.churn, args.latency)))
+
+    columns = LOOP_COLUMNS if args.main_loop else COLUMNS
+    print(" ".join(f"{name:>{len(fmt.format(results[0][name]))}}" for name, fmt in columns))
+    for result in results:
+        print(" ".join(fmt.format(result[name]) for name, fmt in columns))
+
+
+if __name__ == "__main__":
+    main()
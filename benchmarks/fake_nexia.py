@@ -0,0 +1,316 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Nexia mobile API.
+
+Serves either a synthetic house with any number of thermostats and zones, or a recorded house JSON
+(the response of GET /mobile/houses/<id>), and implements login, house and thermostat fetches and the
+zone/thermostat write endpoints closely enough for the nexia library.  Point NexiaHome at it with
+use_fake_brand(), or run it on its own:
+
+    python fake_nexia.py --thermostats 4 --zones 3 --port 8099
+"""
+import argparse
+import asyncio
+import json
+import random
+
+from aiohttp import web
+
+FAKE_BRAND = "fake"
+
+THERMOSTAT_ID_BASE = 200000     # zone ids are thermostat_id * 100 + n, the nexia library treats ids below 256 as UX360 zones
+PRESETS = ["None", "Home", "Away", "Sleep"]
+
+
+def use_fake_brand(base_url):
+    """Make NexiaHome(..., brand=FAKE_BRAND) talk to base_url."""
+    from nexia import home
+    home.BRAND_TO_URL[FAKE_BRAND] = base_url
+
+
+def _setting(setting_type, current_value, options):
+    return {
+        "type": setting_type,
+        "title": setting_type,
+        "current_value": current_value,
+        "options": [{"value": value, "label": label} for value, label in options],
+        "labels": [label for _value, label in options],
+        "values": [value for value, _label in options],
+    }
+
+
+def synthetic_zone(zone_id, name, rng):
+    heat = rng.choice([66, 67, 68, 69, 70])
+    cool = heat + rng.choice([4, 5, 6])
+    mode = rng.choice(["AUTO", "HEAT", "COOL"])
+    return {
+        "type": "xxl_zone",
+        "id": zone_id,
+        "name": name,
+        "current_zone_mode": mode,
+        "temperature": rng.choice([68, 69, 70, 71, 72]),
+        "setpoints": {"heat": heat, "cool": cool},
+        "heating_setpoint": heat,
+        "cooling_setpoint": cool,
+        "operating_state": "",
+        "zone_status": "",
+        "settings": [
+            _setting("preset_selected", 0, [(index, label) for index, label in enumerate(PRESETS)]),
+            _setting("zone_mode", mode, [(value, value.title()) for value in ("AUTO", "COOL", "HEAT", "OFF")]),
+            _setting("run_mode", "run_schedule", [("permanent_hold", "Permanent Hold"), ("run_schedule", "Run Schedule")]),
+        ],
+        "features": [
+            {"name": "thermostat_mode", "label": "Mode", "value": mode, "display_value": mode.title()},
+        ],
+    }
+
+
+def synthetic_thermostat(thermostat_id, name, zone_count, rng):
+    return {
+        "id": thermostat_id,
+        "name": name,
+        "type": "xxl_thermostat",
+        "has_outdoor_temperature": True,
+        "outdoor_temperature": str(rng.randint(20, 95)),
+        "has_indoor_humidity": True,
+        "indoor_humidity": str(rng.randint(30, 60)),
+        "system_status": "System Idle",
+        "connected": True,
+        "features": [
+            {"name": "advanced_info", "items": [
+                {"type": "label", "label": "Model", "value": "XL1050"},
+                {"type": "label", "label": "AUID", "value": f"{thermostat_id:08X}"},
+                {"type": "label", "label": "Firmware Version", "value": "5.9.1"},
+            ]},
+            {"name": "thermostat", "temperature": 70, "status": "System Idle", "setpoint_delta": 3, "scale": "f",
+             "setpoint_increment": 1.0, "setpoint_heat_min": 55, "setpoint_heat_max": 90,
+             "setpoint_cool_min": 60, "setpoint_cool_max": 99},
+            {"name": "thermostat_compressor_speed", "compressor_speed": 0.0},
+        ],
+        "settings": [
+            _setting("fan_mode", "auto", [("auto", "auto"), ("on", "on"), ("circulate", "circulate")]),
+            _setting("fan_speed", 0.35, [(value / 100, f"{value}%") for value in range(35, 105, 5)]),
+            _setting("dehumidify", 0.5, [(value / 100, f"{value}%") for value in range(35, 70, 5)]),
+            _setting("air_cleaner_mode", "auto", [("auto", "Auto"), ("quick", "Quick"), ("allergy", "Allergy")]),
+            _setting("scheduling_enabled", True, [(True, "ON"), (False, "OFF")]),
+        ],
+        "zones": [synthetic_zone(thermostat_id * 100 + index, f"Zone {index + 1}", rng) for index in range(zone_count)],
+    }
+
+
+def synthetic_house(house_id, thermostats, zones_per_thermostat, seed=1):
+    rng = random.Random(seed)
+    items = [synthetic_thermostat(THERMOSTAT_ID_BASE + index, f"Thermostat {index + 1}", zones_per_thermostat, rng)
+             for index in range(thermostats)]
+    return {
+        "success": True,
+        "error": None,
+        "result": {
+            "id": house_id,
+            "name": f"Fake House {house_id}",
+            "_links": {
+                "child": [
+                    {"href": f"/mobile/houses/{house_id}/devices", "data": {"items": items}},
+                    {"href": f"/mobile/houses/{house_id}/automations", "data": {"items": []}},
+                ]
+            },
+        },
+    }
+
+
+class FakeNexiaServer:
+    """
+    aiohttp server holding one house.  churn is the fraction of zones whose temperature and
+    calling state change on each house fetch, latency a per-request delay in seconds.
+    """
+
+    def __init__(self, house_json, churn=0.1, latency=0.0, seed=1):
+        self.house_json = house_json
+        self.house_id = house_json["result"]["id"]
+        self.churn = churn
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.requests = {}
+        self.api_keys = set()       # sessions handed out by sign_in, cleared by expire_sessions()
+        self.reject_writes = False  # answer every write with a server error
+        self.throttle_next = 0      # answer this many of the next requests with 429 Too Many Requests
+        self.retry_after = 1        # Retry-After sent with those, in seconds
+        self.fail_next = 0          # answer this many of the next requests with fail_status
+        self.fail_status = 502
+        self.stall_next = 0         # never answer this many of the next requests
+        self.expired_status = 302   # answer to requests with an expired api key, 302 to the login page or e.g. 401
+        self.runner = None
+        self.base_url = None
+
+        self.thermostats = {}
+        self.zones = {}
+        for child in house_json["result"]["_links"]["child"]:
+            if "/devices" in child.get("href", ""):
+                for thermostat in child["data"].get("items", []):
+                    self.thermostats[str(thermostat["id"])] = thermostat
+                    for zone in thermostat.get("zones", []):
+                        self.zones[str(zone["id"])] = (thermostat, zone)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path) as f:
+            return cls(json.load(f), **kwargs)
+
+    def app(self):
+        app = web.Application(middlewares=[self._count_and_delay])
+        app.router.add_post("/mobile/accounts/sign_in", self.sign_in)
+        app.router.add_post("/mobile/session", self.session)
+        app.router.add_get("/mobile/houses/{house_id}", self.house)
+        app.router.add_get("/mobile/xxl_thermostats/{thermostat_id}", self.thermostat)
+        app.router.add_route("*", "/mobile/xxl_thermostats/{thermostat_id}/{end_point}", self.thermostat_write)
+        app.router.add_route("*", "/mobile/xxl_zones/{zone_id}/{end_point}", self.zone_write)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]     # noqa
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    def expire_sessions(self):
+        """Invalidate every api key, like the Nexia cloud does after a while."""
+        self.api_keys.clear()
+
+    @web.middleware
+    async def _count_and_delay(self, request, handler):
+        key = f"{request.method} {request.match_info.route.resource.canonical if request.match_info.route.resource else request.path}"
+        self.requests[key] = self.requests.get(key, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.throttle_next > 0:
+            self.throttle_next -= 1
+            raise web.HTTPTooManyRequests(headers={"Retry-After": str(self.retry_after)})
+        if self.fail_next > 0:
+            self.fail_next -= 1
+            return web.Response(status=self.fail_status)
+        if self.stall_next > 0:
+            self.stall_next -= 1
+            await asyncio.sleep(3600)
+        if request.path != "/mobile/accounts/sign_in" and request.headers.get("X-ApiKey") not in self.api_keys:
+            # expired or unknown session, the real API redirects to the login page
+            if self.expired_status != 302:
+                return web.Response(status=self.expired_status)
+            raise web.HTTPFound("/login")
+        return await handler(request)
+
+    # login and house endpoints
+
+    async def sign_in(self, _request):
+        api_key = f"fake-api-key-{len(self.api_keys) + 1}-{self.rng.getrandbits(32):08x}"
+        self.api_keys.add(api_key)
+        return web.json_response({"success": True, "error": None, "result": {"mobile_id": 1, "api_key": api_key}})
+
+    async def session(self, _request):
+        data = {"id": self.house_id, "name": self.house_json["result"].get("name", "Fake House")}
+        return web.json_response({"success": True, "result": {"_links": {"child": [{"data": data}]}}})
+
+    async def house(self, _request):
+        self._churn()
+        return web.json_response(self.house_json)
+
+    async def thermostat(self, request):
+        thermostat = self.thermostats.get(request.match_info["thermostat_id"])
+        if thermostat is None:
+            raise web.HTTPNotFound()
+        return web.json_response({"success": True, "result": thermostat})
+
+    # write endpoints
+
+    async def thermostat_write(self, request):
+        if self.reject_writes:
+            raise web.HTTPInternalServerError()
+        thermostat = self.thermostats.get(request.match_info["thermostat_id"])
+        if thermostat is None:
+            raise web.HTTPNotFound()
+        payload = await request.json()
+        end_point = request.match_info["end_point"]
+        for setting in thermostat.get("settings", []):
+            if setting["type"] == end_point:
+                value = payload.get("value")
+                if isinstance(setting["current_value"], float) and isinstance(value, str):
+                    value = float(value)        # nexia posts humidity setpoints as strings, Nexia keeps numbers
+                setting["current_value"] = value
+        return web.json_response({"success": True, "result": thermostat})
+
+    async def zone_write(self, request):
+        if self.reject_writes:
+            raise web.HTTPInternalServerError()
+        entry = self.zones.get(request.match_info["zone_id"])
+        if entry is None:
+            raise web.HTTPNotFound()
+        _thermostat, zone = entry
+        payload = await request.json()
+        end_point = request.match_info["end_point"]
+        if end_point == "setpoints":
+            zone["setpoints"] = {"heat": payload["heat"], "cool": payload["cool"]}
+            zone["heating_setpoint"] = payload["heat"]
+            zone["cooling_setpoint"] = payload["cool"]
+        elif end_point == "zone_mode":
+            zone["current_zone_mode"] = payload["value"]
+            for feature in zone.get("features", []):
+                if feature["name"] == "thermostat_mode":
+                    feature["value"] = payload["value"]
+            self._set_zone_setting(zone, "zone_mode", payload["value"])
+        elif end_point in ("preset_selected", "run_mode"):
+            self._set_zone_setting(zone, end_point, payload["value"])
+        elif end_point == "return_to_schedule":
+            self._set_zone_setting(zone, "run_mode", "run_schedule")
+        return web.json_response({"success": True, "result": zone})
+
+    @staticmethod
+    def _set_zone_setting(zone, setting_type, value):
+        for setting in zone.get("settings", []):
+            if setting["type"] == setting_type:
+                setting["current_value"] = value
+
+    def _churn(self):
+        if not self.churn or not self.zones:
+            return
+        for thermostat, zone in self.rng.sample(list(self.zones.values()), max(1, int(len(self.zones) * self.churn))):
+            zone["temperature"] = zone.get("temperature", 70) + self.rng.choice([-1, 1])
+            zone["operating_state"] = self.rng.choice(["", "Damper Open"])
+            thermostat["system_status"] = "Cooling" if zone["operating_state"] else "System Idle"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake Nexia API server")
+    parser.add_argument("--house", help="recorded house JSON to serve instead of a synthetic house")
+    parser.add_argument("--thermostats", type=int, default=2)
+    parser.add_argument("--zones", type=int, default=3, help="zones per thermostat")
+    parser.add_argument("--churn", type=float, default=0.1)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--port", type=int, default=8099)
+    args = parser.parse_args()
+
+    if args.house:
+        server = FakeNexiaServer.from_file(args.house, churn=args.churn, latency=args.latency)
+    else:
+        server = FakeNexiaServer(synthetic_house(1, args.thermostats, args.zones), churn=args.churn, latency=args.latency)
+
+    async def run():
+        url = await server.start(port=args.port)
+        print(f"Fake Nexia API listening on {url}")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
+
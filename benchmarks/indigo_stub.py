@@ -0,0 +1,141 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Minimal stand-in for the Indigo 'indigo' module, just enough to load plugin.py and run its update
+and action paths outside of the Indigo server.  Devices record every updateStatesOnServer() call so
+the benchmark can count state pushes.
+"""
+import sys
+import types
+import logging
+import tempfile
+
+THREADDEBUG = 5
+logging.addLevelName(THREADDEBUG, "THREADDEBUG")
+
+
+def _threaddebug(self, msg, *args, **kwargs):
+    if self.isEnabledFor(THREADDEBUG):
+        self._log(THREADDEBUG, msg, args, **kwargs)
+
+
+logging.Logger.threaddebug = _threaddebug
+
+
+class _Enum:
+    def __init__(self, *names):
+        for value, name in enumerate(names):
+            setattr(self, name, value)
+
+
+class Dict(dict):
+    pass
+
+
+class Device:
+
+    def __init__(self, dev_id, name, deviceTypeId, pluginProps):
+        self.id = dev_id
+        self.name = name
+        self.deviceTypeId = deviceTypeId
+        self.pluginProps = Dict(pluginProps)
+        self.states = {}
+        self.push_calls = 0
+        self.push_keys = 0
+
+    @property
+    def heatSetpoint(self):
+        return self.states.get("setpointHeat", 68)
+
+    @property
+    def coolSetpoint(self):
+        return self.states.get("setpointCool", 74)
+
+    def updateStatesOnServer(self, update_list):
+        self.push_calls += 1
+        self.push_keys += len(update_list)
+        for item in update_list:
+            self.states[item['key']] = item['value']
+
+    def updateStateOnServer(self, key, value, **_kwargs):
+        self.updateStatesOnServer([{'key': key, 'value': value}])
+
+    def stateListOrDisplayStateIdChanged(self):
+        pass
+
+    def replacePluginPropsOnServer(self, props):
+        self.pluginProps = Dict(props)
+
+
+class DeviceList(dict):
+
+    def iter(self, _filter=None):
+        return iter(list(self.values()))
+
+    def add(self, device):
+        self[device.id] = device
+        return device
+
+
+class PluginBase:
+
+    def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
+        self.pluginId = pluginId
+        self.pluginDisplayName = pluginDisplayName
+        self.pluginVersion = pluginVersion
+        self.pluginPrefs = pluginPrefs
+        self.logger = logging.getLogger("Plugin")
+        self.indigo_log_handler = logging.StreamHandler()
+        self.plugin_file_handler = logging.StreamHandler()
+        self.logger.handlers.clear()       # plugins may be created more than once in a process
+        self.logger.addHandler(self.indigo_log_handler)
+        self.stopThread = False
+
+    def deviceDeleted(self, dev):
+        self.deviceStopComm(dev)
+
+
+class _Server:
+
+    def __init__(self):
+        self.install_folder = tempfile.mkdtemp(prefix="indigo_stub_")
+
+    def getInstallFolderPath(self):
+        return self.install_folder
+
+    def log(self, message, **_kwargs):
+        logging.getLogger("Indigo").info(message)
+
+
+class _Trigger:
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, trigger):
+        self.executed.append(trigger)
+
+
+def install():
+    """Register the stub as the 'indigo' module and return it."""
+    module = sys.modules.get("indigo")
+    if module is not None:
+        return module
+
+    module = types.ModuleType("indigo")
+    module.PluginBase = PluginBase
+    module.Dict = Dict
+    module.List = list
+    module.Device = Device
+    module.devices = DeviceList()
+    module.triggers = DeviceList()
+    module.server = _Server()
+    module.trigger = _Trigger()
+    module.kHvacMode = _Enum("Off", "Heat", "Cool", "HeatCool", "ProgramHeat", "ProgramCool", "ProgramHeatCool")
+    module.kFanMode = _Enum("Auto", "AlwaysOn")
+    module.kThermostatAction = _Enum("SetHvacMode", "SetFanMode", "SetCoolSetpoint", "SetHeatSetpoint",
+                                     "DecreaseCoolSetpoint", "IncreaseCoolSetpoint", "DecreaseHeatSetpoint", "IncreaseHeatSetpoint",
+                                     "RequestStatusAll", "RequestMode", "RequestEquipmentState", "RequestTemperatures",
+                                     "RequestHumidities", "RequestDeadbands", "RequestSetpoints")
+    sys.modules["indigo"] = module
+    return module
@@ -0,0 +1,82 @@
+# The plugin's modules live in the bundle, not in a package.  plugin.py imports indigo, the tests that load it
+# use the stub module from the benchmarks folder, installed before any test module is collected.
+import asyncio
+import logging
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PLUGIN_DIR = os.path.join(ROOT, "Trane Home.indigoPlugin", "Contents", "Server Plugin")
+BENCHMARKS_DIR = os.path.join(ROOT, "benchmarks")
+for folder in (PLUGIN_DIR, BENCHMARKS_DIR):
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
+
+import indigo_stub  # noqa: E402
+
+indigo_stub.install()
+
+
+@pytest.fixture
+def indigo():
+    module = indigo_stub.install()
+    module.devices.clear()
+    module.trigger.executed.clear()
+    return module
+
+
+@pytest.fixture
+def plugin(indigo):
+    # A Plugin that hasn't started.  Its event loop is run by the test instead of by the plugin's thread.
+    import plugin as plugin_module
+    instance = plugin_module.Plugin("com.example.trane", "Trane Home", "test", {"username": "", "password": "", "updateFrequency": "15"})
+    instance.event_loop = asyncio.new_event_loop()
+    instance.wake_event = asyncio.Event()
+    yield instance
+    instance.event_loop.close()
+    logging.getLogger(None).removeHandler(instance.indigo_log_handler)
+
+
+@pytest.fixture
+def settle(plugin):
+    # runs the plugin's event loop until what's scheduled in the next 'seconds' is done
+    def run(seconds=0.0):
+        plugin.event_loop.run_until_complete(asyncio.sleep(seconds))
+        plugin.event_loop.run_until_complete(asyncio.sleep(0))
+    return run
+
+
+class FakeZone:
+    # Records the zone calls a command makes.  Calls named in 'failing' raise.
+    def __init__(self, zone_id=1, failing=()):
+        self.zone_id = zone_id
+        self.failing = failing
+        self.calls = []
+
+    def round_temp(self, temperature):
+        return round(temperature)
+
+    def __getattr__(self, name):
+        if not name.startswith("set_") and not name.startswith("call_"):
+            raise AttributeError(name)
+
+        async def call(*args):
+            self.calls.append((name,) + args)
+            if name in self.failing:
+                raise RuntimeError(f"{name} rejected")
+        return call
+
+
+class FakeThermostat:
+    def __init__(self, thermostat_id=1):
+        self.thermostat_id = thermostat_id
+
+
+@pytest.fixture
+def zone_device(indigo, plugin):
+    # a zone device whose Nexia objects are a FakeZone and a FakeThermostat
+    device = indigo.devices.add(indigo.Device(10, "Zone", "NexiaZone", {"nexia_thermostat": "1", "nexia_zone": "1"}))
+    plugin.device_index[device.id] = {'device': device, 'account': plugin.device_account(device), 'thermostat': FakeThermostat(), 'zone': FakeZone()}
+    return device
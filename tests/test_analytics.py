@@ -0,0 +1,132 @@
+import datetime
+
+import pytest
+
+from analytics import DAYS, HOURS, MAX_GAP, MIN_SEEN, RuntimeAnalytics, Series
+
+HOUR = 3600.0
+DAY = 24 * HOUR
+
+
+def midnight(year, month, day):
+    # local midnight, the day buckets follow the local date
+    return datetime.datetime(year, month, day).timestamp()
+
+
+BASE = midnight(2026, 3, 10) + 3 * HOUR
+BASE -= BASE % HOUR         # a whole hour around 3 am, clear of the day boundary in any time zone
+
+
+def test_interval_is_split_at_the_hour():
+    series = Series()
+    series.add(BASE + 1800.0, BASE + 5400.0, 1.0)
+    assert series.hour_on[series.hour % HOURS] == 1800.0
+    assert series.hour_on[(series.hour - 1) % HOURS] == 1800.0
+    assert series.on_24h == series.seen_24h == 3600.0
+    assert series.mean_24h() == 1.0
+
+
+def test_mean_needs_min_seen():
+    series = Series()
+    series.add(BASE, BASE + MIN_SEEN - 1.0, 1.0)
+    assert series.mean_24h() is None
+    series.add(BASE + MIN_SEEN - 1.0, BASE + MIN_SEEN, 0.0)
+    assert series.mean_24h() == pytest.approx((MIN_SEEN - 1.0) / MIN_SEEN)
+
+
+def test_hours_fall_out_of_the_24_hour_window():
+    series = Series()
+    series.add(BASE, BASE + HOUR, 1.0)
+    series.add(BASE + HOUR, BASE + 2 * HOUR, 0.0)
+    series.advance(BASE + 24 * HOUR)        # the first hour has expired, the second is still in the window
+    assert series.on_24h == 0.0
+    assert series.seen_24h == HOUR
+    series.advance(BASE + 60 * HOUR)        # a long gap clears every bucket
+    assert series.seen_24h == 0.0
+    assert sum(series.hour_seen) == 0.0
+
+
+def test_running_sums_match_the_buckets():
+    series = Series()
+    ts = BASE
+    for step in range(200):
+        series.add(ts, ts + 917.0, step % 3 / 2.0)
+        ts += 917.0
+    assert series.on_24h == pytest.approx(sum(series.hour_on))
+    assert series.seen_24h == pytest.approx(sum(series.hour_seen))
+    assert series.seen_24h == pytest.approx(ts - (ts // HOUR - (HOURS - 1)) * HOUR)     # 23 full hours and the current one
+
+
+def test_interval_is_split_at_local_midnight():
+    series = Series()
+    night = midnight(2026, 3, 11)
+    series.add(night - 1800.0, night + 600.0, 1.0)
+    assert series.day_total(0) == 600.0
+    assert series.day_total(1) == 1800.0
+    assert series.day_total(2) is None
+    assert series.week_total() == 2400.0
+
+
+def test_days_fall_out_of_the_week():
+    series = Series()
+    series.add(BASE, BASE + HOUR, 1.0)
+    series.add(BASE + (DAYS - 1) * DAY, BASE + (DAYS - 1) * DAY + 60.0, 1.0)
+    assert series.day_total(DAYS - 1) == HOUR
+    series.add(BASE + DAYS * DAY, BASE + DAYS * DAY + 60.0, 1.0)
+    assert series.day_total(DAYS - 1) is None
+    assert series.week_total() == 120.0
+    assert series.day_mean(0) == 1.0
+
+
+def test_series_round_trip():
+    series = Series()
+    series.add(BASE, BASE + 2 * HOUR, 0.5)
+    copy = Series(series.to_json())
+    assert copy.to_json() == series.to_json()
+    assert (copy.on_24h, copy.seen_24h) == (series.on_24h, series.seen_24h)
+
+
+def test_record_holds_each_value_until_the_next_poll():
+    analytics = RuntimeAnalytics(None)
+    analytics.record(1, {'compressor': 1.0}, ts=BASE)
+    analytics.record(1, {'compressor': 0.0}, ts=BASE + 600.0)
+    analytics.record(1, {'compressor': 1.0}, ts=BASE + 900.0)
+    assert analytics.series(1, 'compressor').day_total(0) == 600.0
+    analytics.record(1, {'compressor': 1.0}, ts=BASE + 900.0 + MAX_GAP + 1.0)     # a gap isn't counted
+    assert analytics.series(1, 'compressor').day_total(0) == 600.0
+
+
+def test_save_load_and_forget(tmp_path):
+    path = str(tmp_path / "analytics.json")
+    analytics = RuntimeAnalytics(path)
+    now = datetime.datetime.now().timestamp()
+    analytics.record(1, {'calling': 1.0}, ts=now - 600.0)
+    analytics.record(1, {'calling': 0.0}, ts=now)
+    analytics.record(2, {'calling': 1.0}, ts=now)
+    analytics.save(analytics.to_json())
+
+    loaded = RuntimeAnalytics(path)
+    loaded.load()
+    assert sorted(loaded.devices) == [1, 2]
+    assert loaded.zone_states(1) == analytics.zone_states(1)
+
+    loaded.forget(2)
+    loaded.save(loaded.to_json())
+    reloaded = RuntimeAnalytics(path)
+    reloaded.load()
+    assert sorted(reloaded.devices) == [1]
+    assert not (tmp_path / "analytics.json.tmp").exists()
+
+
+def test_max_gap_follows_the_poll_interval():
+    # polls 45 minutes apart, longer than the default MAX_GAP, with the plugin updating every 45 minutes
+    poll = 45 * 60.0
+    analytics = RuntimeAnalytics(None, max_gap=2 * poll)
+    default = RuntimeAnalytics(None)
+    for n in range(9):
+        analytics.record(1, {'compressor': 1.0}, ts=BASE + n * poll)
+        default.record(1, {'compressor': 1.0}, ts=BASE + n * poll)
+    assert analytics.series(1, 'compressor').day_total(0) == 8 * poll
+    assert default.series(1, 'compressor').day_total(0) is None
+    analytics.record(1, {'compressor': 1.0}, ts=BASE + 8 * poll + 2 * poll + 1.0)    # missed updates
+    assert analytics.series(1, 'compressor').day_total(0) == 8 * poll
@@ -0,0 +1,61 @@
+import os
+
+import capture
+from capture import CaptureWriter, capture_files, read_capture
+
+
+def house(n):
+    return {"result": {"id": n, "name": f"Home {n}", "_links": {"child": []}}}
+
+
+def records(folder):
+    return [record for name in capture_files(folder) for record in read_capture(os.path.join(folder, name))]
+
+
+def test_snapshots_are_read_back_in_order(tmp_path):
+    writer = CaptureWriter(str(tmp_path))
+    for n in range(5):
+        writer.write(1, house(n), ts=1000.0 + n)
+    writer.close()
+    assert records(str(tmp_path)) == [{"ts": 1000.0 + n, "account": 1, "house_json": house(n)} for n in range(5)]
+    assert writer.records == 5
+
+
+def test_file_being_written_can_be_read(tmp_path):
+    writer = CaptureWriter(str(tmp_path))
+    writer.write(1, house(1), ts=1000.0)
+    writer.write(2, house(2), ts=1001.0)
+    assert [record["account"] for record in records(str(tmp_path))] == [1, 2]
+    writer.close()
+
+
+def test_record_cut_off_ends_the_file(tmp_path):
+    writer = CaptureWriter(str(tmp_path))
+    writer.write(1, house(1), ts=1000.0)
+    size = writer.raw.tell()
+    writer.write(1, house(2), ts=1001.0)
+    path = writer.path
+    writer.close()
+    with open(path, "r+b") as f:
+        f.truncate(size + 10)
+    assert [record["house_json"] for record in read_capture(path)] == [house(1)]
+
+
+def test_full_files_are_rotated_and_the_oldest_pruned(tmp_path, monkeypatch):
+    # a second apart, so every file gets its own name
+    clock = iter(range(1700000000, 1700001000))
+    monkeypatch.setattr(capture.time, "time", lambda: float(next(clock)))
+    folder = str(tmp_path)
+    writer = CaptureWriter(folder, file_size=1)
+    writer.write(1, house(0), ts=1000.0)
+    file_size = os.path.getsize(writer.path)
+    writer.max_bytes = 5 * file_size + file_size // 2
+    for n in range(1, 20):
+        writer.write(1, house(n), ts=1000.0 + n)
+    writer.close()
+    assert len(capture_files(folder)) == 5
+    assert [record["house_json"] for record in records(folder)] == [house(n) for n in range(15, 20)]
+
+
+def test_missing_folder_has_no_files(tmp_path):
+    assert capture_files(str(tmp_path / "missing")) == []
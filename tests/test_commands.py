@@ -0,0 +1,69 @@
+import logging
+
+from conftest import FakeThermostat, FakeZone
+from plugin import PREFS_ACCOUNT, Command
+
+
+def failed(plugin):
+    return plugin.command_counts[PREFS_ACCOUNT]['failed']
+
+
+def test_command_states_are_kept_when_it_succeeds(indigo, plugin, settle, zone_device):
+    plugin.push_states(zone_device, [{'key': "zone_preset", 'value': "Home"}])
+    plugin.send_command(Command('zone', 'set_preset', ("Away",)), zone_device, {'zone_preset': "Away"})
+    settle()
+    assert plugin.device_index[zone_device.id]['zone'].calls == [("set_preset", "Away")]
+    assert zone_device.states["zone_preset"] == "Away"
+    assert plugin.commands == {}
+    assert plugin.unconfirmed == {zone_device.id: {'zone_preset': "Away"}}
+    assert plugin.command_counts[PREFS_ACCOUNT] == {'outstanding': 0, 'failed': 0}
+    assert plugin.refresh_thermostats == {(PREFS_ACCOUNT, 1)}
+
+
+def test_failed_command_is_rolled_back(indigo, plugin, settle, zone_device):
+    plugin.device_index[zone_device.id]['zone'] = FakeZone(failing=("set_preset",))
+    plugin.push_states(zone_device, [{'key': "zone_preset", 'value': "Home"}])
+    plugin.send_command(Command('zone', 'set_preset', ("Away",)), zone_device, {'zone_preset': "Away"})
+    settle()
+    assert zone_device.states["zone_preset"] == "Home"
+    assert zone_device.push_calls == 3
+    assert plugin.unconfirmed == {}
+    assert failed(plugin) == 1
+
+
+def test_rollback_keeps_states_of_a_later_command(indigo, plugin, zone_device):
+    plugin.push_states(zone_device, [{'key': "setpointHeat", 'value': 68}])
+    plugin._command_sent(1, "set_heat_cool_temp", zone_device, {'setpointHeat': 70})
+    plugin._command_sent(2, "set_heat_cool_temp", zone_device, {'setpointHeat': 72})
+    plugin.rollback_command(plugin.commands.pop(1))
+    assert zone_device.states["setpointHeat"] == 72
+
+
+def test_fetch_keeps_states_of_commands_in_progress(indigo, plugin, zone_device):
+    plugin._command_sent(1, "set_preset", zone_device, {'zone_preset': "Away"})
+    fetched = [{'key': "zone_preset", 'value': "Home"}, {'key': "setpointHeat", 'value': 68}]
+    assert plugin.reconcile_states(zone_device, fetched) == [{'key': "setpointHeat", 'value': 68}]
+
+
+def test_fetch_not_matching_a_finished_command_is_reported(indigo, plugin, zone_device, caplog):
+    plugin.unconfirmed[zone_device.id] = {'setpointHeat': 70, 'zone_preset': "Away"}
+    fetched = [{'key': "setpointHeat", 'value': 68}, {'key': "zone_preset", 'value': "Away"}]
+    with caplog.at_level(logging.WARNING):
+        assert plugin.reconcile_states(zone_device, fetched) == fetched
+    assert "setpointHeat is 68 after the command, not 70" in caplog.text
+    assert failed(plugin) == 1
+    assert plugin.unconfirmed == {}
+
+
+def test_setpoints_are_compared_as_the_zone_rounds_them(indigo, plugin, zone_device):
+    plugin.unconfirmed[zone_device.id] = {'setpointHeat': 70.4, 'setpointCool': 75.6}
+    plugin.reconcile_states(zone_device, [{'key': "setpointHeat", 'value': 70}, {'key': "setpointCool", 'value': 76}])
+    assert plugin.command_counts == {}
+
+
+def test_fractions_are_compared_with_a_tolerance(indigo, plugin):
+    device = indigo.devices.add(indigo.Device(5, "Thermostat", "NexiaThermostat", {"nexia_thermostat": "1"}))
+    plugin.device_index[device.id] = {'device': device, 'account': PREFS_ACCOUNT, 'thermostat': FakeThermostat(), 'zone': None}
+    plugin.unconfirmed[device.id] = {'dehumidify_setpoint': 45 / 100.0}
+    plugin.reconcile_states(device, [{'key': "dehumidify_setpoint", 'value': 0.45000000000000007}])
+    assert plugin.command_counts == {}
@@ -0,0 +1,112 @@
+from types import SimpleNamespace
+
+from events import THERMOSTAT_WATCHED, ZONE_WATCHED, ChangeDetector
+
+
+class Zone:
+    def __init__(self, calling=False, heat=68, cool=74):
+        self.calling = calling
+        self.heat = heat
+        self.cool = cool
+
+    def is_calling(self):
+        return self.calling
+
+    def get_heating_setpoint(self):
+        return self.heat
+
+    def get_cooling_setpoint(self):
+        return self.cool
+
+
+class Thermostat:
+    def __init__(self, status="System Idle", online=True):
+        self.status = status
+        self.online = online
+
+    def get_system_status(self):
+        if self.status is None:
+            raise KeyError("system_status")
+        return self.status
+
+    @property
+    def is_online(self):
+        return self.online
+
+
+def trigger(trigger_id, event_type, **props):
+    return SimpleNamespace(id=trigger_id, name=f"Trigger {trigger_id}", pluginTypeId=event_type, pluginProps=props)
+
+
+def test_first_fetch_only_records_values():
+    detector = ChangeDetector()
+    assert detector.changes(10, ZONE_WATCHED, None, Zone()) == {}
+    assert detector.changes(10, ZONE_WATCHED, None, Zone()) == {}
+
+
+def test_only_changed_values_are_reported():
+    detector = ChangeDetector()
+    detector.changes(10, ZONE_WATCHED, None, Zone())
+    assert detector.changes(10, ZONE_WATCHED, None, Zone(calling=True, heat=70)) == {'calling': (False, True), 'setpointHeat': (68, 70)}
+    assert detector.changes(10, ZONE_WATCHED, None, Zone(calling=True, heat=70)) == {}
+
+
+def test_devices_are_compared_with_their_own_previous_fetch():
+    detector = ChangeDetector()
+    detector.changes(10, ZONE_WATCHED, None, Zone())
+    detector.changes(11, ZONE_WATCHED, None, Zone(heat=60))
+    assert detector.changes(10, ZONE_WATCHED, None, Zone(heat=60)) == {'setpointHeat': (68, 60)}
+
+
+def test_missing_values_are_none():
+    detector = ChangeDetector()
+    detector.changes(5, THERMOSTAT_WATCHED, Thermostat())
+    assert detector.changes(5, THERMOSTAT_WATCHED, Thermostat(status=None, online=False)) == {'system_status': ("System Idle", None), 'online': (True, False)}
+
+
+def test_forgotten_device_starts_over():
+    detector = ChangeDetector()
+    detector.changes(10, ZONE_WATCHED, None, Zone())
+    detector.forget(10)
+    assert detector.changes(10, ZONE_WATCHED, None, Zone(heat=70)) == {}
+
+
+def test_triggers_match_the_event_values(indigo, plugin):
+    zone_device = indigo.devices.add(indigo.Device(10, "Zone", "NexiaZone", {}))
+    started = trigger(1, "zoneCalling", deviceId="0", calling="started")
+    stopped = trigger(2, "zoneCalling", deviceId="10", calling="stopped")
+    other_zone = trigger(3, "zoneCalling", deviceId="11", calling="any")
+    for each in (started, stopped, other_zone):
+        plugin.triggerStartProcessing(each)
+    plugin.fire_events(zone_device, {'calling': (False, True)})
+    plugin.fire_events(zone_device, {'calling': (True, False)})
+    assert indigo.trigger.executed == [started, stopped]
+
+
+def test_setpoint_trigger_fires_once_for_both_setpoints(indigo, plugin):
+    zone_device = indigo.devices.add(indigo.Device(10, "Zone", "NexiaZone", {}))
+    heat = trigger(1, "setpointChanged", setpoint="heat")
+    plugin.triggerStartProcessing(heat)
+    plugin.fire_events(zone_device, {'setpointHeat': (68, 70), 'setpointCool': (74, 76)})
+    assert indigo.trigger.executed == [heat]
+
+
+def test_setpoints_changed_by_a_command_are_not_external(indigo, plugin):
+    zone_device = indigo.devices.add(indigo.Device(10, "Zone", "NexiaZone", {}))
+    plugin.triggerStartProcessing(trigger(1, "setpointChanged", setpoint="any"))
+    plugin.unconfirmed[zone_device.id] = {'setpointHeat': 70}
+    plugin.fire_events(zone_device, {'setpointHeat': (68, 70)})
+    plugin.unconfirmed.clear()
+    plugin._command_sent(1, "set_heat_cool_temp", zone_device, {'setpointHeat': 72})
+    plugin.fire_events(zone_device, {'setpointHeat': (70, 72)})
+    assert indigo.trigger.executed == []
+
+
+def test_triggers_stop_when_removed(indigo, plugin):
+    thermostat_device = indigo.devices.add(indigo.Device(5, "Thermostat", "NexiaThermostat", {}))
+    offline = trigger(1, "thermostatConnection", connection="offline")
+    plugin.triggerStartProcessing(offline)
+    plugin.fire_events(thermostat_device, {'online': (True, False)})
+    plugin.triggerStopProcessing(offline)
+    plugin.fire_events(thermostat_device, {'online': (True, False)})
+    assert indigo.trigger.executed == [offline]
@@ -0,0 +1,41 @@
+def states(*pairs):
+    return [{'key': key, 'value': value} for key, value in pairs]
+
+
+def test_only_changed_states_are_pushed(indigo, plugin):
+    device = indigo.devices.add(indigo.Device(10, "Zone", "NexiaZone", {}))
+    plugin.push_states(device, states(("setpointHeat", 68), ("setpointCool", 74)))
+    plugin.push_states(device, states(("setpointHeat", 68), ("setpointCool", 74)))
+    plugin.push_states(device, states(("setpointHeat", 69), ("setpointCool", 74)))
+    assert (device.push_calls, device.push_keys) == (2, 3)
+    assert device.states == {"setpointHeat": 69, "setpointCool": 74}
+    assert (plugin.states_pushed, plugin.states_skipped) == (3, 3)
+
+
+def test_failed_push_is_sent_again(indigo, plugin):
+    device = indigo.devices.add(indigo.Device(10, "Zone", "NexiaZone", {}))
+    update = device.updateStatesOnServer
+
+    def fail(_update_list):
+        raise RuntimeError("server busy")
+    device.updateStatesOnServer = fail
+    plugin.push_states(device, states(("setpointHeat", 68)))
+    device.updateStatesOnServer = update
+    plugin.push_states(device, states(("setpointHeat", 68)))
+    assert device.states == {"setpointHeat": 68}
+
+
+def test_restarted_device_gets_every_state(indigo, plugin):
+    device = indigo.devices.add(indigo.Device(1, "Account", "NexiaAccount", {}))
+    plugin.push_states(device, states(("home_name", "Home")))
+    plugin.device_started(device)
+    plugin.push_states(device, states(("home_name", "Home")))
+    assert device.push_calls == 2
+
+
+def test_caches_are_per_device(indigo, plugin):
+    first = indigo.devices.add(indigo.Device(10, "Zone 1", "NexiaZone", {}))
+    second = indigo.devices.add(indigo.Device(11, "Zone 2", "NexiaZone", {}))
+    plugin.push_states(first, states(("setpointHeat", 68)))
+    plugin.push_states(second, states(("setpointHeat", 68)))
+    assert (first.push_keys, second.push_keys) == (1, 1)
@@ -0,0 +1,167 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from aiohttp import ClientConnectionError, ClientResponseError
+
+import scheduler
+from metrics import Metrics
+from scheduler import BACKGROUND, INTERACTIVE, RequestScheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def response_error(status, headers=None):
+    return ClientResponseError(None, (), status=status, headers=headers)
+
+
+def calls(*outcomes):
+    # a factory returning each outcome in turn, raising the exceptions, and the list of calls made
+    made = []
+
+    def factory():
+        async def call():
+            made.append(len(made))
+            outcome = outcomes[len(made) - 1]
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        return call()
+    return factory, made
+
+
+def test_tokens_refill_at_rate_up_to_burst():
+    clock = Clock()
+    with mock.patch.object(scheduler.time, "monotonic", clock):
+        requests = RequestScheduler(Metrics(), rate=2.0, burst=3)
+        assert [requests.take_token() for _ in range(4)] == [True, True, True, False]
+        clock.now += 0.5
+        assert [requests.take_token() for _ in range(2)] == [True, False]
+        clock.now += 60.0
+        assert [requests.take_token() for _ in range(4)] == [True, True, True, False]
+
+
+def test_no_tokens_while_paused():
+    clock = Clock()
+    with mock.patch.object(scheduler.time, "monotonic", clock):
+        requests = RequestScheduler(Metrics(), rate=2.0, burst=3)
+        requests.paused_until = clock.now + 5.0
+        assert not requests.take_token()
+        clock.now += 5.0
+        assert requests.take_token()
+
+
+def test_interactive_calls_get_tokens_first():
+    async def run():
+        requests = RequestScheduler(Metrics(), rate=50.0, burst=1)
+        assert requests.take_token()        # the bucket is empty, every call below has to wait
+        order = []
+
+        async def acquire(lane, name):
+            await requests.acquire(lane)
+            order.append(name)
+        tasks = [asyncio.create_task(acquire(BACKGROUND, f"background {n}")) for n in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(acquire(INTERACTIVE, "interactive")))
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["interactive", "background 0", "background 1", "background 2"]
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        requests = RequestScheduler(Metrics(), rate=50.0, burst=1)
+        requests.take_token()
+        waiter = asyncio.create_task(requests.acquire(BACKGROUND))
+        await asyncio.sleep(0)
+        assert requests.queue_depth(BACKGROUND) == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert requests.queue_depth(BACKGROUND) == 0
+        await asyncio.wait_for(requests.acquire(INTERACTIVE), 1.0)
+
+    asyncio.run(run())
+
+
+def test_throttled_call_pauses_and_is_tried_again():
+    async def run():
+        metrics = Metrics()
+        requests = RequestScheduler(metrics)
+        factory, made = calls(response_error(429, {"Retry-After": "0.05"}), "ok")
+        assert await requests.run(BACKGROUND, factory) == "ok"
+        assert len(made) == 2
+        assert requests.paused_until > 0.0
+        assert requests.backoff == 0.0          # reset by the call that succeeded
+        assert metrics.counters[("scheduler_throttled_total", (("status", "429"),))] == 1
+
+    asyncio.run(run())
+
+
+def test_throttle_backoff_doubles_without_retry_after():
+    requests = RequestScheduler(Metrics())
+    for expected in (scheduler.BACKOFF_INITIAL, scheduler.BACKOFF_INITIAL * 2.0, scheduler.BACKOFF_INITIAL * 4.0):
+        requests.throttled(response_error(503), "call")
+        assert requests.backoff == expected
+    requests.backoff = scheduler.BACKOFF_MAX
+    requests.throttled(response_error(503), "call")
+    assert requests.backoff == scheduler.BACKOFF_MAX
+
+
+@mock.patch.object(scheduler, "RETRY_INITIAL", 0.001)
+def test_connection_errors_are_retried_then_raised():
+    async def run():
+        metrics = Metrics()
+        requests = RequestScheduler(metrics)
+        factory, made = calls(ClientConnectionError(), response_error(502), "ok")
+        assert await requests.run(BACKGROUND, factory) == "ok"
+        assert len(made) == 3
+
+        factory, made = calls(*[asyncio.TimeoutError()] * (scheduler.RETRIES + 1))
+        with pytest.raises(asyncio.TimeoutError):
+            await requests.run(BACKGROUND, factory)
+        assert len(made) == scheduler.RETRIES + 1
+
+    asyncio.run(run())
+
+
+def test_other_errors_are_not_retried():
+    async def run():
+        requests = RequestScheduler(Metrics())
+        factory, made = calls(response_error(400), "ok")
+        with pytest.raises(ClientResponseError):
+            await requests.run(BACKGROUND, factory)
+        assert len(made) == 1
+
+    asyncio.run(run())
+
+
+def test_expired_session_logs_in_again_once():
+    async def run():
+        requests = RequestScheduler(Metrics())
+        relogins = []
+
+        async def relogin():
+            relogins.append(True)
+
+        factory, made = calls(response_error(401), "ok")
+        assert await requests.run(INTERACTIVE, factory, relogin=relogin) == "ok"
+        assert len(relogins) == 1
+
+        factory, made = calls(response_error(401), response_error(403))
+        with pytest.raises(ClientResponseError):
+            await requests.run(INTERACTIVE, factory, relogin=relogin)
+        assert len(relogins) == 2 and len(made) == 2
+
+        factory, made = calls(response_error(401))
+        with pytest.raises(ClientResponseError):
+            await requests.run(INTERACTIVE, factory)       # without relogin the error is raised
+        assert len(relogins) == 2
+
+    asyncio.run(run())
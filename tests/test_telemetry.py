@@ -0,0 +1,91 @@
+import sqlite3
+import time
+
+import pytest
+
+from telemetry import RAW_RETENTION, ROLLUP_PERIOD, ROLLUP_RETENTION, RingBuffer, TelemetryRecorder
+
+
+@pytest.fixture
+def recorder(tmp_path):
+    return TelemetryRecorder(str(tmp_path / "telemetry.sqlite"))
+
+
+def rows(recorder, table):
+    db = sqlite3.connect(recorder.db_path)
+    try:
+        return db.execute(f"SELECT * FROM {table} ORDER BY 1, 2, 3").fetchall()
+    finally:
+        db.close()
+
+
+def test_ring_buffer_returns_unflushed_samples():
+    buffer = RingBuffer(size=4)
+    for n in range(3):
+        buffer.append(float(n), n * 10.0)
+    assert buffer.unflushed() == ([(0.0, 0.0), (1.0, 10.0), (2.0, 20.0)], 0)
+    buffer.flushed = buffer.written
+    buffer.append(3.0, 30.0)
+    assert buffer.unflushed() == ([(3.0, 30.0)], 0)
+
+
+def test_ring_buffer_counts_overwritten_samples():
+    buffer = RingBuffer(size=4)
+    for n in range(6):
+        buffer.append(float(n), float(n))
+    samples, dropped = buffer.unflushed()
+    assert samples == [(2.0, 2.0), (3.0, 3.0), (4.0, 4.0), (5.0, 5.0)]
+    assert dropped == 2
+
+
+def test_record_skips_values_that_are_not_numbers(recorder):
+    recorder.record(1, {'temperature': 70, 'hvacMode': "HEAT", 'humidity': None, 'calling': True}, ts=time.time())
+    assert sorted(recorder.buffers) == [(1, 'calling'), (1, 'temperature')]
+
+
+def test_flush_writes_samples_and_rollups_once(recorder):
+    bucket = time.time() // ROLLUP_PERIOD * ROLLUP_PERIOD
+    for offset, value in ((1.0, 70.0), (2.0, 72.0), (3.0, 68.0)):
+        recorder.record(1, {'temperature': value}, ts=bucket + offset)
+    assert recorder.flush() == 3
+    assert recorder.flush() == 0
+    assert len(rows(recorder, "samples")) == 3
+    assert rows(recorder, "rollups") == [(1, 'temperature', bucket, 3, 68.0, 72.0, 210.0)]
+
+    recorder.record(1, {'temperature': 75.0}, ts=bucket + 4.0)
+    assert recorder.flush() == 1
+    assert rows(recorder, "rollups") == [(1, 'temperature', bucket, 4, 68.0, 75.0, 285.0)]
+
+
+def test_query_combines_flushed_and_unflushed_samples(recorder):
+    now = time.time()
+    recorder.record(1, {'temperature': 70.0}, ts=now - 120.0)
+    recorder.flush()
+    recorder.record(1, {'temperature': 74.0}, ts=now - 60.0)
+    recorder.record(1, {'temperature': 60.0}, ts=now - 7200.0)     # outside the window
+    assert recorder.query(1, 'temperature', 3600.0) == {'count': 2, 'min': 70.0, 'max': 74.0, 'avg': 72.0}
+    assert recorder.query(1, 'humidity', 3600.0) is None
+    assert recorder.query(2, 'temperature', 3600.0) is None
+
+
+def test_old_samples_are_kept_only_as_rollups(recorder):
+    now = time.time()
+    old = now - RAW_RETENTION - 4 * ROLLUP_PERIOD
+    old -= old % ROLLUP_PERIOD
+    recorder.record(1, {'temperature': 60.0}, ts=old + 1.0)
+    recorder.record(1, {'temperature': 64.0}, ts=old + 2.0)
+    recorder.record(1, {'temperature': 70.0}, ts=now - 60.0)
+    recorder.flush()
+
+    assert [row[2] for row in rows(recorder, "samples")] == [now - 60.0]
+    assert len(rows(recorder, "rollups")) == 2
+    assert recorder.query(1, 'temperature', 3600.0) == {'count': 1, 'min': 70.0, 'max': 70.0, 'avg': 70.0}
+    assert recorder.query(1, 'temperature', RAW_RETENTION + 8 * ROLLUP_PERIOD) == {'count': 3, 'min': 60.0, 'max': 70.0, 'avg': 194.0 / 3}
+
+
+def test_rollups_expire(recorder):
+    recorder.record(1, {'temperature': 60.0}, ts=time.time() - ROLLUP_RETENTION - 2 * ROLLUP_PERIOD)
+    recorder.flush()
+    assert rows(recorder, "samples") == []
+    assert rows(recorder, "rollups") == []
+    assert recorder.query(1, 'temperature', ROLLUP_RETENTION + 4 * ROLLUP_PERIOD) is None
@@ -0,0 +1,62 @@
+import pytest
+
+import plugin as plugin_module
+
+
+@pytest.fixture(autouse=True)
+def short_window(monkeypatch):
+    monkeypatch.setattr(plugin_module, "WRITE_COALESCE_WINDOW", 0.01)
+
+
+def zone_calls(plugin, device):
+    return plugin.device_index[device.id]['zone'].calls
+
+
+def test_writes_within_the_window_are_merged(indigo, plugin, settle, zone_device):
+    for heat in (69, 70, 71):
+        plugin.queue_zone_write(zone_device, heat=heat)
+    plugin.queue_zone_write(zone_device, cool=76)
+    settle(0.05)
+    assert zone_calls(plugin, zone_device) == [("set_heat_cool_temp", 71, 76)]
+    assert plugin.writes_merged == 3
+    assert zone_device.states == {"setpointHeat": 71, "setpointCool": 76}
+    assert plugin.zone_writes == {}
+
+
+def test_mode_and_preset_are_sent_before_setpoints(indigo, plugin, settle, zone_device):
+    plugin.queue_zone_write(zone_device, heat=70)
+    plugin.queue_zone_write(zone_device, mode="HEAT")
+    settle(0.05)
+    assert zone_calls(plugin, zone_device) == [("set_mode", "HEAT"), ("set_heat_cool_temp", 70, None)]
+    assert zone_device.states["hvacOperationMode"] == indigo.kHvacMode.Heat
+
+
+def test_preset_replaces_earlier_setpoints(indigo, plugin, settle, zone_device):
+    plugin.queue_zone_write(zone_device, heat=70)
+    plugin.queue_zone_write(zone_device, preset="Away")
+    settle(0.05)
+    assert zone_calls(plugin, zone_device) == [("set_preset", "Away")]
+
+
+def test_writes_after_the_flush_start_a_new_write(indigo, plugin, settle, zone_device):
+    plugin.queue_zone_write(zone_device, heat=70)
+    settle(0.05)
+    plugin.queue_zone_write(zone_device, heat=72)
+    settle(0.05)
+    assert zone_calls(plugin, zone_device) == [("set_heat_cool_temp", 70, None), ("set_heat_cool_temp", 72, None)]
+    assert plugin.writes_merged == 0
+
+
+def test_relative_changes_build_on_queued_values(indigo, plugin, settle, zone_device):
+    plugin.queue_zone_write(zone_device, heat=70)
+    assert plugin.pending_zone_value(zone_device, 'heat', 68) == 70
+    assert plugin.pending_zone_value(zone_device, 'cool', 74) == 74
+    settle(0.05)
+    assert plugin.pending_zone_value(zone_device, 'heat', 68) == 68
+
+
+def test_unknown_mode_is_not_queued(indigo, plugin, settle, zone_device):
+    plugin.queue_zone_write(zone_device, mode="EMERGENCY HEAT")
+    settle(0.05)
+    assert plugin.zone_writes == {}
+    assert zone_calls(plugin, zone_device) == []